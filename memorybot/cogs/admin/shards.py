@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import logging
+
+from discord import app_commands, Interaction
+from discord.ext import commands
+
+from memorybot.core.checks import is_owner_check
+from memorybot.db.session import session
+from memorybot.db.shards import ShardSet, get_shards
+
+
+class ShardAdmin(commands.GroupCog, group_name="shards", group_description="Inspect and rebalance database shards"):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.log = logging.getLogger("memorybot.cog.shards")
+
+    async def _shards(self, interaction: Interaction) -> ShardSet | None:
+        shards = get_shards()
+        if shards is None:
+            await interaction.response.send_message("Sharded storage is not enabled (DB_SHARDS=0).", ephemeral=True)
+        return shards
+
+    async def _exclusive_shards(self, interaction: Interaction) -> ShardSet | None:
+        shards = await self._shards(interaction)
+        if shards is not None and shards.lanes > 1:
+            await interaction.response.send_message(
+                "Shard layout changes need exclusive access; run them from a single bot process, not a cluster or queued workers.", ephemeral=True
+            )
+            return None
+        return shards
+
+    @app_commands.command(name="status", description="Rows, scopes and file size per shard")
+    @is_owner_check()
+    async def status(self, interaction: Interaction):
+        shards = await self._shards(interaction)
+        if shards is None:
+            return
+        await interaction.response.defer(ephemeral=True)
+        lines = [
+            f"shard {s['shard']}: rows={s['rows']} scopes={s['scopes']} pinned={s['pinned']} size={s['bytes'] / 1024 / 1024:.1f}MiB"
+            for s in await shards.stats()
+        ]
+        await interaction.followup.send("\n".join(lines), ephemeral=True)
+
+    @app_commands.command(name="split", description="Add a shard and move the scopes that now hash to it")
+    @is_owner_check()
+    async def split(self, interaction: Interaction):
+        shards = await self._exclusive_shards(interaction)
+        if shards is None:
+            return
+        await interaction.response.defer(ephemeral=True)
+        index, moved = await shards.split()
+        self.log.info("split by=%s shard=%d rows=%d", interaction.user.id, index, moved)
+        await interaction.followup.send(f"Added shard {index}; moved {moved} rows.", ephemeral=True)
+
+    @app_commands.command(name="move", description="Pin a guild (or DM channel) to a shard and move its rows")
+    @app_commands.describe(scope_id="Guild id, or channel id with dm=true", shard="Target shard index", dm="Treat scope_id as a DM channel id")
+    @is_owner_check()
+    async def move(self, interaction: Interaction, scope_id: str, shard: int, dm: bool = False):
+        shards = await self._exclusive_shards(interaction)
+        if shards is None:
+            return
+        try:
+            target_id = int(scope_id)
+        except ValueError:
+            await interaction.response.send_message("scope_id must be a numeric id.", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True)
+        try:
+            moved = await (shards.move(None, target_id, shard) if dm else shards.move(target_id, None, shard))
+        except ValueError as e:
+            await interaction.followup.send(str(e), ephemeral=True)
+            return
+        self.log.info("move by=%s scope=%s dm=%s shard=%d rows=%d", interaction.user.id, target_id, dm, shard, moved)
+        await interaction.followup.send(f"Moved {moved} rows to shard {shard}.", ephemeral=True)
+
+    @app_commands.command(name="rebalance", description="Move the largest fitting scopes from the fullest to the emptiest shard")
+    @app_commands.describe(max_moves="Upper bound on scopes moved")
+    @is_owner_check()
+    async def rebalance(self, interaction: Interaction, max_moves: app_commands.Range[int, 1, 100] = 5):
+        shards = await self._exclusive_shards(interaction)
+        if shards is None:
+            return
+        await interaction.response.defer(ephemeral=True)
+        plan = await shards.rebalance(max_moves=max_moves)
+        self.log.info("rebalance by=%s moves=%d", interaction.user.id, len(plan))
+        if not plan:
+            await interaction.followup.send("Shards are already balanced.", ephemeral=True)
+            return
+        lines = [f"{key}: shard {source} -> {target} ({rows} rows)" for key, source, target, rows in plan]
+        await interaction.followup.send("\n".join(lines), ephemeral=True)
+
+    @app_commands.command(name="import", description="Move rows left in the main database into the shards")
+    @is_owner_check()
+    async def absorb(self, interaction: Interaction):
+        shards = await self._exclusive_shards(interaction)
+        if shards is None:
+            return
+        await interaction.response.defer(ephemeral=True)
+        moved = await shards.absorb(session)
+        self.log.info("import by=%s rows=%d", interaction.user.id, moved)
+        await interaction.followup.send(f"Imported {moved} rows into {len(shards.shards)} shards.", ephemeral=True)
+
+
+async def setup(bot: commands.Bot) -> None:
+    await bot.add_cog(ShardAdmin(bot))
@@ -2,32 +2,90 @@ from __future__ import annotations
 
 import logging
 import re
+from typing import Optional
 
 import discord
 from discord.ext import commands
 
-from memorybot.services.openai_chat import OpenAIChatService
-from memorybot.db.repository import ConversationRepository
-from memorybot.utils.message_payload import build_message_json, build_server_info
-from memorybot.schemas.tools import tavily_tool_schema, tavily_tool_instructions
-from memorybot.prompt.system_prompt import build_system_prompt
-import json
-from memorybot.services.tooling import ToolExecutor
+from memorybot.db.work_queue import get_work_queue, partition_key
+from memorybot.services.mention_pipeline import DiscordSink, MentionPipeline
+from memorybot.services.reply_dispatcher import ReplyDispatcher
+from memorybot.services.scheduler import MentionScheduler
+from memorybot.services.memory import get_memory
+from memorybot.services.summarizer import get_summarizer
+from memorybot.utils.message_payload import build_server_info
+from memorybot.core.logging import reset_request_id, set_request_id
+from memorybot.core.tracing import trace
+from memorybot.core.metrics import QUEUE_SIZE, REGISTRY
 
 
 class MentionResponder(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.log = logging.getLogger("memorybot.cog.mention")
-        self.ai = OpenAIChatService(getattr(bot, "settings"))
-        self.repo = ConversationRepository()
-        self.tools = ToolExecutor(getattr(bot, "settings"))
+        settings = getattr(bot, "settings")
+        self.queue = get_work_queue() if settings.mention_mode == "queue" else None
+        if settings.mention_mode == "queue" and self.queue is None:
+            raise RuntimeError("MENTION_MODE=queue requires an open work queue")
+        self.pipeline: Optional[MentionPipeline] = MentionPipeline(settings, logger=self.log) if self.queue is None else None
+        self.dispatcher: Optional[ReplyDispatcher] = None
+        if self.queue is not None:
+            self.dispatcher = ReplyDispatcher(
+                bot,
+                self.queue,
+                concurrency=settings.reply_concurrency,
+                poll_interval=settings.work_queue_poll_ms / 1000,
+            )
+        self.scheduler: MentionScheduler[tuple[discord.Message, str]] = MentionScheduler(
+            self._respond,
+            debounce=settings.mention_debounce_ms / 1000,
+            max_batch=settings.mention_max_batch,
+            max_concurrency=settings.llm_max_concurrency,
+            max_pending=settings.mention_max_pending,
+            logger=self.log,
+        )
+        REGISTRY.add_collector("mention", self._collect_metrics)
+
+    async def cog_load(self) -> None:
+        if self.pipeline is not None:
+            await self.pipeline.start()
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+
+    def _collect_metrics(self) -> None:
+        scheduler = self.scheduler.stats()
+        QUEUE_SIZE.set(scheduler["pending"], queue="mentions")
+        QUEUE_SIZE.set(scheduler["active"], queue="mentions_active")
+        if self.pipeline is not None:
+            self.pipeline.collect_metrics()
 
     def cog_unload(self) -> None:
+        REGISTRY.remove_collector("mention")
+        self.scheduler.close()
+        if self.pipeline is not None:
+            memory = get_memory()
+            summarizer = get_summarizer()
+            self.log.info(
+                "%s; scheduler %s; memory %s; summaries %s",
+                self.pipeline.describe(),
+                self.scheduler.stats(),
+                memory.stats() if memory is not None else None,
+                summarizer.stats() if summarizer is not None else None,
+            )
+        else:
+            self.log.info(
+                "scheduler %s; work queue %s; replies %s",
+                self.scheduler.stats(),
+                self.queue.stats() if self.queue is not None else None,
+                self.dispatcher.stats() if self.dispatcher is not None else None,
+            )
         try:
             loop = getattr(self.bot, "loop", None)
             if loop and loop.is_running():
-                loop.create_task(self.ai.aclose())
+                if self.pipeline is not None:
+                    loop.create_task(self.pipeline.aclose())
+                if self.dispatcher is not None:
+                    loop.create_task(self.dispatcher.close())
         except Exception:
             pass
 
@@ -39,78 +97,63 @@ class MentionResponder(commands.Cog):
             return
         if self.bot.user not in message.mentions:
             return
+        cleaned = self._strip_bot_mentions(message.content, self.bot.user.id).strip()
+        if not cleaned:
+            return
+        token = set_request_id(str(message.id))
         try:
-            cleaned = self._strip_bot_mentions(message.content, self.bot.user.id).strip()
-            if not cleaned:
-                return
-            name = self.bot.user.display_name or self.bot.user.name
-            server_info = build_server_info(message.guild)
-            system_prompt = build_system_prompt(
-                bot_name=name,
-                server_info=server_info,
-                tool_schemas=[tavily_tool_schema()],
-                tool_instructions=[tavily_tool_instructions()],
-            )
-            await self.repo.add_message(
-                guild_id=getattr(message.guild, "id", None),
-                channel_id=message.channel.id,
-                user_id=message.author.id,
-                role="user",
-                content=build_message_json(message, cleaned),
-            )
-            gid = getattr(message.guild, "id", None)
-            if gid is not None:
-                history = await self.repo.get_recent_messages_by_guild(guild_id=gid, limit=20)
+            self.scheduler.submit(message.channel.id, (message, cleaned))
+        finally:
+            reset_request_id(token)
+
+    async def _respond(self, batch: list[tuple[discord.Message, str]]) -> None:
+        message = batch[-1][0]
+        with trace(
+            "mention",
+            str(message.id),
+            guild=getattr(message.guild, "id", None),
+            channel=message.channel.id,
+            batch=len(batch),
+        ):
+            if self.queue is not None:
+                await self._enqueue(batch)
             else:
-                history = await self.repo.get_recent_messages(channel_id=message.channel.id, limit=20)
-            mapped = [{"role": m.role, "content": m.content} for m in history]
-            current_payload = build_message_json(message, cleaned)
-            parsed = await self.ai.chat(current_payload, system_prompt=system_prompt, history=mapped)
-            if not parsed or not getattr(parsed, "message", None) or not getattr(parsed.message, "content", None):
-                return
-            assistant_payload = json.dumps(parsed.model_dump(), indent=2, ensure_ascii=False)
-            await self.repo.add_message(
-                guild_id=getattr(message.guild, "id", None),
-                channel_id=message.channel.id,
-                user_id=self.bot.user.id,
-                role="assistant",
-                content=assistant_payload,
-            )
+                await self._handle(batch)
+
+    async def _handle(self, batch: list[tuple[discord.Message, str]]) -> None:
+        if not self.bot.user or self.pipeline is None:
+            return
+        message = batch[-1][0]
+        job = MentionPipeline.build_job(batch, self.bot.user)
+        try:
+            await self.pipeline.run(job, DiscordSink(message), server_info=lambda: build_server_info(message.guild))
+        except Exception:
+            pass
 
-            initial_msg = await message.reply(parsed.message.content, mention_author=False)
-
-            if getattr(parsed, "tool", None):
-                tool_result = await self.tools.execute(parsed.tool)
-                tool_content = self.tools.serialize_result(tool_result)
-                await self.repo.add_message(
-                    guild_id=getattr(message.guild, "id", None),
-                    channel_id=message.channel.id,
-                    user_id=self.bot.user.id,
-                    role="tool",
-                    content=tool_content,
-                )
-                history = await (
-                    self.repo.get_recent_messages_by_guild(guild_id=gid, limit=22)
-                    if gid is not None
-                    else self.repo.get_recent_messages(channel_id=message.channel.id, limit=22)
-                )
-                mapped = [{"role": m.role, "content": m.content} for m in history]
-                followup = await self.ai.chat(current_payload, system_prompt=system_prompt, history=mapped)
-                if followup and getattr(followup, "message", None) and getattr(followup.message, "content", None):
-                    await self.repo.add_message(
-                        guild_id=getattr(message.guild, "id", None),
-                        channel_id=message.channel.id,
-                        user_id=self.bot.user.id,
-                        role="assistant",
-                        content=json.dumps(followup.model_dump(), indent=2, ensure_ascii=False),
-                    )
-                    try:
-                        await initial_msg.reply(followup.message.content, mention_author=False)
-                    except Exception:
-                        pass
-            self.log.debug("responded to mention guild=%s channel=%s author=%s", getattr(message.guild, "id", None), message.channel.id, message.author.id)
+    async def _enqueue(self, batch: list[tuple[discord.Message, str]]) -> None:
+        if not self.bot.user or self.queue is None:
+            return
+        job = MentionPipeline.build_job(batch, self.bot.user, server_info=True)
+        try:
+            await self.queue.put(
+                "mentions",
+                str(job.channel_id),
+                job.model_dump(),
+                part=partition_key(job.guild_id, job.channel_id),
+                key=f"mention:{job.items[-1].message_id}",
+            )
         except Exception:
-            self.log.error("mention handler error", exc_info=True)
+            self.log.error("failed to enqueue mention guild=%s channel=%s batch=%d", job.guild_id, job.channel_id, len(batch), exc_info=True)
+
+    @commands.Cog.listener()
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild) -> None:
+        if self.pipeline is not None:
+            self.pipeline.prompts.invalidate(after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        if self.pipeline is not None:
+            self.pipeline.prompts.invalidate(guild.id)
 
     def _strip_bot_mentions(self, text: str, bot_id: int) -> str:
         patterns = [rf"<@{bot_id}>", rf"<@!{bot_id}>"]
@@ -2,28 +2,64 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Iterable
+from typing import Any, Iterable
 
 import discord
 from discord.ext import commands
 
+from .cluster import get_cluster
 from .config import Settings
 from .loader import discover_extensions, load_extensions
 from .logging import set_request_id, reset_request_id
 
 
+def build_intents(profile: str) -> discord.Intents:
+    if profile == "full":
+        return discord.Intents.all()
+    if profile == "standard":
+        intents = discord.Intents.default()
+    else:
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = True
+        intents.dm_messages = True
+    intents.message_content = True
+    return intents
+
+
+def gateway_options(intents_profile: str, member_cache: str, max_messages: int, chunk_guilds: bool) -> dict[str, Any]:
+    intents = build_intents(intents_profile)
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents) if member_cache == "auto" else discord.MemberCacheFlags.none(),
+        "max_messages": max_messages or None,
+        "chunk_guilds_at_startup": chunk_guilds and intents.members,
+    }
+
+
 class MemoryBot(commands.Bot):
-    def __init__(self, settings: Settings):
-        intents = discord.Intents.all()
+    def __init__(self, settings: Settings, **kwargs: Any):
+        options = gateway_options(settings.intents, settings.member_cache, settings.max_messages, settings.chunk_guilds)
         super().__init__(
             command_prefix=commands.when_mentioned_or(",,"),
-            intents=intents,
             application_id=settings.application_id,
+            **options,
+            **kwargs,
         )
         self.settings = settings
         self.owner_ids: set[int] = set(settings.owner_ids)
         self.log = logging.getLogger("memorybot")
         self.synced = asyncio.Event()
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.on_socket_event_type = self._log_socket_event
+        self.log.debug(
+            "gateway intents=%s value=%d member_cache=%s max_messages=%s chunk_guilds=%s",
+            settings.intents,
+            options["intents"].value,
+            settings.member_cache,
+            options["max_messages"],
+            options["chunk_guilds_at_startup"],
+        )
 
     async def setup_hook(self) -> None:
         self.log.debug("setup_hook begin")
@@ -36,7 +72,9 @@ class MemoryBot(commands.Bot):
             self.log.warning("%d extensions failed to load", len(failed))
             self.log.debug("extensions failed: %s", ", ".join(m for m, _ in failed))
         await self._populate_owner_ids()
-        await self.sync_app_commands(mode="global")
+        cluster = get_cluster()
+        if cluster is None or cluster.primary:
+            await self.sync_app_commands(mode="global")
         self.synced.set()
         self.tree.on_error = self.on_app_command_error
         self.log.debug("setup_hook complete")
@@ -149,7 +187,7 @@ class MemoryBot(commands.Bot):
         finally:
             reset_request_id(token)
 
-    async def on_socket_event_type(self, event_type: str) -> None:
+    async def _log_socket_event(self, event_type: str) -> None:
         self.log.debug("socket event type=%s", event_type)
 
     async def close(self) -> None:  # type: ignore[override]
@@ -163,3 +201,17 @@ class MemoryBot(commands.Bot):
         except Exception:
             pass
         await super().close()
+
+
+class ShardedMemoryBot(MemoryBot, commands.AutoShardedBot):
+    def __init__(self, settings: Settings):
+        super().__init__(settings, shard_count=settings.shard_count, shard_ids=settings.shard_ids or None)
+
+    async def on_shard_ready(self, shard_id: int) -> None:
+        self.log.info("shard %d ready", shard_id)
+
+    async def on_shard_disconnect(self, shard_id: int) -> None:
+        self.log.warning("shard %d disconnect", shard_id)
+
+    async def on_shard_resumed(self, shard_id: int) -> None:
+        self.log.info("shard %d resumed", shard_id)
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import time
+from typing import Any, Optional, Sequence
+
+import discord
+from dotenv import load_dotenv
+
+from .config import Settings, load_settings
+from .logging import configure_logging, stop_logging
+
+
+_IDENTIFY_WINDOW = 5.0
+
+
+class ClusterInfo:
+    def __init__(self, cluster_id: int, cluster_count: int, shard_ids: Sequence[int], shard_count: int):
+        if not shard_ids:
+            raise ValueError("a cluster needs at least one shard id")
+        if any(not 0 <= s < shard_count for s in shard_ids):
+            raise ValueError(f"shard ids must be in [0, {shard_count})")
+        if not 0 <= cluster_id < cluster_count:
+            raise ValueError(f"cluster id must be in [0, {cluster_count})")
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
+        self.shard_ids = sorted(set(shard_ids))
+        self.shard_count = shard_count
+        self._owned = frozenset(self.shard_ids)
+
+    @property
+    def primary(self) -> bool:
+        return self.cluster_id == 0
+
+    @property
+    def layout(self) -> str:
+        return f"shards-{self.shard_ids[0]}-{self.shard_ids[-1]}-of-{self.shard_count}"
+
+    def shard_for(self, guild_id: Optional[int]) -> int:
+        return 0 if guild_id is None else (guild_id >> 22) % self.shard_count
+
+    def owns(self, guild_id: Optional[int], channel_id: Optional[int] = None) -> bool:
+        return self.shard_for(guild_id) in self._owned
+
+    def __repr__(self) -> str:
+        return f"ClusterInfo({self.cluster_id}/{self.cluster_count}, {self.layout})"
+
+
+def shard_ranges(shard_count: int, processes: int) -> list[list[int]]:
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges: list[list[int]] = []
+    start = 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+_cluster: Optional[ClusterInfo] = None
+
+
+def configure_cluster(settings: Settings) -> Optional[ClusterInfo]:
+    global _cluster
+    if not settings.shard_ids:
+        _cluster = None
+        return None
+    if settings.shard_count is None:
+        raise ValueError("DISCORD_SHARD_IDS requires DISCORD_SHARD_COUNT")
+    _cluster = ClusterInfo(settings.cluster_id, settings.cluster_count, settings.shard_ids, settings.shard_count)
+    return _cluster
+
+
+def get_cluster() -> Optional[ClusterInfo]:
+    return _cluster
+
+
+async def recommended_shards(token: str) -> tuple[int, int]:
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shards, _, limits = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return int(shards), max(1, int(limits.get("max_concurrency", 1)))
+
+
+class ChildProcess:
+    def __init__(self, index: int, label: str, env: dict[str, str], *, stagger: float = 0.0):
+        self.index = index
+        self.label = label
+        self.env = env
+        self.stagger = stagger
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.started = 0.0
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+
+class ProcessSupervisor:
+    def __init__(
+        self,
+        kind: str,
+        children: Sequence[ChildProcess],
+        *,
+        health_interval: float = 60.0,
+        shutdown_timeout: float = 30.0,
+        restart_backoff: float = 5.0,
+        command: Optional[Sequence[str]] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.kind = kind
+        self.children = list(children)
+        self._health_interval = max(1.0, float(health_interval))
+        self._shutdown_timeout = max(0.0, float(shutdown_timeout))
+        self._restart_backoff = max(0.1, float(restart_backoff))
+        self._command = list(command or (sys.executable, "-m", "memorybot"))
+        self._stopping = asyncio.Event()
+        self._exit_code = 0
+        self._log = logger or logging.getLogger(f"memorybot.{kind}")
+
+    def _env(self, child: ChildProcess) -> dict[str, str]:
+        env = dict(os.environ)
+        env.update(child.env)
+        return env
+
+    async def _spawn(self, child: ChildProcess) -> None:
+        child.proc = await asyncio.create_subprocess_exec(*self._command, env=self._env(child))
+        child.started = time.monotonic()
+        self._log.info("%s %d started pid=%d %s", self.kind, child.index, child.proc.pid, child.label)
+
+    async def _sleep(self, seconds: float) -> bool:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _supervise(self, child: ChildProcess) -> None:
+        backoff = self._restart_backoff
+        while not self._stopping.is_set():
+            await self._spawn(child)
+            assert child.proc is not None
+            if self._stopping.is_set():
+                child.proc.send_signal(signal.SIGTERM)
+            code = await child.proc.wait()
+            if self._stopping.is_set():
+                break
+            uptime = time.monotonic() - child.started
+            if code == 2:
+                self._log.error("%s %d exited with a configuration error; stopping all %ss", self.kind, child.index, self.kind)
+                self._exit_code = 2
+                self.stop()
+                break
+            if uptime > 60.0:
+                backoff = self._restart_backoff
+            child.restarts += 1
+            self._log.error("%s %d exited code=%s after %.0fs; restarting in %.1fs", self.kind, child.index, code, uptime, backoff)
+            if await self._sleep(backoff):
+                break
+            backoff = min(backoff * 2, 60.0)
+
+    async def _report(self) -> None:
+        while not await self._sleep(self._health_interval):
+            now = time.monotonic()
+            self._log.info(
+                "%s status %s",
+                self.kind,
+                " ".join(
+                    f"{self.kind[0]}{c.index}[{c.label} pid={c.proc.pid if c.alive else '-'} "
+                    f"up={int(now - c.started) if c.alive else 0}s restarts={c.restarts}]"
+                    for c in self.children
+                ),
+            )
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def _terminate(self) -> None:
+        alive = [c for c in self.children if c.alive]
+        for c in alive:
+            assert c.proc is not None
+            try:
+                c.proc.send_signal(signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if not alive:
+            return
+        waits = {asyncio.ensure_future(c.proc.wait()): c for c in alive if c.proc is not None}
+        done, pending = await asyncio.wait(waits, timeout=self._shutdown_timeout or None)
+        for fut in pending:
+            c = waits[fut]
+            self._log.warning("%s %d did not stop within %.0fs; killing pid=%d", self.kind, c.index, self._shutdown_timeout, c.proc.pid)
+            try:
+                c.proc.kill()
+            except ProcessLookupError:
+                pass
+        if pending:
+            await asyncio.wait(pending)
+        for fut, c in waits.items():
+            self._log.info("%s %d stopped code=%s", self.kind, c.index, fut.result())
+
+    def install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (getattr(signal, "SIGINT", None), getattr(signal, "SIGTERM", None)):
+            if sig is None:
+                continue
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                pass
+
+    async def run(self) -> int:
+        tasks: list[asyncio.Task] = []
+        reporter = asyncio.create_task(self._report(), name=f"memorybot-{self.kind}-status")
+        try:
+            for child in self.children:
+                tasks.append(asyncio.create_task(self._supervise(child), name=f"memorybot-{self.kind}-{child.index}"))
+                if child is not self.children[-1] and child.stagger and await self._sleep(child.stagger):
+                    break
+            await self._stopping.wait()
+        finally:
+            self._stopping.set()
+            await self._terminate()
+            reporter.cancel()
+            await asyncio.gather(reporter, *tasks, return_exceptions=True)
+        return self._exit_code
+
+
+class ClusterLauncher(ProcessSupervisor):
+    def __init__(self, shard_count: int, processes: int, *, max_concurrency: int = 1, **options: Any):
+        self.shard_count = shard_count
+        self._max_concurrency = max(1, int(max_concurrency))
+        ranges = shard_ranges(shard_count, processes)
+        children = [
+            ChildProcess(
+                i,
+                f"shards={r[0]}-{r[-1]}",
+                {
+                    "DISCORD_SHARD_COUNT": str(shard_count),
+                    "DISCORD_SHARD_IDS": json.dumps(r),
+                    "DISCORD_CLUSTER_ID": str(i),
+                    "DISCORD_CLUSTER_COUNT": str(len(ranges)),
+                },
+                stagger=math.ceil(len(r) / self._max_concurrency) * _IDENTIFY_WINDOW,
+            )
+            for i, r in enumerate(ranges)
+        ]
+        super().__init__("cluster", children, **options)
+
+    async def run(self) -> int:
+        self._log.info(
+            "launching %d clusters for %d shards (max_concurrency=%d)", len(self.children), self.shard_count, self._max_concurrency
+        )
+        return await super().run()
+
+
+async def start_cluster() -> int:
+    load_dotenv()
+    settings = load_settings()
+    configure_logging(
+        settings.log_level,
+        settings.log_format,
+        settings.log_datefmt,
+        json_output=settings.log_json,
+        queued=settings.log_queue,
+    )
+    log = logging.getLogger("memorybot.cluster")
+    try:
+        max_concurrency = 1
+        shard_count = settings.shard_count
+        if shard_count is None:
+            try:
+                shard_count, max_concurrency = await recommended_shards(settings.token)
+            except discord.HTTPException as e:
+                log.error("failed to fetch the recommended shard count: %s", e)
+                return 2
+        launcher = ClusterLauncher(
+            shard_count,
+            settings.cluster_processes or os.cpu_count() or 1,
+            max_concurrency=max_concurrency,
+            health_interval=settings.cluster_health_interval_ms / 1000,
+            shutdown_timeout=settings.cluster_shutdown_timeout_ms / 1000,
+        )
+        launcher.install_signal_handlers()
+        return await launcher.run()
+    finally:
+        stop_logging()
+
+
+def _health(bot: Any) -> dict[str, Any]:
+    latencies = getattr(bot, "latencies", None) or [(0, bot.latency)]
+    shards = getattr(bot, "shards", {}) or {}
+    return {
+        "ready": bot.is_ready(),
+        "guilds": len(bot.guilds),
+        "latency_ms": {sid: (round(lat * 1000) if math.isfinite(lat) else None) for sid, lat in latencies},
+        "closed": sorted(sid for sid, info in shards.items() if info.is_closed()),
+    }
+
+
+async def report_health(bot: Any, cluster: Optional[ClusterInfo], interval: float) -> None:
+    log = logging.getLogger("memorybot.cluster")
+    label = f"{cluster.cluster_id}/{cluster.cluster_count} {cluster.layout}" if cluster is not None else "-"
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            log.info("cluster health cluster=%s %s", label, json.dumps(_health(bot), separators=(",", ":")))
+        except Exception:
+            log.debug("health report failed", exc_info=True)
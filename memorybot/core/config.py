@@ -18,17 +18,113 @@ class Settings(BaseSettings):
     log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
     log_format: str | None = None
     log_datefmt: str | None = None
+    log_json: bool = False
+    log_queue: bool = True
+    intents: Literal["minimal", "standard", "full"] = "minimal"
+    member_cache: Literal["none", "auto"] = "none"
+    max_messages: int = Field(default=0, ge=0)
+    chunk_guilds: bool = False
+    auto_shard: bool = False
+    shard_count: int | None = Field(default=None, ge=1)
+    shard_ids: List[int] = Field(default_factory=list)
+    cluster_id: int = Field(default=0, ge=0)
+    cluster_count: int = Field(default=1, ge=1)
 
     openai_api_key: Optional[str] = Field(default=None, validation_alias="OPENAI_API_KEY")
     openai_base_url: Optional[str] = Field(default=None, validation_alias="OPENAI_BASE_URL")
     openai_api_base: Optional[str] = Field(default=None, validation_alias="OPENAI_API_BASE")
     openai_model: str = Field(default="gpt-4o-2024-08-06", validation_alias="OPENAI_MODEL")
+    openai_rpm: int = Field(default=0, ge=0, validation_alias="OPENAI_RPM")
+    openai_tpm: int = Field(default=0, ge=0, validation_alias="OPENAI_TPM")
+    openai_max_concurrency: int = Field(default=0, ge=0, validation_alias="OPENAI_MAX_CONCURRENCY")
+    openai_max_retries: int = Field(default=4, ge=0, validation_alias="OPENAI_MAX_RETRIES")
+    openai_retry_base_ms: int = Field(default=500, ge=1, validation_alias="OPENAI_RETRY_BASE_MS")
+    openai_retry_max_ms: int = Field(default=30000, ge=1, validation_alias="OPENAI_RETRY_MAX_MS")
+    context_token_budget: int = Field(default=6000, ge=256, validation_alias="CONTEXT_TOKEN_BUDGET")
+    context_history_limit: int = Field(default=50, ge=1, validation_alias="CONTEXT_HISTORY_LIMIT")
+    mention_debounce_ms: int = Field(default=300, ge=0, validation_alias="MENTION_DEBOUNCE_MS")
+    mention_max_batch: int = Field(default=5, ge=1, validation_alias="MENTION_MAX_BATCH")
+    mention_max_pending: int = Field(default=100, ge=1, validation_alias="MENTION_MAX_PENDING")
+    llm_max_concurrency: int = Field(default=8, ge=1, validation_alias="LLM_MAX_CONCURRENCY")
+    stream_replies: bool = Field(default=False, validation_alias="STREAM_REPLIES")
+    stream_edit_interval_ms: int = Field(default=1200, ge=0, validation_alias="STREAM_EDIT_INTERVAL_MS")
+    tool_call_mode: Literal["structured", "native"] = Field(default="structured", validation_alias="TOOL_CALL_MODE")
+    max_tool_rounds: int = Field(default=3, ge=1, validation_alias="MAX_TOOL_ROUNDS")
+    mention_mode: Literal["inline", "queue"] = Field(default="inline", validation_alias="MENTION_MODE")
+    work_queue_path: str = Field(default="./work_queue.db", validation_alias="WORK_QUEUE_PATH")
+    work_queue_lease_ms: int = Field(default=120000, ge=1000, validation_alias="WORK_QUEUE_LEASE_MS")
+    work_queue_max_attempts: int = Field(default=5, ge=1, validation_alias="WORK_QUEUE_MAX_ATTEMPTS")
+    work_queue_poll_ms: int = Field(default=200, ge=10, validation_alias="WORK_QUEUE_POLL_MS")
+    reply_concurrency: int = Field(default=4, ge=1, validation_alias="REPLY_CONCURRENCY")
+    worker_processes: int = Field(default=2, ge=1, validation_alias="WORKER_PROCESSES")
+    worker_index: int = Field(default=0, ge=0, validation_alias="WORKER_INDEX")
 
     database_url: str = Field(default="sqlite+aiosqlite:///./memorybot.db", validation_alias="DATABASE_URL")
+    db_sqlite_tuned: bool = Field(default=True, validation_alias="DB_SQLITE_TUNED")
+    db_read_pool_size: int = Field(default=4, ge=1, validation_alias="DB_READ_POOL_SIZE")
+    db_mmap_mb: int = Field(default=256, ge=0, validation_alias="DB_MMAP_MB")
+    db_cache_mb: int = Field(default=64, ge=1, validation_alias="DB_CACHE_MB")
+    db_busy_timeout_ms: int = Field(default=5000, ge=0, validation_alias="DB_BUSY_TIMEOUT_MS")
+    db_shards: int = Field(default=0, ge=0, le=1024, validation_alias="DB_SHARDS")
+    db_shard_dir: str = Field(default="./shards", validation_alias="DB_SHARD_DIR")
+    db_shard_settle_ms: int = Field(default=2000, ge=0, validation_alias="DB_SHARD_SETTLE_MS")
+    db_write_behind: bool = Field(default=False, validation_alias="DB_WRITE_BEHIND")
+    db_write_batch_size: int = Field(default=64, ge=1, validation_alias="DB_WRITE_BATCH_SIZE")
+    db_write_flush_ms: int = Field(default=10, ge=0, validation_alias="DB_WRITE_FLUSH_MS")
+    history_cache_enabled: bool = Field(default=True, validation_alias="HISTORY_CACHE_ENABLED")
+    history_cache_window: int = Field(default=50, ge=1, validation_alias="HISTORY_CACHE_WINDOW")
+    history_cache_max_scopes: int = Field(default=1000, ge=1, validation_alias="HISTORY_CACHE_MAX_SCOPES")
+    history_cache_max_mb: int = Field(default=64, ge=0, validation_alias="HISTORY_CACHE_MAX_MB")
+    memory_enabled: bool = Field(default=False, validation_alias="MEMORY_ENABLED")
+    memory_index_dir: str = Field(default="./memory_index", validation_alias="MEMORY_INDEX_DIR")
+    memory_batch_size: int = Field(default=64, ge=1, validation_alias="MEMORY_BATCH_SIZE")
+    memory_index_interval_ms: int = Field(default=2000, ge=50, validation_alias="MEMORY_INDEX_INTERVAL_MS")
+    memory_top_k: int = Field(default=5, ge=0, validation_alias="MEMORY_TOP_K")
+    memory_token_budget: int = Field(default=800, ge=0, validation_alias="MEMORY_TOKEN_BUDGET")
+    memory_ivf_min_rows: int = Field(default=100000, ge=1, validation_alias="MEMORY_IVF_MIN_ROWS")
+    memory_nprobe: int = Field(default=8, ge=1, validation_alias="MEMORY_NPROBE")
+    embedding_backend: Literal["openai", "hashing"] = Field(default="openai", validation_alias="EMBEDDING_BACKEND")
+    embedding_model: str = Field(default="text-embedding-3-small", validation_alias="EMBEDDING_MODEL")
+    embedding_dim: int = Field(default=256, ge=8, validation_alias="EMBEDDING_DIM")
+    summary_enabled: bool = Field(default=False, validation_alias="SUMMARY_ENABLED")
+    summary_model: Optional[str] = Field(default=None, validation_alias="SUMMARY_MODEL")
+    summary_segment_size: int = Field(default=40, ge=1, validation_alias="SUMMARY_SEGMENT_SIZE")
+    summary_keep_recent: Optional[int] = Field(default=None, ge=0, validation_alias="SUMMARY_KEEP_RECENT")
+    summary_interval_ms: int = Field(default=30000, ge=50, validation_alias="SUMMARY_INTERVAL_MS")
+    summary_min_call_interval_ms: int = Field(default=2000, ge=0, validation_alias="SUMMARY_MIN_CALL_INTERVAL_MS")
+    summary_max_per_pass: int = Field(default=10, ge=1, validation_alias="SUMMARY_MAX_PER_PASS")
+    summary_max_tokens: int = Field(default=400, ge=32, validation_alias="SUMMARY_MAX_TOKENS")
+    retention_enabled: bool = Field(default=False, validation_alias="RETENTION_ENABLED")
+    retention_max_age_days: Optional[int] = Field(default=None, ge=0, validation_alias="RETENTION_MAX_AGE_DAYS")
+    retention_max_rows: Optional[int] = Field(default=None, ge=0, validation_alias="RETENTION_MAX_ROWS")
+    retention_overrides: str = Field(default="", validation_alias="RETENTION_OVERRIDES")
+    retention_interval_ms: int = Field(default=3600000, ge=1000, validation_alias="RETENTION_INTERVAL_MS")
+    retention_batch_size: int = Field(default=500, ge=1, validation_alias="RETENTION_BATCH_SIZE")
+    retention_batch_pause_ms: int = Field(default=50, ge=0, validation_alias="RETENTION_BATCH_PAUSE_MS")
+    retention_vacuum_pages: int = Field(default=2000, ge=0, validation_alias="RETENTION_VACUUM_PAGES")
+    metrics_enabled: bool = Field(default=False, validation_alias="METRICS_ENABLED")
+    metrics_host: str = Field(default="127.0.0.1", validation_alias="METRICS_HOST")
+    metrics_port: int = Field(default=9108, ge=0, le=65535, validation_alias="METRICS_PORT")
+    trace_enabled: bool = Field(default=True, validation_alias="TRACE_ENABLED")
+    trace_slow_ms: int = Field(default=5000, ge=0, validation_alias="TRACE_SLOW_MS")
+    trace_profile_dir: Optional[str] = Field(default=None, validation_alias="TRACE_PROFILE_DIR")
+    trace_profile_max_files: int = Field(default=20, ge=1, validation_alias="TRACE_PROFILE_MAX_FILES")
+    trace_sample_interval_ms: int = Field(default=0, ge=0, validation_alias="TRACE_SAMPLE_INTERVAL_MS")
 
     tavily_api_key: Optional[str] = Field(default=None, validation_alias="TAVILY_API_KEY")
+    tavily_base_url: Optional[str] = Field(default=None, validation_alias="TAVILY_BASE_URL")
+    tavily_max_connections: int = Field(default=10, ge=1, validation_alias="TAVILY_MAX_CONNECTIONS")
+    tavily_max_keepalive: int = Field(default=5, ge=0, validation_alias="TAVILY_MAX_KEEPALIVE")
+    tavily_keepalive_expiry: float = Field(default=30.0, ge=0, validation_alias="TAVILY_KEEPALIVE_EXPIRY")
+    tool_cache_enabled: bool = Field(default=True, validation_alias="TOOL_CACHE_ENABLED")
+    tool_cache_ttl: float = Field(default=600.0, ge=0, validation_alias="TOOL_CACHE_TTL")
+    tool_cache_max_entries: int = Field(default=512, ge=1, validation_alias="TOOL_CACHE_MAX_ENTRIES")
+    tool_cache_persist: bool = Field(default=False, validation_alias="TOOL_CACHE_PERSIST")
+    cluster_processes: int = Field(default=0, ge=0, validation_alias="CLUSTER_PROCESSES")
+    cluster_health_interval_ms: int = Field(default=60000, ge=1000, validation_alias="CLUSTER_HEALTH_INTERVAL_MS")
+    cluster_shutdown_timeout_ms: int = Field(default=30000, ge=0, validation_alias="CLUSTER_SHUTDOWN_TIMEOUT_MS")
 
-    @field_validator("owner_ids", mode="before")
+    @field_validator("owner_ids", "shard_ids", mode="before")
     @classmethod
     def parse_csv_ints(cls, v):
         if v is None or v == "":
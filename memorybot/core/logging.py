@@ -1,11 +1,17 @@
+import atexit
+import contextvars
+import json
 import logging
 import os
+import queue
 import re
 import sys
-import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, TextIO
 
 
 _request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+_fields: dict[str, Any] = {}
 
 
 class ContextFilter(logging.Filter):
@@ -14,11 +20,13 @@ class ContextFilter(logging.Filter):
             record.request_id = _request_id.get()
         except Exception:
             record.request_id = "-"
+        if _fields:
+            record.__dict__.update(_fields)
         return True
 
 
 class RedactingFormatter(logging.Formatter):
-    _token_re = re.compile(r"[A-Za-z0-9_\-]{20,}\.[A-Za-z0-9_\-]{6,}\.[A-Za-z0-9_\-]{20,}")
+    _token_re = re.compile(r"(?<![A-Za-z0-9_\-])[A-Za-z0-9_\-]{20,}\.[A-Za-z0-9_\-]{6,}\.[A-Za-z0-9_\-]{20,}")
 
     def __init__(self, fmt: str, datefmt: str | None = None):
         super().__init__(fmt=fmt, datefmt=datefmt)
@@ -30,19 +38,70 @@ class RedactingFormatter(logging.Formatter):
     def _redact(self, text: str) -> str:
         s = text
         for secret in self._secrets:
-            if secret:
+            if secret and secret in s:
                 s = s.replace(secret, "[REDACTED]")
-        s = self._token_re.sub("[REDACTED]", s)
+        if s.count(".") >= 2:
+            s = self._token_re.sub("[REDACTED]", s)
         return s
 
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = self._redact(record.message)
+        return super().formatMessage(record)
+
+    def formatException(self, ei: Any) -> str:
+        return self._redact(super().formatException(ei))
+
+    def formatStack(self, stack_info: str) -> str:
+        return self._redact(stack_info)
+
     def format(self, record: logging.LogRecord) -> str:
         try:
             if not hasattr(record, "request_id"):
                 record.request_id = "-"
         except Exception:
             pass
-        rendered = super().format(record)
-        return self._redact(rendered)
+        return super().format(record)
+
+
+_RESERVED = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id", "taskName"}
+
+
+class JsonFormatter(RedactingFormatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data: dict[str, Any] = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "source": f"{record.filename}:{record.lineno}",
+            "request_id": getattr(record, "request_id", "-"),
+            "message": self._redact(record.getMessage()),
+        }
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener: QueueListener | None = None
+
+
+def set_log_fields(**fields: Any) -> None:
+    _fields.clear()
+    _fields.update(fields)
 
 
 def set_request_id(value: str) -> contextvars.Token[str]:
@@ -53,22 +112,61 @@ def reset_request_id(token: contextvars.Token[str]) -> None:
     _request_id.reset(token)
 
 
-def configure_logging(level: str | int = "INFO", fmt: str | None = None, datefmt: str | None = None) -> None:
+def configure_logging(
+    level: str | int = "INFO",
+    fmt: str | None = None,
+    datefmt: str | None = None,
+    *,
+    json_output: bool = False,
+    queued: bool = True,
+    stream: TextIO | None = None,
+) -> None:
+    global _listener
     log_level = level if isinstance(level, int) else getattr(logging, str(level).upper(), logging.INFO)
+    stop_logging()
     root = logging.getLogger()
     for h in list(root.handlers):
         root.removeHandler(h)
-    handler = logging.StreamHandler(sys.stdout)
+    handler = logging.StreamHandler(stream or sys.stdout)
     fmt_value = fmt or os.getenv(
         "LOG_FORMAT",
-        "%(asctime)s | %(levelname)s | %(name)s | %(filename)s:%(lineno)d | %(request_id)s | %(message)s",
+        "%(asctime)s | %(levelname)s | %(name)s | %(filename)s:%(lineno)d | "
+        + "".join(f"{k}=%({k})s | " for k in _fields)
+        + "%(request_id)s | %(message)s",
     )
     datefmt_value = datefmt or os.getenv("LOG_DATEFMT", "%Y-%m-%d %H:%M:%S")
-    formatter = RedactingFormatter(fmt=fmt_value, datefmt=datefmt_value)
+    formatter = (JsonFormatter if json_output else RedactingFormatter)(fmt=fmt_value, datefmt=datefmt_value)
     handler.setFormatter(formatter)
-    handler.addFilter(ContextFilter())
-    root.addHandler(handler)
+    if queued:
+        records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        front: logging.Handler = DeferredQueueHandler(records)
+        _listener = QueueListener(records, handler)
+        _listener.start()
+    else:
+        front = handler
+    front.addFilter(ContextFilter())
+    root.addHandler(front)
     root.setLevel(log_level)
     lib_level = logging.DEBUG if log_level <= logging.DEBUG else logging.WARNING
     for name in ("discord", "discord.http"):
         logging.getLogger(name).setLevel(lib_level)
+
+
+def stop_logging() -> None:
+    global _listener
+    listener = _listener
+    _listener = None
+    if listener is None:
+        return
+    try:
+        listener.stop()
+    except Exception:
+        pass
+    for h in listener.handlers:
+        try:
+            h.flush()
+        except Exception:
+            pass
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict[str, Any]) -> LabelValues:
+        try:
+            key = tuple([labels[n] if type(labels[n]) is str else str(labels[n]) for n in self.labelnames])
+        except KeyError:
+            key = ()
+        if len(key) != len(labels) or len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return key
+
+    def _labels(self, key: LabelValues, extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{self._labels(k)} {_fmt(v)}" for k, v in list(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{self._labels(k)} {_fmt(v)}" for k, v in list(self._values.items())]
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self._series: dict[LabelValues, _Series] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series(len(self.buckets) + 1)
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(self._key(labels))
+        return series.count if series is not None else 0
+
+    def _samples(self) -> list[str]:
+        lines: list[str] = []
+        for key, series in list(self._series.items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), series.counts):
+                cumulative += n
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_fmt(series.sum)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {series.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: dict[str, Callable[[], None]] = {}
+        self._log = logging.getLogger("memorybot.metrics")
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, name: str, collect: Callable[[], None]) -> None:
+        self._collectors[name] = collect
+
+    def remove_collector(self, name: str) -> None:
+        self._collectors.pop(name, None)
+
+    def render(self) -> str:
+        for name, collect in list(self._collectors.items()):
+            try:
+                collect()
+            except Exception:
+                self._log.debug("metrics collector %s failed", name, exc_info=True)
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+MENTION_SECONDS = REGISTRY.register(Histogram("memorybot_mention_seconds", "End-to-end mention handling time"))
+MENTION_STAGE_SECONDS = REGISTRY.register(Histogram("memorybot_mention_stage_seconds", "Time spent per mention pipeline stage", ("stage",)))
+MENTIONS = REGISTRY.register(Counter("memorybot_mentions_total", "Mention batches handled", ("outcome",)))
+DB_SECONDS = REGISTRY.register(Histogram("memorybot_db_seconds", "Conversation store operation time", ("op",)))
+OPENAI_SECONDS = REGISTRY.register(Histogram("memorybot_openai_request_seconds", "OpenAI request time", ("model", "op")))
+OPENAI_TOKENS = REGISTRY.register(Counter("memorybot_openai_tokens_total", "OpenAI tokens used", ("model", "kind")))
+OPENAI_ERRORS = REGISTRY.register(Counter("memorybot_openai_errors_total", "Failed OpenAI requests", ("model", "op")))
+OPENAI_STRUCTURED = REGISTRY.register(
+    Counter("memorybot_openai_structured_total", "Structured replies by how they were decoded", ("result",))
+)
+OPENAI_RETRIES = REGISTRY.register(Counter("memorybot_openai_retries_total", "OpenAI requests retried", ("model", "reason")))
+OPENAI_WAIT_SECONDS = REGISTRY.register(
+    Histogram("memorybot_openai_wait_seconds", "Time OpenAI requests waited for client-side rate limit capacity", ("priority",))
+)
+TOOL_CALLS = REGISTRY.register(Counter("memorybot_tool_calls_total", "Tool calls by result status", ("tool", "status")))
+TOOL_SECONDS = REGISTRY.register(Histogram("memorybot_tool_seconds", "Upstream tool execution time", ("tool",)))
+GATEWAY_LATENCY = REGISTRY.register(Gauge("memorybot_gateway_latency_seconds", "Discord gateway heartbeat latency"))
+QUEUE_SIZE = REGISTRY.register(Gauge("memorybot_queue_size", "Items waiting in internal queues", ("queue",)))
+CACHE_ENTRIES = REGISTRY.register(Gauge("memorybot_cache_entries", "Entries held by in-process caches", ("cache",)))
+CACHE_BYTES = REGISTRY.register(Gauge("memorybot_cache_bytes", "Approximate bytes held by in-process caches", ("cache",)))
+CACHE_LOOKUPS = REGISTRY.register(Counter("memorybot_cache_lookups_total", "Cache lookups by result", ("cache", "result")))
+
+
+class MetricsServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, *, registry: Registry = REGISTRY):
+        self._host = host
+        self._port = port
+        self._registry = registry
+        self._server: Optional[asyncio.Server] = None
+        self._log = logging.getLogger("memorybot.metrics")
+        self.scrapes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None and self._server.is_serving()
+
+    @property
+    def port(self) -> int:
+        if self._server is not None and self._server.sockets:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._server = await asyncio.start_server(self._handle, self._host, self._port)
+        self._log.info("metrics endpoint listening on http://%s:%d/metrics", self._host, self.port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+            if len(parts) >= 2 and parts[0] == "GET" and path in ("/metrics", "/"):
+                body = self._registry.render().encode()
+                status, ctype = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+                self.scrapes += 1
+            else:
+                body, status, ctype = b"not found\n", "404 Not Found", "text/plain"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            self._log.debug("metrics request failed", exc_info=True)
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        server = self._server
+        self._server = None
+        if server is None:
+            return
+        server.close()
+        await server.wait_closed()
+
+
+_server: Optional[MetricsServer] = None
+
+
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9108) -> MetricsServer:
+    global _server
+    if _server is None or not _server.running:
+        _server = MetricsServer(host, port)
+        await _server.start()
+    return _server
+
+
+def get_metrics_server() -> Optional[MetricsServer]:
+    s = _server
+    if s is None or not s.running:
+        return None
+    return s
+
+
+async def stop_metrics_server() -> None:
+    global _server
+    s = _server
+    _server = None
+    if s is None:
+        return
+    await s.close()
@@ -1,17 +1,40 @@
 import asyncio
+import functools
 import logging
+import math
 import os
 import platform
 import signal
 import sys
+from typing import Optional
 
 from dotenv import load_dotenv
 
 from .config import Settings, load_settings
 from memorybot.db.session import init_engine, get_engine, close_engine
 from memorybot.db.repository import ConversationRepository
-from .logging import configure_logging
-from .bot import MemoryBot
+from memorybot.db.writer import get_writer, start_writer, stop_writer
+from memorybot.db.shards import get_shards, init_shards, close_shards
+from memorybot.db.cache import configure_cache, get_cache, clear_cache
+from memorybot.db.work_queue import close_work_queue, init_work_queue
+from memorybot.db.retention import RetentionRule, parse_overrides, rule_for, start_pruner, stop_pruner
+from memorybot.services.memory import start_memory, stop_memory
+from memorybot.services.rate_limiter import get_rate_limiter, start_rate_limiter, stop_rate_limiter
+from memorybot.services.summarizer import get_summarizer, start_summarizer, stop_summarizer
+from .logging import configure_logging, set_log_fields, stop_logging
+from .tracing import start_tracer, stop_tracer
+from .metrics import (
+    CACHE_BYTES,
+    CACHE_ENTRIES,
+    CACHE_LOOKUPS,
+    GATEWAY_LATENCY,
+    QUEUE_SIZE,
+    REGISTRY,
+    start_metrics_server,
+    stop_metrics_server,
+)
+from .bot import MemoryBot, ShardedMemoryBot
+from .cluster import configure_cluster, report_health
 
 
 def _install_signal_handlers(bot: MemoryBot) -> None:
@@ -25,10 +48,124 @@ def _install_signal_handlers(bot: MemoryBot) -> None:
             pass
 
 
+def _collect_runtime_metrics(bot: MemoryBot) -> None:
+    if math.isfinite(bot.latency):
+        GATEWAY_LATENCY.set(bot.latency)
+    shards = get_shards()
+    writers = [s.writer for s in shards.shards if s.writer is not None] if shards is not None else [get_writer()]
+    QUEUE_SIZE.set(sum(w.pending for w in writers if w is not None), queue="db_writes")
+    summarizer = get_summarizer()
+    if summarizer is not None:
+        QUEUE_SIZE.set(summarizer.stats()["dirty_scopes"], queue="summaries")
+    collect_openai_metrics()
+    cache = get_cache()
+    if cache is not None:
+        stats = cache.stats()
+        CACHE_ENTRIES.set(stats["scopes"], cache="history")
+        CACHE_BYTES.set(stats["bytes"], cache="history")
+        CACHE_LOOKUPS.set_total(stats["hits"], cache="history", result="hit")
+        CACHE_LOOKUPS.set_total(stats["misses"], cache="history", result="miss")
+
+
+def collect_openai_metrics() -> None:
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        QUEUE_SIZE.set(limiter.waiting, queue="openai_waiting")
+
+
+def start_openai_limits(settings: Settings) -> None:
+    if not (settings.openai_rpm or settings.openai_tpm or settings.openai_max_concurrency):
+        return
+    start_rate_limiter(rpm=settings.openai_rpm, tpm=settings.openai_tpm, max_concurrency=settings.openai_max_concurrency)
+    logging.getLogger("startup").debug(
+        "openai rate limits rpm=%d tpm=%d concurrency=%d", settings.openai_rpm, settings.openai_tpm, settings.openai_max_concurrency
+    )
+
+
+def stop_openai_limits() -> None:
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        logging.getLogger("startup").info("openai rate limiter stats %s", limiter.stats())
+    stop_rate_limiter()
+
+
+async def open_storage(settings: Settings, *, lane: int = 0, lanes: int = 1) -> None:
+    log = logging.getLogger("startup")
+    engine_options = dict(
+        sqlite_tuned=settings.db_sqlite_tuned,
+        read_pool_size=settings.db_read_pool_size,
+        mmap_mb=settings.db_mmap_mb,
+        cache_mb=settings.db_cache_mb,
+        busy_timeout_ms=settings.db_busy_timeout_ms,
+    )
+    await init_engine(settings.database_url, **engine_options)
+    repo = ConversationRepository()
+    await repo.create_all(get_engine())
+    shards = None
+    if settings.db_shards:
+        shards = await init_shards(
+            settings.db_shard_dir,
+            settings.db_shards,
+            settle=settings.db_shard_settle_ms / 1000,
+            lane=lane,
+            lanes=lanes,
+            **engine_options,
+        )
+        log.debug("sharded storage enabled dir=%s shards=%d", settings.db_shard_dir, len(shards.shards))
+    if settings.db_write_behind:
+        if shards is not None:
+            shards.start_writers(batch_size=settings.db_write_batch_size, flush_interval=settings.db_write_flush_ms / 1000)
+        else:
+            start_writer(batch_size=settings.db_write_batch_size, flush_interval=settings.db_write_flush_ms / 1000)
+        log.debug("write-behind enabled batch=%d flush_ms=%d", settings.db_write_batch_size, settings.db_write_flush_ms)
+    if settings.history_cache_enabled:
+        rules = retention_rules(settings)
+        configure_cache(
+            window=settings.history_cache_window,
+            max_scopes=settings.history_cache_max_scopes,
+            max_bytes=settings.history_cache_max_mb * 1024 * 1024,
+            retention=functools.partial(rule_for, *rules) if rules is not None else None,
+        )
+
+
+def retention_rules(settings: Settings) -> Optional[tuple[RetentionRule, dict[int, RetentionRule]]]:
+    if not settings.retention_enabled:
+        return None
+    default_rule = RetentionRule(settings.retention_max_age_days or None, settings.retention_max_rows or None)
+    overrides = parse_overrides(settings.retention_overrides, default_rule)
+    if not (default_rule.active or any(r.active for r in overrides.values())):
+        return None
+    return default_rule, overrides
+
+
+async def close_storage() -> None:
+    log = logging.getLogger("startup")
+    cache = get_cache()
+    if cache is not None:
+        log.info("history cache stats %s", cache.stats())
+        clear_cache()
+    try:
+        await close_shards()
+    except Exception:
+        log.error("failed to close shards", exc_info=True)
+    try:
+        await close_engine()
+    except Exception:
+        pass
+
+
 async def start_bot() -> None:
     load_dotenv()
     settings = load_settings()
-    configure_logging(settings.log_level, settings.log_format, settings.log_datefmt)
+    if settings.shard_ids:
+        set_log_fields(cluster=settings.cluster_id)
+    configure_logging(
+        settings.log_level,
+        settings.log_format,
+        settings.log_datefmt,
+        json_output=settings.log_json,
+        queued=settings.log_queue,
+    )
     log = logging.getLogger("startup")
     try:
         import discord as _discord
@@ -46,15 +183,82 @@ async def start_bot() -> None:
         os.getpid(),
         platform.platform(),
     )
-    await init_engine(settings.database_url)
-    repo = ConversationRepository()
-    await repo.create_all(get_engine())
-    bot = MemoryBot(settings)
+    try:
+        cluster = configure_cluster(settings)
+    except ValueError as e:
+        log.error("invalid cluster configuration: %s", e)
+        raise SystemExit(2)
+    if cluster is not None:
+        log.info("cluster %d/%d shards=%s", cluster.cluster_id, cluster.cluster_count, ",".join(map(str, cluster.shard_ids)))
+    queued = settings.mention_mode == "queue"
+    lanes = cluster.cluster_count if cluster is not None else 1
+    await open_storage(
+        settings,
+        lane=cluster.cluster_id if cluster is not None else 0,
+        lanes=lanes + settings.worker_processes if queued else lanes,
+    )
+    if queued:
+        await init_work_queue(
+            settings.work_queue_path,
+            lease=settings.work_queue_lease_ms / 1000,
+            max_attempts=settings.work_queue_max_attempts,
+            busy_timeout_ms=settings.db_busy_timeout_ms,
+        )
+        log.debug("mentions are queued to %s for %d workers", settings.work_queue_path, settings.worker_processes)
+    if queued and (settings.memory_enabled or settings.summary_enabled):
+        log.debug("semantic memory and summaries run in the workers")
+    elif settings.memory_enabled:
+        try:
+            memory = start_memory(settings)
+            log.debug("semantic memory enabled dir=%s backend=%s %s", settings.memory_index_dir, settings.embedding_backend, memory.stats())
+        except RuntimeError as e:
+            log.error("semantic memory disabled: %s", e)
+    if settings.retention_enabled and cluster is not None and not cluster.primary:
+        log.debug("retention runs on cluster 0 only")
+    elif settings.retention_enabled:
+        rules = retention_rules(settings)
+        if rules is not None:
+            start_pruner(
+                *rules,
+                interval=settings.retention_interval_ms / 1000,
+                batch_size=settings.retention_batch_size,
+                pause=settings.retention_batch_pause_ms / 1000,
+                vacuum_pages=settings.retention_vacuum_pages,
+            )
+            log.debug("retention enabled default=%s overrides=%d", rules[0], len(rules[1]))
+        else:
+            log.warning("RETENTION_ENABLED is set but no age or row limit is configured")
+    if not queued:
+        start_openai_limits(settings)
+    if settings.summary_enabled and not queued:
+        start_summarizer(settings)
+        log.debug("rolling summaries enabled segment=%d", settings.summary_segment_size)
+    if settings.trace_enabled:
+        start_tracer(
+            slow_ms=settings.trace_slow_ms,
+            profile_dir=settings.trace_profile_dir or None,
+            sample_interval=settings.trace_sample_interval_ms / 1000,
+            profile_max_files=settings.trace_profile_max_files,
+        )
+        log.debug("request tracing enabled slow_ms=%d", settings.trace_slow_ms)
+    bot = ShardedMemoryBot(settings) if cluster is not None or settings.auto_shard else MemoryBot(settings)
     _install_signal_handlers(bot)
+    if settings.metrics_enabled:
+        REGISTRY.add_collector("runtime", lambda: _collect_runtime_metrics(bot))
+        port = settings.metrics_port + cluster.cluster_id if cluster is not None and settings.metrics_port else settings.metrics_port
+        try:
+            await start_metrics_server(settings.metrics_host, port)
+        except OSError as e:
+            log.error("metrics endpoint disabled: %s", e)
     token = settings.token
     if not token or not token.strip():
         log.error("missing DISCORD_TOKEN; set it in environment or .env")
         raise SystemExit(2)
+    health = None
+    if cluster is not None or settings.auto_shard:
+        health = asyncio.create_task(
+            report_health(bot, cluster, settings.cluster_health_interval_ms / 1000), name="memorybot-cluster-health"
+        )
     try:
         await bot.start(token)
     except (asyncio.CancelledError, KeyboardInterrupt):
@@ -63,11 +267,37 @@ async def start_bot() -> None:
         log.error("failed to start bot", exc_info=True)
         raise SystemExit(1)
     finally:
+        if health is not None:
+            health.cancel()
         try:
             if not bot.is_closed():
                 await bot.close()
         finally:
+            stop_tracer()
+            try:
+                await stop_metrics_server()
+            except Exception:
+                log.error("failed to stop metrics endpoint", exc_info=True)
+            try:
+                await stop_pruner()
+            except Exception:
+                log.error("failed to stop retention job", exc_info=True)
+            try:
+                await stop_writer()
+            except Exception:
+                log.error("failed to flush pending writes", exc_info=True)
+            try:
+                await stop_summarizer()
+            except Exception:
+                log.error("failed to stop summarizer", exc_info=True)
+            try:
+                await stop_memory()
+            except Exception:
+                log.error("failed to stop semantic memory", exc_info=True)
             try:
-                await close_engine()
+                await close_work_queue()
             except Exception:
-                pass
+                log.error("failed to close work queue", exc_info=True)
+            stop_openai_limits()
+            await close_storage()
+            stop_logging()
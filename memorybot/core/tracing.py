@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from .logging import reset_request_id, set_request_id
+
+
+class Trace:
+    __slots__ = ("request_id", "name", "start", "end", "spans", "attrs")
+
+    def __init__(self, request_id: str, name: str):
+        self.request_id = request_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: dict[str, list[float]] = {}
+        self.attrs: dict[str, Any] = {}
+
+    def record(self, path: str, seconds: float) -> None:
+        entry = self.spans.get(path)
+        if entry is None:
+            self.spans[path] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    @property
+    def total_ms(self) -> float:
+        return ((self.end if self.end is not None else time.perf_counter()) - self.start) * 1000
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "ms": round(self.total_ms, 1),
+            "spans": {path: {"n": int(n), "ms": round(s * 1000, 1)} for path, (n, s) in self.spans.items()},
+            **self.attrs,
+        }
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_path: contextvars.ContextVar[str] = contextvars.ContextVar("span_path", default="")
+
+
+class StackSampler:
+    def __init__(self, *, interval: float = 0.005, window: float = 120.0):
+        self._interval = max(0.001, float(interval))
+        self._samples: deque[tuple[float, str]] = deque(maxlen=max(1, int(window / self._interval)))
+        self._target = threading.main_thread().ident
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, target: Optional[int] = None) -> None:
+        if self.running:
+            return
+        self._target = target or threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="memorybot-stack-sampler", daemon=True)
+        self._thread.start()
+
+    def acquire(self) -> None:
+        with self._lock:
+            self._active += 1
+        self._wake.set()
+
+    def release(self) -> None:
+        with self._lock:
+            self._active = max(0, self._active - 1)
+
+    @staticmethod
+    def _collapse(frame: Any) -> str:
+        parts: list[str] = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        parts.reverse()
+        return ";".join(parts)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if not self._active:
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            frame = sys._current_frames().get(self._target)
+            if frame is not None and frame.f_code.co_name not in ("select", "poll", "epoll", "kqueue"):
+                self._samples.append((time.perf_counter(), self._collapse(frame)))
+            time.sleep(self._interval)
+
+    def collect(self, start: float, end: float) -> Counter[str]:
+        return Counter(stack for ts, stack in list(self._samples) if start <= ts <= end)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        self._thread = None
+        if thread is not None:
+            thread.join(timeout=1.0)
+
+
+class Tracer:
+    def __init__(
+        self,
+        *,
+        slow_ms: float = 0.0,
+        profile_dir: Optional[str | os.PathLike[str]] = None,
+        sample_interval: float = 0.0,
+        profile_max_files: int = 20,
+        profile_min_interval: float = 60.0,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._slow_ms = max(0.0, float(slow_ms))
+        self._profile_dir = Path(profile_dir) if profile_dir else None
+        self._profile_max_files = max(1, int(profile_max_files))
+        self._profile_min_interval = max(0.0, float(profile_min_interval))
+        self._next_profile = 0.0
+        self._sampler = StackSampler(interval=sample_interval) if self._slow_ms and sample_interval > 0 else None
+        self._log = logger or logging.getLogger("memorybot.trace")
+        self.traces = 0
+        self.slow = 0
+        self.profiles = 0
+
+    def start(self) -> None:
+        if self._sampler is not None:
+            self._sampler.start()
+
+    @contextmanager
+    def trace(self, name: str, request_id: str, **attrs: Any) -> Iterator[Trace]:
+        current = Trace(request_id, name)
+        current.attrs.update(attrs)
+        token = _trace.set(current)
+        path_token = _path.set("")
+        rid_token = set_request_id(request_id)
+        if self._sampler is not None:
+            self._sampler.acquire()
+        try:
+            yield current
+        finally:
+            current.end = time.perf_counter()
+            if self._sampler is not None:
+                self._sampler.release()
+            try:
+                self._finish(current)
+            finally:
+                reset_request_id(rid_token)
+                _path.reset(path_token)
+                _trace.reset(token)
+
+    def _finish(self, current: Trace) -> None:
+        self.traces += 1
+        record = current.to_dict()
+        if self._slow_ms and current.total_ms >= self._slow_ms:
+            self.slow += 1
+            record["slow"] = True
+            if self._sampler is not None:
+                stacks = self._sampler.collect(current.start, current.end or time.perf_counter())
+                record["samples"] = sum(stacks.values())
+                profile = self._write_profile(current, stacks)
+                if profile is not None:
+                    record["profile"] = profile
+                record["hot"] = [
+                    {"frame": frame, "samples": n}
+                    for frame, n in Counter(stack.rsplit(";", 1)[-1] for stack in stacks.elements()).most_common(5)
+                ]
+            self._log.warning("trace %s", json.dumps(record, separators=(",", ":"), default=str))
+            return
+        self._log.info("trace %s", json.dumps(record, separators=(",", ":"), default=str))
+
+    def _write_profile(self, current: Trace, stacks: Counter[str]) -> Optional[str]:
+        if self._profile_dir is None or not stacks:
+            return None
+        now = time.monotonic()
+        if now < self._next_profile:
+            return None
+        self._next_profile = now + self._profile_min_interval
+        try:
+            self._profile_dir.mkdir(parents=True, exist_ok=True)
+            path = self._profile_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{current.name}-{current.request_id}.folded"
+            path.write_text("".join(f"{stack} {n}\n" for stack, n in stacks.most_common()))
+            self.profiles += 1
+            for old in sorted(self._profile_dir.glob("*.folded"), key=lambda p: p.stat().st_mtime)[: -self._profile_max_files]:
+                old.unlink(missing_ok=True)
+            return str(path)
+        except OSError:
+            self._log.debug("failed writing profile", exc_info=True)
+            return None
+
+    def close(self) -> None:
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def stats(self) -> dict[str, Any]:
+        return {"traces": self.traces, "slow": self.slow, "profiles": self.profiles}
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    current = _trace.get()
+    if current is None:
+        yield
+        return
+    parent = _path.get()
+    path = f"{parent}/{name}" if parent else name
+    token = _path.set(path)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.record(path, time.perf_counter() - start)
+        _path.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def start_tracer(
+    *,
+    slow_ms: float = 0.0,
+    profile_dir: Optional[str] = None,
+    sample_interval: float = 0.0,
+    profile_max_files: int = 20,
+) -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(slow_ms=slow_ms, profile_dir=profile_dir, sample_interval=sample_interval, profile_max_files=profile_max_files)
+        _tracer.start()
+    return _tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def stop_tracer() -> None:
+    global _tracer
+    t = _tracer
+    _tracer = None
+    if t is not None:
+        t.close()
+
+
+@contextmanager
+def trace(name: str, request_id: str, **attrs: Any) -> Iterator[Optional[Trace]]:
+    tracer = _tracer
+    if tracer is None:
+        token = set_request_id(request_id)
+        try:
+            yield None
+        finally:
+            reset_request_id(token)
+        return
+    with tracer.trace(name, request_id, **attrs) as current:
+        yield current
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from pydantic import ValidationError
+
+from .config import load_settings
+from .logging import configure_logging, set_log_fields, stop_logging
+from .metrics import QUEUE_SIZE, REGISTRY, start_metrics_server, stop_metrics_server
+from .tracing import start_tracer, stop_tracer, trace
+from .cluster import ChildProcess, ProcessSupervisor
+from .runtime import collect_openai_metrics, close_storage, open_storage, start_openai_limits, stop_openai_limits
+from memorybot.db.shards import get_shards
+from memorybot.db.writer import get_writer, stop_writer
+from memorybot.db.work_queue import Job, LeaseLost, WorkQueue, close_work_queue, init_work_queue, partition_key
+from memorybot.schemas.jobs import MentionJob
+from memorybot.services.memory import start_memory, stop_memory
+from memorybot.services.mention_pipeline import MentionPipeline, QueueSink
+from memorybot.services.summarizer import start_summarizer, stop_summarizer
+
+
+async def _flush_writes() -> None:
+    shards = get_shards()
+    if shards is not None:
+        await shards.flush()
+        return
+    writer = get_writer()
+    if writer is not None:
+        await writer.flush()
+
+
+class MentionWorker:
+    def __init__(
+        self,
+        pipeline: MentionPipeline,
+        queue: WorkQueue,
+        *,
+        index: int = 0,
+        processes: int = 1,
+        concurrency: int = 8,
+        poll_interval: float = 0.2,
+        drain_timeout: float = 30.0,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._pipeline = pipeline
+        self._queue = queue
+        self._partition = (index, processes)
+        self._concurrency = max(1, int(concurrency))
+        self._poll_interval = max(0.01, float(poll_interval))
+        self._drain_timeout = max(0.0, float(drain_timeout))
+        self._owner = f"worker-{index}-{socket.gethostname()}-{os.getpid()}"
+        self._active: dict[asyncio.Task, Job] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._log = logger or logging.getLogger("memorybot.worker")
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="memorybot-mention-worker")
+
+    async def _run(self) -> None:
+        while True:
+            free = self._concurrency - len(self._active)
+            jobs: list[Job] = []
+            if free > 0:
+                try:
+                    jobs = await self._queue.claim("mentions", self._owner, limit=free, partition=self._partition)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self._log.error("claiming mentions failed", exc_info=True)
+            for job in jobs:
+                task = asyncio.create_task(self._process(job))
+                self._active[task] = job
+                task.add_done_callback(self._done)
+            if jobs and len(self._active) < self._concurrency:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._active.pop(task, None)
+        self._wake.set()
+
+    async def _heartbeat(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(self._queue.lease / 3)
+            try:
+                await self._queue.extend(job)
+            except LeaseLost:
+                self._log.warning("lost the lease on %r while it was running", job)
+                return
+            except Exception:
+                self._log.warning("failed to extend the lease on %r", job, exc_info=True)
+
+    async def _process(self, job: Job) -> None:
+        try:
+            mention = MentionJob.model_validate(job.payload)
+        except ValidationError as e:
+            await self._queue.bury(job, f"invalid payload: {e}")
+            return
+        sink = QueueSink(self._queue, job, mention)
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            with trace(
+                "mention",
+                str(mention.items[-1].message_id),
+                guild=mention.guild_id,
+                channel=mention.channel_id,
+                batch=len(mention.items),
+                attempt=job.attempts,
+            ):
+                await self._pipeline.run(mention, sink)
+                await _flush_writes()
+                await sink.complete()
+            self.completed += 1
+        except LeaseLost:
+            self._log.warning("lost the lease on %r; another attempt will redo it", job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            try:
+                await self._queue.fail(job, f"{type(e).__name__}: {e}")
+            except LeaseLost:
+                pass
+        finally:
+            heartbeat.cancel()
+
+    async def close(self) -> None:
+        task = self._task
+        self._task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if not self._active:
+            return
+        self._log.info("waiting up to %.0fs for %d running jobs", self._drain_timeout, len(self._active))
+        _, pending = await asyncio.wait(list(self._active), timeout=self._drain_timeout or None)
+        unfinished = [self._active[t] for t in pending if t in self._active]
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for job in unfinished:
+            try:
+                await self._queue.release(job)
+            except Exception:
+                self._log.warning("failed to release %r", job, exc_info=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {"completed": self.completed, "failed": self.failed, "active": len(self._active), **self._queue.stats()}
+
+
+def _owns(index: int, processes: int):
+    return lambda guild_id, channel_id: partition_key(guild_id, channel_id) % processes == index
+
+
+async def start_worker() -> int:
+    load_dotenv()
+    settings = load_settings()
+    index, processes = settings.worker_index, settings.worker_processes
+    set_log_fields(worker=index)
+    configure_logging(
+        settings.log_level,
+        settings.log_format,
+        settings.log_datefmt,
+        json_output=settings.log_json,
+        queued=settings.log_queue,
+    )
+    log = logging.getLogger("memorybot.worker")
+    if index >= processes:
+        log.error("WORKER_INDEX must be in [0, %d)", processes)
+        stop_logging()
+        return 2
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (getattr(signal, "SIGINT", None), getattr(signal, "SIGTERM", None)):
+        if sig is None:
+            continue
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            pass
+    worker: Optional[MentionWorker] = None
+    pipeline: Optional[MentionPipeline] = None
+    try:
+        await open_storage(settings, lane=settings.cluster_count + index, lanes=settings.cluster_count + processes)
+        owns = _owns(index, processes)
+        start_openai_limits(settings)
+        if settings.memory_enabled:
+            try:
+                start_memory(settings, layout=f"worker-{index}-of-{processes}", owns=owns if processes > 1 else None)
+            except RuntimeError as e:
+                log.error("semantic memory disabled: %s", e)
+        if settings.summary_enabled:
+            start_summarizer(settings, owns=owns if processes > 1 else None)
+        if settings.trace_enabled:
+            start_tracer(
+                slow_ms=settings.trace_slow_ms,
+                profile_dir=settings.trace_profile_dir or None,
+                sample_interval=settings.trace_sample_interval_ms / 1000,
+                profile_max_files=settings.trace_profile_max_files,
+            )
+        queue = await init_work_queue(
+            settings.work_queue_path,
+            lease=settings.work_queue_lease_ms / 1000,
+            max_attempts=settings.work_queue_max_attempts,
+            busy_timeout_ms=settings.db_busy_timeout_ms,
+        )
+        pipeline = MentionPipeline(settings)
+        await pipeline.start()
+        worker = MentionWorker(
+            pipeline,
+            queue,
+            index=index,
+            processes=processes,
+            concurrency=settings.llm_max_concurrency,
+            poll_interval=settings.work_queue_poll_ms / 1000,
+            drain_timeout=settings.cluster_shutdown_timeout_ms / 1000 / 2,
+        )
+        if settings.metrics_enabled:
+            REGISTRY.add_collector("mention", pipeline.collect_metrics)
+            REGISTRY.add_collector("worker", lambda: QUEUE_SIZE.set(worker.stats()["active"], queue="mentions_active"))
+            REGISTRY.add_collector("openai", collect_openai_metrics)
+            port = settings.metrics_port + settings.cluster_count + index if settings.metrics_port else 0
+            try:
+                await start_metrics_server(settings.metrics_host, port)
+            except OSError as e:
+                log.error("metrics endpoint disabled: %s", e)
+        worker.start()
+        log.info("worker %d/%d consuming %s", index, processes, settings.work_queue_path)
+        await stopping.wait()
+        return 0
+    finally:
+        if worker is not None:
+            await worker.close()
+            log.info("worker stats %s", worker.stats())
+        if pipeline is not None:
+            log.info("%s", pipeline.describe())
+            await pipeline.aclose()
+        stop_tracer()
+        try:
+            await stop_metrics_server()
+        except Exception:
+            log.error("failed to stop metrics endpoint", exc_info=True)
+        try:
+            await stop_writer()
+        except Exception:
+            log.error("failed to flush pending writes", exc_info=True)
+        try:
+            await stop_summarizer()
+        except Exception:
+            log.error("failed to stop summarizer", exc_info=True)
+        try:
+            await stop_memory()
+        except Exception:
+            log.error("failed to stop semantic memory", exc_info=True)
+        try:
+            await close_work_queue()
+        except Exception:
+            log.error("failed to close work queue", exc_info=True)
+        stop_openai_limits()
+        await close_storage()
+        stop_logging()
+
+
+async def start_workers() -> int:
+    load_dotenv()
+    settings = load_settings()
+    configure_logging(
+        settings.log_level,
+        settings.log_format,
+        settings.log_datefmt,
+        json_output=settings.log_json,
+        queued=settings.log_queue,
+    )
+    try:
+        processes = settings.worker_processes
+        supervisor = ProcessSupervisor(
+            "worker",
+            [
+                ChildProcess(i, f"partition={i}/{processes}", {"WORKER_INDEX": str(i), "WORKER_PROCESSES": str(processes)})
+                for i in range(processes)
+            ],
+            health_interval=settings.cluster_health_interval_ms / 1000,
+            shutdown_timeout=settings.cluster_shutdown_timeout_ms / 1000,
+            command=(sys.executable, "-m", "memorybot.core.worker"),
+        )
+        supervisor.install_signal_handlers()
+        logging.getLogger("memorybot.worker").info("launching %d workers on %s", processes, settings.work_queue_path)
+        return await supervisor.run()
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(start_worker()))
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+from .models import Message
+
+
+ScopeKey = tuple[str, int]
+
+_ENTRY_OVERHEAD = 64
+
+
+def _size(message: Message) -> int:
+    return len(message.content or "") + len(message.text or "") + len(message.meta or "") + _ENTRY_OVERHEAD
+
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo is None else value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class _Window:
+    __slots__ = ("items", "bytes", "exhaustive")
+
+    def __init__(self, rows: list[Message], window: int):
+        self.items: deque[Message] = deque(rows[-window:], maxlen=window)
+        self.bytes = sum(_size(m) for m in self.items)
+        self.exhaustive = len(rows) < window
+
+    def append(self, message: Message) -> int:
+        freed = 0
+        if len(self.items) == self.items.maxlen:
+            freed = _size(self.items[0])
+            self.exhaustive = False
+        self.items.append(message)
+        added = _size(message)
+        self.bytes += added - freed
+        return added - freed
+
+
+class ConversationWindowCache:
+    def __init__(
+        self,
+        *,
+        window: int = 50,
+        max_scopes: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        retention: Optional[Callable[[Optional[int]], Any]] = None,
+    ):
+        self.window = max(1, int(window))
+        self._max_scopes = max(1, int(max_scopes))
+        self._max_bytes = max(0, int(max_bytes))
+        self._retention = retention
+        self._entries: OrderedDict[ScopeKey, _Window] = OrderedDict()
+        self._bytes = 0
+        self._loading: dict[ScopeKey, int] = {}
+        self._dirty: set[ScopeKey] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def scope_key(guild_id: Optional[int], channel_id: Optional[int]) -> ScopeKey:
+        if guild_id is not None:
+            return ("guild", guild_id)
+        if channel_id is not None:
+            return ("channel", channel_id)
+        raise ValueError("guild_id or channel_id is required")
+
+    def get(self, key: ScopeKey, limit: int) -> Optional[list[Message]]:
+        entry = self._entries.get(key)
+        if entry is None or (limit > len(entry.items) and not entry.exhaustive):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if limit <= 0:
+            return []
+        items = list(entry.items)
+        if self._retention is not None and items:
+            items = self._retained(items)
+        return items[-limit:]
+
+    def _retained(self, items: list[Message]) -> list[Message]:
+        rule = self._retention(items[-1].guild_id)
+        if rule.max_age_days:
+            cutoff = datetime.utcnow() - timedelta(days=rule.max_age_days)
+            items = [m for m in items if m.created_at is None or _utc(m.created_at) >= cutoff]
+        if rule.max_rows:
+            items = items[-rule.max_rows:]
+        return items
+
+    def begin_load(self, key: ScopeKey) -> None:
+        self._loading[key] = self._loading.get(key, 0) + 1
+
+    def end_load(self, key: ScopeKey, rows: Optional[list[Message]]) -> None:
+        pending = self._loading.get(key, 0) - 1
+        stale = key in self._dirty
+        if pending <= 0:
+            self._loading.pop(key, None)
+            self._dirty.discard(key)
+        else:
+            self._loading[key] = pending
+        if rows is None or stale or key in self._entries:
+            return
+        entry = _Window(rows, self.window)
+        self._entries[key] = entry
+        self._bytes += entry.bytes
+        self._evict()
+
+    def append(self, message: Message) -> None:
+        keys = [("channel", message.channel_id)]
+        if message.guild_id is not None:
+            keys.append(("guild", message.guild_id))
+        for key in keys:
+            if key in self._loading:
+                self._dirty.add(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._bytes += entry.append(message)
+        self._evict()
+
+    def invalidate(self, key: Optional[ScopeKey] = None) -> None:
+        if key is None:
+            self._entries.clear()
+            self._bytes = 0
+            self._dirty.update(self._loading)
+            return
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.bytes
+        if key in self._loading:
+            self._dirty.add(key)
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self._max_scopes or self._bytes > self._max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.bytes
+            self.evictions += 1
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "scopes": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+_cache: Optional[ConversationWindowCache] = None
+
+
+def configure_cache(
+    *,
+    window: int = 50,
+    max_scopes: int = 1000,
+    max_bytes: int = 64 * 1024 * 1024,
+    retention: Optional[Callable[[Optional[int]], Any]] = None,
+) -> ConversationWindowCache:
+    global _cache
+    _cache = ConversationWindowCache(window=window, max_scopes=max_scopes, max_bytes=max_bytes, retention=retention)
+    return _cache
+
+
+def get_cache() -> Optional[ConversationWindowCache]:
+    return _cache
+
+
+def clear_cache() -> None:
+    global _cache
+    _cache = None
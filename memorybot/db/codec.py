@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import json
+from typing import Any, NamedTuple, Optional
+
+
+_CHANNEL_KEYS = ("id", "name")
+
+
+class CompactRecord(NamedTuple):
+    discord_message_id: Optional[int]
+    text: Optional[str]
+    meta: str
+
+
+def compact_json(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_user_payload(payload: dict[str, Any]) -> CompactRecord:
+    message = dict(payload.get("message") or {})
+    text = message.pop("content", None) or ""
+    if not message.get("reference"):
+        message.pop("reference", None)
+    meta: dict[str, Any] = {"message": message, "author": payload.get("author")}
+    channel = payload.get("channel")
+    if isinstance(channel, dict):
+        meta["channel"] = {k: channel[k] for k in _CHANNEL_KEYS if channel.get(k) is not None}
+    mid = message.get("id")
+    return CompactRecord(mid if isinstance(mid, int) else None, text, compact_json(meta))
+
+
+def encode_assistant_payload(payload: dict[str, Any]) -> CompactRecord:
+    message = payload.get("message") or {}
+    text = message.get("content") if isinstance(message, dict) else None
+    return CompactRecord(None, text or "", compact_json({"tool": payload.get("tool")}))
+
+
+def encode_tool_payload(payload: Any) -> CompactRecord:
+    return CompactRecord(None, None, compact_json(payload))
+
+
+def encode_legacy(role: str, content: str) -> Optional[CompactRecord]:
+    try:
+        payload = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if role == "tool":
+        return encode_tool_payload(payload)
+    if not isinstance(payload, dict) or not isinstance(payload.get("message"), dict):
+        return None
+    if role == "user":
+        return encode_user_payload(payload)
+    if role == "assistant":
+        return encode_assistant_payload(payload)
+    return None
+
+
+def render_content(content: Optional[str], text: Optional[str], meta: Optional[str]) -> str:
+    if meta is None:
+        return content or ""
+    if text is None:
+        return meta
+    try:
+        payload = json.loads(meta)
+    except ValueError:
+        return text
+    if not isinstance(payload, dict):
+        return text
+    message = payload.pop("message", None)
+    if not isinstance(message, dict):
+        message = {}
+    return compact_json({"message": {**message, "content": text}, **payload})
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import logging
+
+from sqlalchemy import Connection, inspect
+
+from .models import Base, Message
+
+
+_LEGACY_INDEXES = ("ix_messages_guild_id", "ix_messages_channel_id")
+
+
+def _ensure_indexes(conn: Connection) -> None:
+    log = logging.getLogger("memorybot.db.migrations")
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(Message.__tablename__)}
+    for index in Message.__table__.indexes:
+        if index.name not in existing:
+            index.create(conn)
+            log.info("created index %s", index.name)
+    for name in _LEGACY_INDEXES:
+        if name in existing:
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+            log.info("dropped superseded index %s", name)
+
+
+def _ensure_columns(conn: Connection) -> None:
+    log = logging.getLogger("memorybot.db.migrations")
+    existing = {col["name"] for col in inspect(conn).get_columns(Message.__tablename__)}
+    for column in Message.__table__.columns:
+        if column.name in existing:
+            continue
+        if not column.nullable:
+            raise RuntimeError(f"cannot add non-nullable column {column.name} to existing table")
+        type_sql = column.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f"ALTER TABLE {Message.__tablename__} ADD COLUMN {column.name} {type_sql}")
+        log.info("added column %s", column.name)
+
+
+def _enable_incremental_vacuum(conn: Connection) -> None:
+    if conn.dialect.name != "sqlite" or inspect(conn).get_table_names():
+        return
+    conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+def upgrade(conn: Connection) -> None:
+    _enable_incremental_vacuum(conn)
+    Base.metadata.create_all(conn)
+    _ensure_columns(conn)
+    _ensure_indexes(conn)
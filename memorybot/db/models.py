@@ -4,7 +4,9 @@ from datetime import datetime
 from typing import Optional
 
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
-from sqlalchemy import Integer, BigInteger, String, DateTime
+from sqlalchemy import Integer, BigInteger, String, DateTime, Float, Index
+
+from .codec import render_content
 
 
 Base = declarative_base()
@@ -12,11 +14,47 @@ Base = declarative_base()
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_guild_id_created_at", "guild_id", "created_at"),
+        Index("ix_messages_channel_id_created_at", "channel_id", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    guild_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True, index=True)
-    channel_id: Mapped[int] = mapped_column(BigInteger, index=True, nullable=False)
+    guild_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    channel_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     user_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     role: Mapped[str] = mapped_column(String(16), nullable=False)
-    content: Mapped[str] = mapped_column(String, nullable=False)
+    content: Mapped[str] = mapped_column(String, nullable=False, default="")
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False, index=True)
+    discord_message_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    text: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    meta: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+    def render(self) -> str:
+        return render_content(self.content, self.text, self.meta)
+
+
+class ToolResult(Base):
+    __tablename__ = "tool_results"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    tool: Mapped[str] = mapped_column(String(64), nullable=False)
+    payload: Mapped[str] = mapped_column(String, nullable=False)
+    expires_at: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+    __table_args__ = (
+        Index("ix_conversation_summaries_guild_id_end", "guild_id", "end_message_id"),
+        Index("ix_conversation_summaries_channel_id_end", "channel_id", "end_message_id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    guild_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    channel_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    start_message_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    end_message_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    content: Mapped[str] = mapped_column(String, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
@@ -1,13 +1,109 @@
 from __future__ import annotations
 
-from typing import List, Optional
+import asyncio
+from typing import Any, List, Mapping, NamedTuple, Optional, Sequence, Tuple
 from datetime import datetime
 
-from sqlalchemy import select
+from sqlalchemy import and_, case, delete, func, or_, select
 
-from .session import session
-from .models import Message, Base
-from sqlalchemy.ext.asyncio import AsyncEngine
+from .session import read_session, session
+from .shards import Shard, get_shards
+from .models import ConversationSummary, Message, ToolResult
+from .codec import render_content
+from .migrations import upgrade
+from .writer import MessageWriteQueue, get_writer
+from .cache import get_cache
+from memorybot.core.metrics import DB_SECONDS
+from memorybot.core.tracing import span
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+
+class MessageCursor(NamedTuple):
+    created_at: datetime
+    id: int
+
+    @classmethod
+    def of(cls, message: Message) -> "MessageCursor":
+        return cls(message.created_at, message.id)
+
+
+def _scope(guild_id: Optional[int], channel_id: Optional[int]):
+    if guild_id is not None:
+        return Message.guild_id == guild_id
+    if channel_id is not None:
+        return Message.channel_id == channel_id
+    raise ValueError("guild_id or channel_id is required")
+
+
+def _shard(guild_id: Optional[int], channel_id: Optional[int]) -> Optional[Shard]:
+    shards = get_shards()
+    return shards.route(guild_id, channel_id) if shards is not None else None
+
+
+def _write_session(guild_id: Optional[int], channel_id: Optional[int]) -> AsyncSession:
+    shard = _shard(guild_id, channel_id)
+    return shard.session() if shard is not None else session()
+
+
+def _read_session(guild_id: Optional[int], channel_id: Optional[int]) -> AsyncSession:
+    shard = _shard(guild_id, channel_id)
+    return shard.read_session() if shard is not None else read_session()
+
+
+def _read_shards(guild_id: Optional[int], channel_id: Optional[int]) -> List[Optional[Shard]]:
+    shards = get_shards()
+    return list(shards.read_shards(guild_id, channel_id)) if shards is not None else [None]
+
+
+async def _read_all(targets: Sequence[Optional[Shard]], stmt: Any, *, scalars: bool = True) -> List[List[Any]]:
+    async def run(shard: Optional[Shard]) -> List[Any]:
+        async with (shard.read_session() if shard is not None else read_session()) as s:
+            res = await s.execute(stmt)
+            return list(res.scalars()) if scalars else list(res.all())
+
+    if len(targets) == 1:
+        return [await run(targets[0])]
+    return list(await asyncio.gather(*(run(shard) for shard in targets)))
+
+
+def _merged(parts: Sequence[List[Any]], limit: int, *, newest: bool = True) -> List[Any]:
+    if len(parts) == 1:
+        return parts[0]
+    unique = {r.id: r for part in parts for r in part}
+    order = (lambda r: (r.created_at, r.id)) if newest else (lambda r: r.id)
+    return sorted(unique.values(), key=order, reverse=newest)[:limit]
+
+
+def _writer(guild_id: Optional[int], channel_id: Optional[int]) -> Optional[MessageWriteQueue]:
+    shard = _shard(guild_id, channel_id)
+    if shard is None:
+        return get_writer()
+    writer = shard.writer
+    return writer if writer is not None and writer.running else None
+
+
+async def _fan_out(stmt: Any, *, write: bool = False) -> List[Any]:
+    shards = get_shards()
+    if shards is None:
+        async with (session() if write else read_session()) as s:
+            res = await s.execute(stmt)
+            if write:
+                await s.commit()
+            return [res]
+
+    async def run(shard: Shard) -> Any:
+        async with (shard.session() if write else shard.read_session()) as s:
+            res = await s.execute(stmt)
+            if write:
+                await s.commit()
+            return res
+
+    return list(await asyncio.gather(*(run(shard) for shard in shards.shards)))
+
+
+def _settled(stmt: Any) -> Any:
+    shards = get_shards()
+    return stmt.where(Message.id <= shards.settled_id()) if shards is not None else stmt
 
 
 class ConversationRepository:
@@ -18,48 +114,354 @@ class ConversationRepository:
         channel_id: int,
         user_id: Optional[int],
         role: str,
-        content: str,
-    ) -> Message:
-        async with session() as s:
-            m = Message(
+        content: str = "",
+        discord_message_id: Optional[int] = None,
+        text: Optional[str] = None,
+        meta: Optional[str] = None,
+        refresh: bool = True,
+        wait: bool = True,
+    ) -> Optional[Message]:
+        created_at = datetime.utcnow()
+        writer = _writer(guild_id, channel_id)
+        cache = get_cache()
+        if writer is not None and not refresh:
+            row = {
+                "guild_id": guild_id,
+                "channel_id": channel_id,
+                "user_id": user_id,
+                "role": role,
+                "content": content,
+                "created_at": created_at,
+                "discord_message_id": discord_message_id,
+                "text": text,
+                "meta": meta,
+            }
+            with span("db.write"), DB_SECONDS.time(op="write" if wait else "enqueue"):
+                await writer.submit(row, wait=wait)
+            return None
+        shard = _shard(guild_id, channel_id)
+        with span("db.write"), DB_SECONDS.time(op="write"):
+            async with _write_session(guild_id, channel_id) as s:
+                m = Message(
+                    id=shard.ids.next() if shard is not None else None,
+                    guild_id=guild_id,
+                    channel_id=channel_id,
+                    user_id=user_id,
+                    role=role,
+                    content=content,
+                    created_at=created_at,
+                    discord_message_id=discord_message_id,
+                    text=text,
+                    meta=meta,
+                )
+                s.add(m)
+                await s.commit()
+                if refresh:
+                    await s.refresh(m)
+        if cache is not None:
+            cache.append(m)
+        return m
+
+    async def flush(self, *, guild_id: Optional[int] = None, channel_id: Optional[int] = None) -> None:
+        shards = get_shards()
+        if shards is not None and guild_id is None and channel_id is None:
+            await shards.flush()
+            return
+        writer = _writer(guild_id, channel_id) if shards is not None else get_writer()
+        if writer is not None:
+            await writer.flush()
+
+    async def _query_recent(self, guild_id: Optional[int], channel_id: Optional[int], limit: int) -> List[Message]:
+        stmt = (
+            select(Message)
+            .where(_scope(guild_id, channel_id))
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(limit)
+        )
+        rows = list(_merged(await _read_all(_read_shards(guild_id, channel_id), stmt), limit))
+        rows.reverse()
+        return rows
+
+    async def _recent(self, guild_id: Optional[int], channel_id: Optional[int], limit: int) -> List[Message]:
+        cache = get_cache()
+        if cache is None:
+            return await self._query_recent(guild_id, channel_id, limit)
+        key = cache.scope_key(guild_id, channel_id)
+        cached = cache.get(key, limit)
+        if cached is not None:
+            return cached
+        await self.flush(guild_id=guild_id, channel_id=channel_id)
+        rows: Optional[List[Message]] = None
+        cache.begin_load(key)
+        try:
+            rows = await self._query_recent(guild_id, channel_id, max(limit, cache.window))
+        finally:
+            cache.end_load(key, rows)
+        return rows[-limit:] if limit > 0 else []
+
+    async def get_recent_messages(self, *, channel_id: int, limit: int = 20) -> List[Message]:
+        return await self._recent(None, channel_id, limit)
+
+    async def get_recent_messages_by_guild(self, *, guild_id: int, limit: int = 20) -> List[Message]:
+        return await self._recent(guild_id, None, limit)
+
+    async def get_messages_before(
+        self,
+        *,
+        guild_id: Optional[int] = None,
+        channel_id: Optional[int] = None,
+        before: Optional[MessageCursor] = None,
+        limit: int = 50,
+    ) -> List[Message]:
+        stmt = select(Message).where(_scope(guild_id, channel_id))
+        if before is not None:
+            stmt = stmt.where(
+                or_(
+                    Message.created_at < before.created_at,
+                    and_(Message.created_at == before.created_at, Message.id < before.id),
+                )
+            )
+        stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+        rows = list(_merged(await _read_all(_read_shards(guild_id, channel_id), stmt), limit))
+        rows.reverse()
+        return rows
+
+    async def get_messages_after_id(
+        self,
+        after_id: int,
+        *,
+        guild_id: Optional[int] = None,
+        channel_id: Optional[int] = None,
+        roles: Sequence[str] = ("user", "assistant"),
+        limit: int = 256,
+    ) -> List[Message]:
+        stmt = select(Message).where(Message.id > after_id, Message.role.in_(roles))
+        if guild_id is not None or channel_id is not None:
+            stmt = stmt.where(_scope(guild_id, channel_id)).order_by(Message.id).limit(limit)
+            return list(_merged(await _read_all(_read_shards(guild_id, channel_id), stmt), limit, newest=False))
+        results = await _fan_out(_settled(stmt).order_by(Message.id).limit(limit))
+        rows = sorted((m for res in results for m in res.scalars()), key=lambda m: m.id)
+        return rows[:limit]
+
+    async def get_scopes_after_id(self, after_id: int) -> Tuple[List[Tuple[Optional[int], Optional[int]]], int]:
+        stmt = (
+            select(
+                Message.guild_id,
+                case((Message.guild_id.is_(None), Message.channel_id), else_=None),
+                func.max(Message.id),
+            )
+            .where(Message.id > after_id)
+            .group_by(Message.guild_id, case((Message.guild_id.is_(None), Message.channel_id), else_=None))
+        )
+        rows = [row for res in await _fan_out(_settled(stmt)) for row in res.all()]
+        return [(g, c) for g, c, _ in rows], max((m for _, _, m in rows), default=after_id)
+
+    async def get_messages_by_ids(self, ids: Sequence[int]) -> List[Message]:
+        if not ids:
+            return []
+        results = await _fan_out(select(Message).where(Message.id.in_(list(ids))))
+        return [m for res in results for m in res.scalars()]
+
+    async def delete_older_than(
+        self,
+        cutoff: datetime,
+        *,
+        guild_id: Optional[int] = None,
+        exclude_guilds: Sequence[int] = (),
+        limit: int = 500,
+    ) -> int:
+        ids = select(Message.id).where(Message.created_at < cutoff)
+        if guild_id is not None:
+            ids = ids.where(Message.guild_id == guild_id)
+            async with _write_session(guild_id, None) as s:
+                res = await s.execute(delete(Message).where(Message.id.in_(ids.limit(limit))))
+                await s.commit()
+                return res.rowcount or 0
+        if exclude_guilds:
+            ids = ids.where(or_(Message.guild_id.is_(None), Message.guild_id.not_in(list(exclude_guilds))))
+        results = await _fan_out(delete(Message).where(Message.id.in_(ids.limit(limit))), write=True)
+        return sum(res.rowcount or 0 for res in results)
+
+    async def get_cursor_at(
+        self,
+        *,
+        guild_id: Optional[int] = None,
+        channel_id: Optional[int] = None,
+        offset: int,
+    ) -> Optional[MessageCursor]:
+        stmt = (
+            select(Message.created_at, Message.id)
+            .where(_scope(guild_id, channel_id))
+            .order_by(Message.created_at.desc(), Message.id.desc())
+        )
+        targets = _read_shards(guild_id, channel_id)
+        if len(targets) > 1:
+            rows = _merged(await _read_all(targets, stmt.limit(offset + 1), scalars=False), offset + 1)
+            return MessageCursor(rows[offset][0], rows[offset][1]) if len(rows) > offset else None
+        async with _read_session(guild_id, channel_id) as s:
+            row = (await s.execute(stmt.offset(offset).limit(1))).first()
+        return MessageCursor(row[0], row[1]) if row is not None else None
+
+    async def delete_through(
+        self,
+        *,
+        guild_id: Optional[int] = None,
+        channel_id: Optional[int] = None,
+        through: MessageCursor,
+        limit: int = 500,
+    ) -> int:
+        ids = (
+            select(Message.id)
+            .where(
+                _scope(guild_id, channel_id),
+                or_(
+                    Message.created_at < through.created_at,
+                    and_(Message.created_at == through.created_at, Message.id <= through.id),
+                ),
+            )
+            .limit(limit)
+        )
+        async with _write_session(guild_id, channel_id) as s:
+            res = await s.execute(delete(Message).where(Message.id.in_(ids)))
+            await s.commit()
+            return res.rowcount or 0
+
+    @staticmethod
+    def _history_stmt(guild_id: Optional[int], channel_id: Optional[int], limit: int):
+        return (
+            select(Message.role, Message.content, Message.text, Message.meta, Message.created_at, Message.id)
+            .where(_scope(guild_id, channel_id))
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(limit)
+        )
+
+    @staticmethod
+    def _rendered(rows: Sequence[Any]) -> List[Tuple[str, str]]:
+        out = [(r, render_content(c, t, m)) for r, c, t, m, *_ in rows]
+        out.reverse()
+        return out
+
+    async def get_recent_history(
+        self,
+        *,
+        guild_id: Optional[int] = None,
+        channel_id: Optional[int] = None,
+        limit: int = 20,
+    ) -> List[Tuple[str, str]]:
+        with span("db.read"), DB_SECONDS.time(op="read"):
+            if get_cache() is not None:
+                return [(m.role, m.render()) for m in await self._recent(guild_id, channel_id, limit)]
+            parts = await _read_all(_read_shards(guild_id, channel_id), self._history_stmt(guild_id, channel_id, limit), scalars=False)
+            return self._rendered(_merged(parts, limit))
+
+    async def append_and_get_history(
+        self,
+        rows: Sequence[Mapping[str, Any]],
+        *,
+        guild_id: Optional[int],
+        channel_id: int,
+        limit: int = 20,
+    ) -> List[Tuple[str, str]]:
+        writer = _writer(guild_id, channel_id)
+        if writer is not None:
+            for i, row in enumerate(rows):
+                await self.add_message(guild_id=guild_id, channel_id=channel_id, **row, refresh=False, wait=i == len(rows) - 1)
+            return await self.get_recent_history(guild_id=guild_id, channel_id=channel_id, limit=limit)
+        cache = get_cache()
+        shard = _shard(guild_id, channel_id)
+        messages = [
+            Message(
+                id=shard.ids.next() if shard is not None else None,
                 guild_id=guild_id,
                 channel_id=channel_id,
-                user_id=user_id,
-                role=role,
-                content=content,
                 created_at=datetime.utcnow(),
+                **row,
             )
-            s.add(m)
-            await s.commit()
-            await s.refresh(m)
-            return m
+            for row in rows
+        ]
+        history: List[Tuple[str, str]] = []
+        merged = len(_read_shards(guild_id, channel_id)) > 1
+        op = "write" if cache is not None or merged else "append_read"
+        with span(f"db.{op}"), DB_SECONDS.time(op=op):
+            async with _write_session(guild_id, channel_id) as s:
+                s.add_all(messages)
+                if cache is None and not merged:
+                    await s.flush()
+                    res = await s.execute(self._history_stmt(guild_id, channel_id, limit))
+                    history = self._rendered(res.all())
+                await s.commit()
+        if cache is None and not merged:
+            return history
+        if cache is None:
+            return await self.get_recent_history(guild_id=guild_id, channel_id=channel_id, limit=limit)
+        for m in messages:
+            cache.append(m)
+        return await self.get_recent_history(guild_id=guild_id, channel_id=channel_id, limit=limit)
 
-    async def get_recent_messages(self, *, channel_id: int, limit: int = 20) -> List[Message]:
-        async with session() as s:
-            stmt = (
-                select(Message)
-                .where(Message.channel_id == channel_id)
-                .order_by(Message.created_at.desc())
-                .limit(limit)
-            )
+    async def create_all(self, engine: AsyncEngine) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(upgrade)
+
+
+
+class ToolResultRepository:
+    async def get(self, key: str, *, now: float) -> Optional[str]:
+        async with read_session() as s:
+            stmt = select(ToolResult.payload).where(ToolResult.key == key, ToolResult.expires_at > now)
             res = await s.execute(stmt)
-            rows = list(res.scalars())
-            rows.reverse()
-            return rows
+            return res.scalar_one_or_none()
 
-    async def get_recent_messages_by_guild(self, *, guild_id: int, limit: int = 20) -> List[Message]:
+    async def put(self, key: str, *, tool: str, payload: str, expires_at: float) -> None:
         async with session() as s:
-            stmt = (
-                select(Message)
-                .where(Message.guild_id == guild_id)
-                .order_by(Message.created_at.desc())
-                .limit(limit)
-            )
-            res = await s.execute(stmt)
-            rows = list(res.scalars())
-            rows.reverse()
-            return rows
+            await s.merge(ToolResult(key=key, tool=tool, payload=payload, expires_at=expires_at))
+            await s.commit()
 
-    async def create_all(self, engine: AsyncEngine) -> None:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+    async def purge_expired(self, *, now: float) -> int:
+        async with session() as s:
+            res = await s.execute(delete(ToolResult).where(ToolResult.expires_at <= now))
+            await s.commit()
+            return res.rowcount or 0
+
+
+class SummaryRepository:
+    @staticmethod
+    def _scope(guild_id: Optional[int], channel_id: Optional[int]):
+        if guild_id is not None:
+            return ConversationSummary.guild_id == guild_id
+        if channel_id is not None:
+            return and_(ConversationSummary.guild_id.is_(None), ConversationSummary.channel_id == channel_id)
+        raise ValueError("guild_id or channel_id is required")
+
+    async def latest(self, *, guild_id: Optional[int] = None, channel_id: Optional[int] = None) -> Optional[ConversationSummary]:
+        stmt = (
+            select(ConversationSummary)
+            .where(self._scope(guild_id, channel_id))
+            .order_by(ConversationSummary.end_message_id.desc())
+            .limit(1)
+        )
+        found = [m for part in await _read_all(_read_shards(guild_id, channel_id), stmt) for m in part]
+        return max(found, key=lambda m: m.end_message_id, default=None)
+
+    async def add(
+        self,
+        *,
+        guild_id: Optional[int],
+        channel_id: Optional[int],
+        start_message_id: int,
+        end_message_id: int,
+        message_count: int,
+        content: str,
+    ) -> ConversationSummary:
+        summary = ConversationSummary(
+            guild_id=guild_id,
+            channel_id=None if guild_id is not None else channel_id,
+            start_message_id=start_message_id,
+            end_message_id=end_message_id,
+            message_count=message_count,
+            content=content,
+        )
+        async with _write_session(guild_id, channel_id) as s:
+            s.add(summary)
+            await s.commit()
+            await s.refresh(summary)
+            return summary
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .session import get_engine
+from .shards import get_shards
+from .repository import ConversationRepository
+from .cache import get_cache
+
+
+@dataclass(frozen=True)
+class RetentionRule:
+    max_age_days: Optional[int] = None
+    max_rows: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.max_age_days) or bool(self.max_rows)
+
+
+def parse_overrides(raw: str, default: RetentionRule) -> dict[int, RetentionRule]:
+    rules: dict[int, RetentionRule] = {}
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(":")
+        if len(parts) != 3:
+            raise ValueError(f"invalid retention override {item!r}; expected guild_id:days:rows")
+        guild, days, rows = (p.strip() for p in parts)
+        rules[int(guild)] = RetentionRule(
+            max_age_days=default.max_age_days if days == "" else (int(days) or None),
+            max_rows=default.max_rows if rows == "" else (int(rows) or None),
+        )
+    return rules
+
+
+def rule_for(default: RetentionRule, overrides: dict[int, RetentionRule], guild_id: Optional[int]) -> RetentionRule:
+    if guild_id is None:
+        return default
+    return overrides.get(guild_id, default)
+
+
+@dataclass
+class PruneReport:
+    by_age: int = 0
+    by_count: int = 0
+    batches: int = 0
+    freed_pages: int = 0
+    seconds: float = 0.0
+
+    @property
+    def removed(self) -> int:
+        return self.by_age + self.by_count
+
+
+class MessagePruner:
+    def __init__(
+        self,
+        default: RetentionRule,
+        overrides: Optional[dict[int, RetentionRule]] = None,
+        *,
+        repo: Optional[ConversationRepository] = None,
+        interval: float = 3600.0,
+        batch_size: int = 500,
+        pause: float = 0.05,
+        vacuum_pages: int = 2000,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._default = default
+        self._overrides = dict(overrides or {})
+        self._repo = repo or ConversationRepository()
+        self._interval = max(1.0, float(interval))
+        self._batch_size = max(1, int(batch_size))
+        self._pause = max(0.0, float(pause))
+        self._vacuum_pages = max(0, int(vacuum_pages))
+        self._task: Optional[asyncio.Task] = None
+        self._scan_id = 0
+        self._log = logger or logging.getLogger("memorybot.db.retention")
+        self.passes = 0
+        self.rows_removed = 0
+        self.seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="memorybot-retention")
+
+    def rule_for(self, guild_id: Optional[int]) -> RetentionRule:
+        return rule_for(self._default, self._overrides, guild_id)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._log.error("retention pass failed", exc_info=True)
+            await asyncio.sleep(self._interval)
+
+    async def _drain(self, step: Callable[[], Awaitable[int]], report: PruneReport) -> int:
+        total = 0
+        while True:
+            removed = await step()
+            report.batches += 1
+            total += removed
+            if removed < self._batch_size:
+                return total
+            if self._pause:
+                await asyncio.sleep(self._pause)
+
+    async def run_pass(self) -> PruneReport:
+        report = PruneReport()
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        if self._default.max_age_days:
+            cutoff = now - timedelta(days=self._default.max_age_days)
+            report.by_age += await self._drain(
+                lambda: self._repo.delete_older_than(cutoff, exclude_guilds=list(self._overrides), limit=self._batch_size),
+                report,
+            )
+        for guild_id, rule in self._overrides.items():
+            if not rule.max_age_days:
+                continue
+            cutoff_g = now - timedelta(days=rule.max_age_days)
+            report.by_age += await self._drain(
+                lambda: self._repo.delete_older_than(cutoff_g, guild_id=guild_id, limit=self._batch_size),
+                report,
+            )
+        touched: list[tuple[Optional[int], Optional[int]]] = []
+        scopes, self._scan_id = await self._repo.get_scopes_after_id(self._scan_id)
+        for guild_id, channel_id in scopes:
+            rule = self.rule_for(guild_id)
+            if not rule.max_rows:
+                continue
+            cursor = await self._repo.get_cursor_at(guild_id=guild_id, channel_id=channel_id, offset=rule.max_rows)
+            if cursor is None:
+                continue
+            removed = await self._drain(
+                lambda: self._repo.delete_through(guild_id=guild_id, channel_id=channel_id, through=cursor, limit=self._batch_size),
+                report,
+            )
+            if removed:
+                report.by_count += removed
+                touched.append((guild_id, channel_id))
+        cache = get_cache()
+        if cache is not None:
+            if report.by_age:
+                cache.invalidate()
+            else:
+                for guild_id, channel_id in touched:
+                    cache.invalidate(cache.scope_key(guild_id, channel_id))
+        if report.removed:
+            report.freed_pages = await self._incremental_vacuum()
+        report.seconds = time.perf_counter() - started
+        self.passes += 1
+        self.rows_removed += report.removed
+        self.seconds += report.seconds
+        self._log.info(
+            "retention pass removed=%d age=%d count=%d batches=%d freed_pages=%d in %.2fs",
+            report.removed,
+            report.by_age,
+            report.by_count,
+            report.batches,
+            report.freed_pages,
+            report.seconds,
+        )
+        return report
+
+    async def _incremental_vacuum(self) -> int:
+        shards = get_shards()
+        engines = [shard.engine for shard in shards.shards] if shards is not None else [get_engine()]
+        freed = 0
+        for engine in engines:
+            freed += await self._vacuum(engine)
+        return freed
+
+    async def _vacuum(self, engine: AsyncEngine) -> int:
+        if engine.dialect.name != "sqlite" or self._vacuum_pages <= 0:
+            return 0
+        async with engine.connect() as conn:
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            mode = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+            if mode != 2:
+                self._log.debug("auto_vacuum is not incremental; run compact-messages --vacuum once to enable it")
+                return 0
+            before = (await conn.execute(text("PRAGMA freelist_count"))).scalar() or 0
+            if before:
+                raw = await conn.get_raw_connection()
+                cursor = await raw.driver_connection.execute(f"PRAGMA incremental_vacuum({self._vacuum_pages})")
+                await cursor.fetchall()
+                await cursor.close()
+            after = (await conn.execute(text("PRAGMA freelist_count"))).scalar() or 0
+        return max(0, before - after)
+
+    async def close(self) -> None:
+        task = self._task
+        self._task = None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def stats(self) -> dict[str, Any]:
+        return {"passes": self.passes, "rows_removed": self.rows_removed, "seconds": round(self.seconds, 3)}
+
+
+_pruner: Optional[MessagePruner] = None
+
+
+def start_pruner(
+    default: RetentionRule,
+    overrides: Optional[dict[int, RetentionRule]] = None,
+    *,
+    interval: float = 3600.0,
+    batch_size: int = 500,
+    pause: float = 0.05,
+    vacuum_pages: int = 2000,
+) -> MessagePruner:
+    global _pruner
+    if _pruner is None or not _pruner.running:
+        _pruner = MessagePruner(
+            default,
+            overrides,
+            interval=interval,
+            batch_size=batch_size,
+            pause=pause,
+            vacuum_pages=vacuum_pages,
+        )
+        _pruner.start()
+    return _pruner
+
+
+def get_pruner() -> Optional[MessagePruner]:
+    p = _pruner
+    if p is None or not p.running:
+        return None
+    return p
+
+
+async def stop_pruner() -> None:
+    global _pruner
+    p = _pruner
+    _pruner = None
+    if p is None:
+        return
+    await p.close()
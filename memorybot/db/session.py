@@ -1,18 +1,68 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Any, Optional
 
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker, AsyncSession
 
 _engine: Optional[AsyncEngine] = None
+_read_engine: Optional[AsyncEngine] = None
 _session_maker: Optional[async_sessionmaker[AsyncSession]] = None
+_read_session_maker: Optional[async_sessionmaker[AsyncSession]] = None
 
 
-async def init_engine(database_url: str) -> None:
-    global _engine, _session_maker
-    if _engine is None:
-        _engine = create_async_engine(database_url, pool_pre_ping=True, pool_recycle=1800)
-        _session_maker = async_sessionmaker(_engine, expire_on_commit=False)
+def _is_file_sqlite(database_url: str) -> bool:
+    url = make_url(database_url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:") and "mode=memory" not in str(url)
+
+
+def _install_pragmas(engine: AsyncEngine, pragmas: dict[str, Any]) -> None:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, _record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def create_engines(
+    database_url: str,
+    *,
+    sqlite_tuned: bool = True,
+    read_pool_size: int = 4,
+    mmap_mb: int = 256,
+    cache_mb: int = 64,
+    busy_timeout_ms: int = 5000,
+) -> tuple[AsyncEngine, AsyncEngine]:
+    if not (sqlite_tuned and _is_file_sqlite(database_url)):
+        engine = create_async_engine(database_url, pool_pre_ping=True, pool_recycle=1800)
+        return engine, engine
+    pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": int(busy_timeout_ms),
+        "mmap_size": int(mmap_mb) * 1024 * 1024,
+        "cache_size": -int(cache_mb) * 1024,
+        "temp_store": "MEMORY",
+    }
+    engine = create_async_engine(database_url, pool_size=1, max_overflow=0)
+    _install_pragmas(engine, {"auto_vacuum": "INCREMENTAL", **pragmas})
+    readers = max(1, int(read_pool_size))
+    read_engine = create_async_engine(database_url, pool_size=readers, max_overflow=readers)
+    _install_pragmas(read_engine, {**pragmas, "query_only": "ON"})
+    return engine, read_engine
+
+
+async def init_engine(database_url: str, **options: Any) -> None:
+    global _engine, _read_engine, _session_maker, _read_session_maker
+    if _engine is not None:
+        return
+    _engine, _read_engine = create_engines(database_url, **options)
+    _session_maker = async_sessionmaker(_engine, expire_on_commit=False)
+    _read_session_maker = async_sessionmaker(_read_engine, expire_on_commit=False)
 
 
 def get_engine() -> AsyncEngine:
@@ -21,17 +71,31 @@ def get_engine() -> AsyncEngine:
     return _engine
 
 
+def get_read_engine() -> AsyncEngine:
+    if _read_engine is None:
+        raise RuntimeError("database engine is not initialized")
+    return _read_engine
+
+
 def session() -> AsyncSession:
     if _session_maker is None:
         raise RuntimeError("database session maker is not initialized")
     return _session_maker()
 
 
-async def close_engine() -> None:
-    global _engine, _session_maker
-    eng = _engine
-    _session_maker = None
-    _engine = None
+def read_session() -> AsyncSession:
+    if _read_session_maker is None:
+        raise RuntimeError("database session maker is not initialized")
+    return _read_session_maker()
+
+
+async def dispose_engines(eng: Optional[AsyncEngine], read_eng: Optional[AsyncEngine] = None) -> None:
+    if read_eng is not None and read_eng is not eng:
+        await _dispose(read_eng)
+    await _dispose(eng)
+
+
+async def _dispose(eng: Optional[AsyncEngine]) -> None:
     if eng is None:
         return
     dispose = getattr(eng, "dispose", None)
@@ -40,3 +104,13 @@ async def close_engine() -> None:
     res = dispose()
     if hasattr(res, "__await__"):
         await res
+
+
+async def close_engine() -> None:
+    global _engine, _read_engine, _session_maker, _read_session_maker
+    eng, read_eng = _engine, _read_engine
+    _session_maker = None
+    _read_session_maker = None
+    _engine = None
+    _read_engine = None
+    await dispose_engines(eng, read_eng)
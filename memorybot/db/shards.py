@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from .session import create_engines, dispose_engines
+from .models import ConversationSummary, Message
+from .migrations import upgrade
+from .writer import MessageWriteQueue
+from .cache import get_cache
+
+
+_EPOCH_MS = 1704067200000
+_SLOT_BITS = 10
+_SEQ_BITS = 12
+_SEQ_MASK = (1 << _SEQ_BITS) - 1
+MAX_SHARDS = 1 << _SLOT_BITS
+
+
+def shard_key(guild_id: Optional[int], channel_id: Optional[int]) -> str:
+    if guild_id is not None:
+        return f"g:{guild_id}"
+    if channel_id is not None:
+        return f"c:{channel_id}"
+    raise ValueError("guild_id or channel_id is required")
+
+
+def _parse_key(key: str) -> tuple[Optional[int], Optional[int]]:
+    kind, _, value = key.partition(":")
+    if kind == "g":
+        return int(value), None
+    if kind == "c":
+        return None, int(value)
+    raise ValueError(f"invalid shard key {key!r}")
+
+
+def _key_filter(key: str):
+    guild_id, channel_id = _parse_key(key)
+    if guild_id is not None:
+        return Message.guild_id == guild_id
+    return and_(Message.guild_id.is_(None), Message.channel_id == channel_id)
+
+
+def _summary_filter(key: str):
+    guild_id, channel_id = _parse_key(key)
+    if guild_id is not None:
+        return ConversationSummary.guild_id == guild_id
+    return and_(ConversationSummary.guild_id.is_(None), ConversationSummary.channel_id == channel_id)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def id_floor(epoch_ms: int) -> int:
+    return max(0, epoch_ms - _EPOCH_MS) << (_SEQ_BITS + _SLOT_BITS)
+
+
+class IdAllocator:
+    def __init__(self, slot: int, last_id: int = 0, *, lane: int = 0, lanes: int = 1):
+        if not 0 <= slot < MAX_SHARDS:
+            raise ValueError(f"shard slot must be in [0, {MAX_SHARDS})")
+        if not 0 <= lane < lanes <= _SEQ_MASK + 1:
+            raise ValueError(f"id lane must be in [0, {lanes})")
+        self._slot = slot
+        self._lane = lane
+        self._lanes = lanes
+        self._ms = last_id >> (_SEQ_BITS + _SLOT_BITS)
+        self._seq = (last_id >> _SLOT_BITS) & _SEQ_MASK
+
+    def next(self) -> int:
+        ms = int(time.time() * 1000) - _EPOCH_MS
+        if ms > self._ms:
+            self._ms, self._seq = ms, self._lane
+        else:
+            self._seq += 1
+            self._seq += (self._lane - self._seq) % self._lanes
+            if self._seq > _SEQ_MASK:
+                self._ms, self._seq = self._ms + 1, self._lane
+        return (self._ms << (_SEQ_BITS + _SLOT_BITS)) | (self._seq << _SLOT_BITS) | self._slot
+
+
+class ShardMap:
+    def __init__(
+        self,
+        path: Path,
+        count: int,
+        pins: Optional[dict[str, int]] = None,
+        moving: Optional[dict[str, tuple[int, int]]] = None,
+    ):
+        self.path = path
+        self.count = count
+        self.pins = dict(pins or {})
+        self.moving = dict(moving or {})
+
+    @classmethod
+    def load(cls, path: Path, default_count: int) -> "ShardMap":
+        if not path.exists():
+            return cls(path, default_count)
+        data = json.loads(path.read_text())
+        shard_map = cls(path, int(data["count"]), {k: int(v) for k, v in data.get("pins", {}).items()})
+        for key, value in data.get("moving", {}).items():
+            if isinstance(value, list):
+                shard_map.moving[key] = (int(value[0]), int(value[1]))
+            else:
+                shard_map.moving[key] = (int(value), shard_map.route(key))
+        return shard_map
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".json.tmp")
+        moving = {k: [source, target] for k, (source, target) in self.moving.items()}
+        tmp.write_text(json.dumps({"count": self.count, "pins": self.pins, "moving": moving}, sort_keys=True))
+        os.replace(tmp, self.path)
+
+    def route(self, key: str) -> int:
+        pinned = self.pins.get(key)
+        if pinned is not None:
+            return pinned
+        return jump_hash(_hash(key), self.count)
+
+
+class Shard:
+    def __init__(self, index: int, path: Path, engine: AsyncEngine, read_engine: AsyncEngine, *, lane: int = 0, lanes: int = 1):
+        self.index = index
+        self.path = path
+        self.engine = engine
+        self.read_engine = read_engine
+        self._session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        self._read_session_maker = async_sessionmaker(read_engine, expire_on_commit=False)
+        self._lane = lane
+        self._lanes = lanes
+        self.ids = IdAllocator(index, lane=lane, lanes=lanes)
+        self.writer: Optional[MessageWriteQueue] = None
+
+    def session(self) -> AsyncSession:
+        return self._session_maker()
+
+    def read_session(self) -> AsyncSession:
+        return self._read_session_maker()
+
+    async def open(self) -> None:
+        async with self.engine.begin() as conn:
+            await conn.run_sync(upgrade)
+        async with self.session() as s:
+            last = (await s.execute(select(func.max(Message.id)))).scalar()
+        self.ids = IdAllocator(self.index, last or 0, lane=self._lane, lanes=self._lanes)
+
+    def start_writer(self, **options: Any) -> None:
+        if self.writer is not None and self.writer.running:
+            return
+        self.writer = MessageWriteQueue(session_factory=self.session, ids=self.ids.next, name=f"memorybot-db-writer-{self.index}", **options)
+        self.writer.start()
+
+    async def flush(self) -> None:
+        if self.writer is not None:
+            await self.writer.flush()
+
+    async def scope_sizes(self) -> dict[str, int]:
+        stmt = (
+            select(Message.guild_id, Message.channel_id, func.count())
+            .group_by(Message.guild_id, Message.channel_id)
+        )
+        sizes: dict[str, int] = {}
+        async with self.read_session() as s:
+            for guild_id, channel_id, n in (await s.execute(stmt)).all():
+                key = shard_key(guild_id, channel_id)
+                sizes[key] = sizes.get(key, 0) + n
+        return sizes
+
+    async def close(self) -> None:
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            await writer.close()
+        await dispose_engines(self.engine, self.read_engine)
+
+
+async def _insert_summaries(target: Shard, key: str, summaries: list[ConversationSummary]) -> None:
+    columns = [c.key for c in ConversationSummary.__table__.columns if c.key != "id"]
+    async with target.session() as t:
+        present = set((await t.execute(select(ConversationSummary.end_message_id).where(_summary_filter(key)))).scalars())
+        rows = [{c: getattr(m, c) for c in columns} for m in summaries if m.end_message_id not in present]
+        if rows:
+            await t.execute(insert(ConversationSummary), rows)
+            await t.commit()
+
+
+class ShardSet:
+    def __init__(
+        self,
+        root: str | os.PathLike[str],
+        count: int,
+        *,
+        settle: float = 2.0,
+        batch_size: int = 1000,
+        lane: int = 0,
+        lanes: int = 1,
+        **engine_options: Any,
+    ):
+        if not 1 <= count <= MAX_SHARDS:
+            raise ValueError(f"shard count must be in [1, {MAX_SHARDS}]")
+        self.root = Path(root)
+        self.lane = lane
+        self.lanes = lanes
+        self._count = count
+        self._settle_ms = int(max(0.0, float(settle)) * 1000)
+        self._batch_size = max(1, int(batch_size))
+        self._engine_options = engine_options
+        self._writer_options: Optional[dict[str, Any]] = None
+        self._map: Optional[ShardMap] = None
+        self._shards: list[Shard] = []
+        self._lock = asyncio.Lock()
+        self._log = logging.getLogger("memorybot.db.shards")
+
+    @property
+    def shards(self) -> list[Shard]:
+        return list(self._shards)
+
+    async def _open_shard(self, index: int) -> Shard:
+        path = self.root / f"shard-{index:03d}.db"
+        engine, read_engine = create_engines(f"sqlite+aiosqlite:///{path}", **self._engine_options)
+        shard = Shard(index, path, engine, read_engine, lane=self.lane, lanes=self.lanes)
+        await shard.open()
+        if self._writer_options is not None:
+            shard.start_writer(**self._writer_options)
+        return shard
+
+    async def open(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._map = ShardMap.load(self.root / "shards.json", self._count)
+        if self._map.count != self._count:
+            self._log.warning("shard map has %d shards; ignoring configured count %d", self._map.count, self._count)
+        if self.lane == 0:
+            self._map.save()
+        for index in range(self._map.count):
+            self._shards.append(await self._open_shard(index))
+        if self.lane != 0:
+            return
+        for key, (source, target) in list(self._map.moving.items()):
+            self._log.info("resuming interrupted move of %s shard %d -> %d", key, source, target)
+            await self._finish_move(key, source, target)
+
+    def _shard_map(self) -> ShardMap:
+        if self._map is None:
+            raise RuntimeError("shard set is not open")
+        return self._map
+
+    def route(self, guild_id: Optional[int], channel_id: Optional[int]) -> Shard:
+        return self._shards[self._shard_map().route(shard_key(guild_id, channel_id))]
+
+    def read_shards(self, guild_id: Optional[int], channel_id: Optional[int]) -> list[Shard]:
+        shard_map = self._shard_map()
+        key = shard_key(guild_id, channel_id)
+        shard = self._shards[shard_map.route(key)]
+        moving = shard_map.moving.get(key)
+        if moving is None or moving[0] == shard.index:
+            return [shard]
+        return [shard, self._shards[moving[0]]]
+
+    def settled_id(self) -> int:
+        return id_floor(int(time.time() * 1000) - self._settle_ms)
+
+    def start_writers(self, **options: Any) -> None:
+        self._writer_options = options
+        for shard in self._shards:
+            shard.start_writer(**options)
+
+    async def flush(self) -> None:
+        await asyncio.gather(*(shard.flush() for shard in self._shards))
+
+    async def _copy_scope(self, key: str, source: Shard, target: Shard) -> int:
+        moved = 0
+        columns = [c.key for c in Message.__table__.columns]
+        while True:
+            async with source.session() as s:
+                rows = list((await s.execute(select(Message).where(_key_filter(key)).order_by(Message.id).limit(self._batch_size))).scalars())
+            if not rows:
+                break
+            async with target.session() as t:
+                await t.execute(insert(Message).prefix_with("OR IGNORE"), [{c: getattr(m, c) for c in columns} for m in rows])
+                await t.commit()
+            async with source.session() as s:
+                await s.execute(delete(Message).where(Message.id.in_([m.id for m in rows])))
+                await s.commit()
+            moved += len(rows)
+        async with source.session() as s:
+            summaries = list((await s.execute(select(ConversationSummary).where(_summary_filter(key)))).scalars())
+        if summaries:
+            await _insert_summaries(target, key, summaries)
+            async with source.session() as s:
+                await s.execute(delete(ConversationSummary).where(ConversationSummary.id.in_([m.id for m in summaries])))
+                await s.commit()
+        return moved
+
+    async def _finish_move(self, key: str, source: int, target: int) -> int:
+        shard_map = self._shard_map()
+        await self._shards[source].flush()
+        moved = await self._copy_scope(key, self._shards[source], self._shards[target])
+        shard_map.moving.pop(key, None)
+        shard_map.save()
+        cache = get_cache()
+        if cache is not None:
+            cache.invalidate(cache.scope_key(*_parse_key(key)))
+        return moved
+
+    async def _relocate(self, moves: dict[str, tuple[int, int]], update: Any) -> int:
+        shard_map = self._shard_map()
+        moved = 0
+        shard_map.moving.update(moves)
+        update()
+        shard_map.save()
+        for key, (source, target) in moves.items():
+            moved += await self._finish_move(key, source, target)
+        return moved
+
+    async def move(self, guild_id: Optional[int], channel_id: Optional[int], target: int) -> int:
+        async with self._lock:
+            shard_map = self._shard_map()
+            if not 0 <= target < shard_map.count:
+                raise ValueError(f"shard {target} does not exist")
+            key = shard_key(guild_id, channel_id)
+            source = shard_map.route(key)
+            if source == target:
+                return 0
+
+            def pin() -> None:
+                shard_map.pins[key] = target
+
+            moved = await self._relocate({key: (source, target)}, pin)
+            self._log.info("moved %s shard %d -> %d rows=%d", key, source, target, moved)
+            return moved
+
+    async def split(self) -> tuple[int, int]:
+        async with self._lock:
+            shard_map = self._shard_map()
+            if shard_map.count >= MAX_SHARDS:
+                raise ValueError("shard limit reached")
+            index = shard_map.count
+            if len(self._shards) <= index:
+                self._shards.append(await self._open_shard(index))
+            moves: dict[str, tuple[int, int]] = {}
+            for shard in self._shards[:index]:
+                for key in await shard.scope_sizes():
+                    if key not in shard_map.pins and jump_hash(_hash(key), index + 1) == index:
+                        moves[key] = (shard.index, index)
+
+            def grow() -> None:
+                shard_map.count = index + 1
+
+            moved = await self._relocate(moves, grow)
+            self._log.info("split added shard %d scopes=%d rows=%d", index, len(moves), moved)
+            return index, moved
+
+    async def rebalance(self, *, max_moves: int = 5) -> list[tuple[str, int, int, int]]:
+        sizes = await asyncio.gather(*(shard.scope_sizes() for shard in self._shards))
+        totals = [sum(s.values()) for s in sizes]
+        plan: list[tuple[str, int, int, int]] = []
+        while len(plan) < max_moves:
+            source = max(range(len(totals)), key=totals.__getitem__)
+            target = min(range(len(totals)), key=totals.__getitem__)
+            gap = totals[source] - totals[target]
+            candidates = [(n, k) for k, n in sizes[source].items() if n * 2 <= gap]
+            if source == target or not candidates:
+                break
+            n, key = max(candidates)
+            sizes[source].pop(key)
+            sizes[target][key] = n
+            totals[source] -= n
+            totals[target] += n
+            plan.append((key, source, target, n))
+        for key, source, target, _ in plan:
+            await self.move(*_parse_key(key), target)
+        return plan
+
+    async def absorb(self, session_factory: Any) -> int:
+        columns = [c.key for c in Message.__table__.columns]
+        absorbed = 0
+        async with self._lock:
+            while True:
+                async with session_factory() as s:
+                    rows = list((await s.execute(select(Message).order_by(Message.id).limit(self._batch_size))).scalars())
+                if not rows:
+                    break
+                groups: dict[int, list[dict[str, Any]]] = {}
+                for m in rows:
+                    groups.setdefault(self.route(m.guild_id, m.channel_id).index, []).append({c: getattr(m, c) for c in columns})
+                for index, batch in groups.items():
+                    async with self._shards[index].session() as t:
+                        await t.execute(insert(Message).prefix_with("OR IGNORE"), batch)
+                        await t.commit()
+                async with session_factory() as s:
+                    await s.execute(delete(Message).where(Message.id.in_([m.id for m in rows])))
+                    await s.commit()
+                absorbed += len(rows)
+            async with session_factory() as s:
+                summaries = list((await s.execute(select(ConversationSummary))).scalars())
+            by_key: dict[str, list[ConversationSummary]] = {}
+            for m in summaries:
+                by_key.setdefault(shard_key(m.guild_id, m.channel_id), []).append(m)
+            for key, group in by_key.items():
+                await _insert_summaries(self._shards[self._shard_map().route(key)], key, group)
+            if summaries:
+                async with session_factory() as s:
+                    await s.execute(delete(ConversationSummary))
+                    await s.commit()
+        self._log.info("absorbed %d rows and %d summaries into shards", absorbed, len(summaries))
+        return absorbed
+
+    async def stats(self) -> list[dict[str, Any]]:
+        out: list[dict[str, Any]] = []
+        shard_map = self._shard_map()
+        for shard, sizes in zip(self._shards, await asyncio.gather(*(s.scope_sizes() for s in self._shards))):
+            out.append(
+                {
+                    "shard": shard.index,
+                    "scopes": len(sizes),
+                    "rows": sum(sizes.values()),
+                    "pinned": sum(1 for v in shard_map.pins.values() if v == shard.index),
+                    "bytes": shard.path.stat().st_size if shard.path.exists() else 0,
+                }
+            )
+        return out
+
+    async def close(self) -> None:
+        shards, self._shards = self._shards, []
+        for shard in shards:
+            await shard.close()
+
+
+_shards: Optional[ShardSet] = None
+
+
+async def init_shards(
+    root: str | os.PathLike[str], count: int, *, settle: float = 2.0, lane: int = 0, lanes: int = 1, **engine_options: Any
+) -> ShardSet:
+    global _shards
+    if _shards is None:
+        shards = ShardSet(root, count, settle=settle, lane=lane, lanes=lanes, **engine_options)
+        await shards.open()
+        _shards = shards
+    return _shards
+
+
+def get_shards() -> Optional[ShardSet]:
+    return _shards
+
+
+async def close_shards() -> None:
+    global _shards
+    s = _shards
+    _shards = None
+    if s is None:
+        return
+    await s.close()
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_INITIAL_CAPACITY = 1024
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("semantic memory requires numpy; install with `pip install memorybot[memory]`")
+
+
+def scope_name(guild_id: Optional[int], channel_id: Optional[int]) -> str:
+    if guild_id is not None:
+        return f"g{guild_id}"
+    if channel_id is not None:
+        return f"c{channel_id}"
+    raise ValueError("guild_id or channel_id is required")
+
+
+class _Ivf:
+    __slots__ = ("centroids", "order", "offsets", "rows", "tail", "assigned")
+
+    def __init__(self, centroids: Any, order: Any, offsets: Any, rows: int):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.rows = rows
+        self.tail = np.empty(0, dtype=np.int32)
+        self.assigned = 0
+
+    def assign(self, vectors: Any) -> None:
+        n = len(vectors)
+        if n == 0:
+            return
+        end = self.assigned + n
+        tail = self.tail
+        if end > len(tail):
+            tail = np.empty(max(end, 2 * len(tail), _INITIAL_CAPACITY), dtype=np.int32)
+            tail[:self.assigned] = self.tail[:self.assigned]
+        tail[self.assigned:end] = np.argmax(np.asarray(vectors) @ self.centroids.T, axis=1)
+        self.tail = tail
+        self.assigned = end
+
+
+class ScopeIndex:
+    def __init__(self, root: Path, name: str, dim: int, *, ivf_min_rows: int = 100_000, nprobe: int = 8):
+        require_numpy()
+        self.name = name
+        self.dim = int(dim)
+        self._ivf_min_rows = max(1, int(ivf_min_rows))
+        self._nprobe = max(1, int(nprobe))
+        self._vec_path = root / f"{name}.f32"
+        self._ids_path = root / f"{name}.ids"
+        self._meta_path = root / f"{name}.json"
+        self._ivf_path = root / f"{name}.ivf.npz"
+        self.count = 0
+        self.last_id = 0
+        self._capacity = 0
+        self._ivf: Optional[_Ivf] = None
+        self._training = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+            if int(meta.get("dim", self.dim)) != self.dim:
+                raise ValueError(f"index {self.name} has dim {meta.get('dim')}, expected {self.dim}")
+            self.count = int(meta.get("count", 0))
+            self.last_id = int(meta.get("last_id", 0))
+        capacity = max(_INITIAL_CAPACITY, self.count)
+        if self._vec_path.exists():
+            capacity = max(capacity, self._vec_path.stat().st_size // (4 * self.dim))
+        self._map(capacity)
+        if self._ivf_path.exists():
+            with np.load(self._ivf_path) as data:
+                rows = int(data["rows"])
+                if rows <= self.count:
+                    self._ivf = _Ivf(data["centroids"], data["order"], data["offsets"], rows)
+                    self._assign_tail(self._ivf)
+
+    def _map(self, capacity: int) -> None:
+        for path, width in ((self._vec_path, 4 * self.dim), (self._ids_path, 8)):
+            size = capacity * width
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        self._vectors = np.memmap(self._vec_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._ids = np.memmap(self._ids_path, dtype=np.int64, mode="r+", shape=(capacity,))
+        self._capacity = capacity
+
+    def _assign_tail(self, ivf: _Ivf) -> None:
+        chunk = 65536
+        for start in range(ivf.rows + ivf.assigned, self.count, chunk):
+            ivf.assign(self._vectors[start:min(start + chunk, self.count)])
+
+    def add(self, ids: Any, vectors: Any) -> int:
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        fresh = ids > self.last_id
+        ids, vectors = ids[fresh], vectors[fresh]
+        n = len(ids)
+        if n == 0:
+            return 0
+        with self._lock:
+            needed = self.count + n
+            if needed > self._capacity:
+                capacity = self._capacity
+                while capacity < needed:
+                    capacity *= 2
+                self._vectors.flush()
+                self._ids.flush()
+                self._map(capacity)
+            self._vectors[self.count:needed] = vectors
+            self._ids[self.count:needed] = ids
+            self.count = needed
+            self.last_id = int(ids.max())
+            if self._ivf is not None:
+                self._assign_tail(self._ivf)
+        return n
+
+    def flush(self) -> None:
+        self._vectors.flush()
+        self._ids.flush()
+        tmp = self._meta_path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"dim": self.dim, "count": self.count, "last_id": self.last_id}))
+        os.replace(tmp, self._meta_path)
+
+    def needs_training(self) -> bool:
+        if self._training or self.count < self._ivf_min_rows:
+            return False
+        ivf = self._ivf
+        return ivf is None or self.count - ivf.rows > ivf.rows // 2
+
+    def train(self, *, iterations: int = 8, sample_per_list: int = 64, seed: int = 0) -> None:
+        self._training = True
+        try:
+            rows = self.count
+            vectors = self._vectors
+            nlist = max(1, int(np.sqrt(rows)))
+            rng = np.random.default_rng(seed)
+            sample_size = min(rows, nlist * sample_per_list)
+            sample = np.asarray(vectors[np.sort(rng.choice(rows, size=sample_size, replace=False))])
+            centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                filled = norms[:, 0] > 0
+                centroids[filled] = sums[filled] / norms[filled]
+            labels = np.empty(rows, dtype=np.int32)
+            chunk = 65536
+            for start in range(0, rows, chunk):
+                block = np.asarray(vectors[start:min(start + chunk, rows)])
+                labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable").astype(np.int64)
+            offsets = np.zeros(nlist + 1, dtype=np.int64)
+            np.cumsum(np.bincount(labels, minlength=nlist), out=offsets[1:])
+            ivf = _Ivf(centroids, order, offsets, rows)
+            tmp = self._ivf_path.with_suffix(".tmp.npz")
+            np.savez(tmp, centroids=centroids, order=order, offsets=offsets, rows=np.int64(rows))
+            os.replace(tmp, self._ivf_path)
+            with self._lock:
+                self._assign_tail(ivf)
+                self._ivf = ivf
+        finally:
+            self._training = False
+
+    def search(self, query: Any, k: int) -> list[tuple[int, float]]:
+        with self._lock:
+            n = self.count
+            ivf = self._ivf
+            tail = None if ivf is None else ivf.tail[:ivf.assigned]
+            vectors, ids = self._vectors, self._ids
+        if n == 0 or k <= 0:
+            return []
+        q = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        if ivf is None:
+            scores = vectors[:n] @ q
+            rows = None
+        else:
+            probes = np.argsort(ivf.centroids @ q)[-self._nprobe:]
+            parts = [ivf.order[ivf.offsets[c]:ivf.offsets[c + 1]] for c in probes]
+            probed = np.zeros(len(ivf.centroids), dtype=bool)
+            probed[probes] = True
+            parts.append(np.flatnonzero(probed[tail]) + ivf.rows)
+            rows = np.sort(np.concatenate(parts))
+            scores = vectors[rows] @ q
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        picked = top if rows is None else rows[top]
+        return [(int(ids[r]), float(scores[t])) for r, t in zip(picked, top)]
+
+    def stats(self) -> dict[str, Any]:
+        ivf = self._ivf
+        return {
+            "rows": self.count,
+            "ivf_lists": 0 if ivf is None else len(ivf.centroids),
+            "ivf_rows": 0 if ivf is None else ivf.rows + ivf.assigned,
+        }
+
+
+class VectorIndex:
+    def __init__(self, root: str | os.PathLike[str], dim: int, *, ivf_min_rows: int = 100_000, nprobe: int = 8):
+        require_numpy()
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self.dim = int(dim)
+        self._ivf_min_rows = ivf_min_rows
+        self._nprobe = nprobe
+        self._scopes: dict[str, ScopeIndex] = {}
+        self._lock = threading.Lock()
+        self._state_path = self._root / "state.json"
+        self._log = logging.getLogger("memorybot.db.vector_index")
+
+    def scope(self, name: str) -> ScopeIndex:
+        idx = self._scopes.get(name)
+        if idx is None:
+            with self._lock:
+                idx = self._scopes.get(name)
+                if idx is None:
+                    idx = ScopeIndex(self._root, name, self.dim, ivf_min_rows=self._ivf_min_rows, nprobe=self._nprobe)
+                    self._scopes[name] = idx
+        return idx
+
+    def has_scope(self, name: str) -> bool:
+        return name in self._scopes or (self._root / f"{name}.json").exists()
+
+    def add(self, name: str, ids: Any, vectors: Any) -> int:
+        return self.scope(name).add(ids, vectors)
+
+    def search(self, name: str, query: Any, k: int) -> list[tuple[int, float]]:
+        if not self.has_scope(name):
+            return []
+        return self.scope(name).search(query, k)
+
+    def flush(self) -> None:
+        for idx in list(self._scopes.values()):
+            idx.flush()
+
+    def watermark(self) -> int:
+        if not self._state_path.exists():
+            return 0
+        return int(json.loads(self._state_path.read_text()).get("watermark", 0))
+
+    def save_watermark(self, value: int) -> None:
+        self.flush()
+        tmp = self._state_path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"watermark": int(value)}))
+        os.replace(tmp, self._state_path)
+
+    def pending_training(self) -> list[ScopeIndex]:
+        return [idx for idx in self._scopes.values() if idx.needs_training()]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "scopes": len(self._scopes),
+            "rows": sum(idx.count for idx in self._scopes.values()),
+            "ivf_scopes": sum(1 for idx in self._scopes.values() if idx.stats()["ivf_lists"]),
+        }
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import logging
+import os
+import random
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Iterable, Optional, Sequence
+
+from sqlalchemy import JSON, Column, Float, Index, Integer, MetaData, String, Table, Text, delete, exists, func, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .session import create_engines, dispose_engines
+from .shards import shard_key
+
+
+READY = "ready"
+LEASED = "leased"
+DEAD = "dead"
+DONE = "done"
+
+metadata = MetaData()
+
+jobs = Table(
+    "jobs",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("queue", String(32), nullable=False),
+    Column("scope", String(64), nullable=False),
+    Column("part", Integer, nullable=False, default=0),
+    Column("key", String(128), nullable=True, unique=True),
+    Column("payload", JSON, nullable=False),
+    Column("state", String(8), nullable=False, default=READY),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("available_at", Float, nullable=False),
+    Column("lease_owner", String(64), nullable=True),
+    Column("lease_until", Float, nullable=True),
+    Column("created_at", Float, nullable=False),
+    Column("error", Text, nullable=True),
+    Index("ix_jobs_claim", "queue", "state", "available_at"),
+    Index("ix_jobs_scope", "queue", "scope", "id"),
+)
+
+
+def partition_key(guild_id: Optional[int], channel_id: Optional[int]) -> int:
+    return zlib.crc32(shard_key(guild_id, channel_id).encode())
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ("id", "queue", "scope", "payload", "attempts", "owner")
+
+    def __init__(self, id: int, queue: str, scope: str, payload: dict[str, Any], attempts: int, owner: str):
+        self.id = id
+        self.queue = queue
+        self.scope = scope
+        self.payload = payload
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self) -> str:
+        return f"Job({self.queue}#{self.id} scope={self.scope} attempt={self.attempts})"
+
+
+class WorkQueue:
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        *,
+        lease: float = 120.0,
+        max_attempts: int = 5,
+        backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        done_ttl: float = 86400.0,
+        busy_timeout_ms: int = 5000,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.path = Path(path)
+        self.lease = max(1.0, float(lease))
+        self.max_attempts = max(1, int(max_attempts))
+        self._backoff = max(0.0, float(backoff))
+        self._max_backoff = max(self._backoff, float(max_backoff))
+        self._done_ttl = max(0.0, float(done_ttl))
+        self._next_purge = 0.0
+        self._busy_timeout_ms = busy_timeout_ms
+        self._engine: Optional[AsyncEngine] = None
+        self._log = logger or logging.getLogger("memorybot.db.work_queue")
+        self.put_count = 0
+        self.claimed = 0
+        self.completed = 0
+        self.retried = 0
+        self.buried = 0
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            raise RuntimeError("work queue is not open")
+        return self._engine
+
+    async def open(self) -> None:
+        if self._engine is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        engine, read_engine = create_engines(
+            f"sqlite+aiosqlite:///{self.path}", read_pool_size=1, mmap_mb=0, cache_mb=8, busy_timeout_ms=self._busy_timeout_ms
+        )
+        if read_engine is not engine:
+            await dispose_engines(read_engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+        self._engine = engine
+
+    async def close(self) -> None:
+        engine = self._engine
+        self._engine = None
+        await dispose_engines(engine)
+
+    @staticmethod
+    def _row(queue: str, scope: str, payload: dict[str, Any], *, part: int, key: Optional[str], delay: float, now: float) -> dict[str, Any]:
+        return {
+            "queue": queue,
+            "scope": scope,
+            "part": part,
+            "key": key,
+            "payload": payload,
+            "state": READY,
+            "attempts": 0,
+            "available_at": now + delay,
+            "created_at": now,
+        }
+
+    async def put(self, queue: str, scope: str, payload: dict[str, Any], *, part: int = 0, key: Optional[str] = None, delay: float = 0.0) -> None:
+        await self.put_many([(queue, scope, payload, part, key)], delay=delay)
+
+    async def put_many(self, items: Iterable[tuple[str, str, dict[str, Any], int, Optional[str]]], *, delay: float = 0.0) -> None:
+        now = time.time()
+        rows = [self._row(q, s, p, part=part, key=key, delay=delay, now=now) for q, s, p, part, key in items]
+        if not rows:
+            return
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(jobs).on_conflict_do_nothing(index_elements=["key"]), rows)
+        self.put_count += len(rows)
+
+    async def claim(self, queue: str, owner: str, *, limit: int = 1, partition: Optional[tuple[int, int]] = None) -> list[Job]:
+        now = time.time()
+        older = jobs.alias("older")
+        blocked = exists().where(
+            older.c.queue == jobs.c.queue,
+            older.c.scope == jobs.c.scope,
+            older.c.id < jobs.c.id,
+            older.c.state.not_in((DEAD, DONE)),
+        )
+        candidates = select(jobs.c.id).where(
+            jobs.c.queue == queue,
+            or_(
+                (jobs.c.state == READY) & (jobs.c.available_at <= now),
+                (jobs.c.state == LEASED) & (jobs.c.lease_until < now),
+            ),
+            ~blocked,
+        )
+        if partition is not None and partition[1] > 1:
+            candidates = candidates.where(jobs.c.part % partition[1] == partition[0])
+        stmt = (
+            update(jobs)
+            .where(jobs.c.id.in_(candidates.order_by(jobs.c.id).limit(max(1, limit)).scalar_subquery()))
+            .values(state=LEASED, lease_owner=owner, lease_until=now + self.lease, attempts=jobs.c.attempts + 1)
+            .returning(jobs.c.id, jobs.c.scope, jobs.c.payload, jobs.c.attempts)
+        )
+        async with self.engine.begin() as conn:
+            rows = (await conn.execute(stmt)).all()
+        claimed = sorted((Job(r.id, queue, r.scope, r.payload, r.attempts, owner) for r in rows), key=lambda j: j.id)
+        out: list[Job] = []
+        for job in claimed:
+            if job.attempts > self.max_attempts:
+                await self.bury(job, "lease expired on the final attempt")
+                continue
+            out.append(job)
+        self.claimed += len(out)
+        return out
+
+    def _owned(self, job: Job):
+        return (jobs.c.id == job.id) & (jobs.c.lease_owner == job.owner) & (jobs.c.attempts == job.attempts) & (jobs.c.state == LEASED)
+
+    async def extend(self, job: Job) -> None:
+        async with self.engine.begin() as conn:
+            res = await conn.execute(update(jobs).where(self._owned(job)).values(lease_until=time.time() + self.lease))
+        if res.rowcount != 1:
+            raise LeaseLost(repr(job))
+
+    async def checkpoint(self, job: Job, payload: dict[str, Any]) -> None:
+        async with self.engine.begin() as conn:
+            res = await conn.execute(update(jobs).where(self._owned(job)).values(payload=payload))
+        if res.rowcount != 1:
+            raise LeaseLost(repr(job))
+        job.payload = payload
+
+    async def complete(self, job: Job, follow: Sequence[tuple[str, str, dict[str, Any], int, Optional[str]]] = ()) -> None:
+        now = time.time()
+        async with self.engine.begin() as conn:
+            res = await conn.execute(
+                update(jobs)
+                .where(self._owned(job), jobs.c.key.is_not(None))
+                .values(state=DONE, lease_owner=None, lease_until=None, available_at=now, payload={})
+            )
+            if res.rowcount == 0:
+                res = await conn.execute(delete(jobs).where(self._owned(job)))
+            if res.rowcount != 1:
+                raise LeaseLost(repr(job))
+            if now >= self._next_purge:
+                self._next_purge = now + min(self._done_ttl, 3600.0)
+                await conn.execute(delete(jobs).where(jobs.c.state == DONE, jobs.c.available_at < now - self._done_ttl))
+            if follow:
+                await conn.execute(
+                    insert(jobs).on_conflict_do_nothing(index_elements=["key"]),
+                    [self._row(q, s, p, part=part, key=key, delay=0.0, now=now) for q, s, p, part, key in follow],
+                )
+        self.completed += 1
+        self.put_count += len(follow)
+
+    def _delay(self, attempts: int) -> float:
+        delay = min(self._max_backoff, self._backoff * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def fail(self, job: Job, error: str) -> bool:
+        if job.attempts >= self.max_attempts:
+            await self.bury(job, error)
+            return False
+        delay = self._delay(job.attempts)
+        async with self.engine.begin() as conn:
+            res = await conn.execute(
+                update(jobs)
+                .where(self._owned(job))
+                .values(state=READY, lease_owner=None, lease_until=None, available_at=time.time() + delay, error=error[:2000])
+            )
+        if res.rowcount != 1:
+            raise LeaseLost(repr(job))
+        self.retried += 1
+        self._log.warning("%r failed; retrying in %.1fs: %s", job, delay, error)
+        return True
+
+    async def release(self, job: Job) -> None:
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                update(jobs)
+                .where(self._owned(job))
+                .values(state=READY, lease_owner=None, lease_until=None, attempts=jobs.c.attempts - 1, available_at=time.time())
+            )
+
+    async def bury(self, job: Job, error: str) -> None:
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                update(jobs)
+                .where(jobs.c.id == job.id, jobs.c.lease_owner == job.owner, jobs.c.attempts == job.attempts)
+                .values(state=DEAD, lease_owner=None, lease_until=None, error=error[:2000])
+            )
+        self.buried += 1
+        self._log.error("%r moved to the dead letter state after %d attempts: %s", job, job.attempts, error)
+
+    async def depth(self) -> dict[str, dict[str, int]]:
+        async with self.engine.connect() as conn:
+            rows = (
+                await conn.execute(
+                    select(jobs.c.queue, jobs.c.state, func.count()).where(jobs.c.state != DONE).group_by(jobs.c.queue, jobs.c.state)
+                )
+            ).all()
+        out: dict[str, dict[str, int]] = {}
+        for queue, state, n in rows:
+            out.setdefault(queue, {})[state] = int(n)
+        return out
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "put": self.put_count,
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "retried": self.retried,
+            "buried": self.buried,
+        }
+
+
+_queue: Optional[WorkQueue] = None
+
+
+async def init_work_queue(path: str | os.PathLike[str], **options: Any) -> WorkQueue:
+    global _queue
+    if _queue is None:
+        queue = WorkQueue(path, **options)
+        await queue.open()
+        _queue = queue
+    return _queue
+
+
+def get_work_queue() -> Optional[WorkQueue]:
+    return _queue
+
+
+async def close_work_queue() -> None:
+    global _queue
+    queue = _queue
+    _queue = None
+    if queue is not None:
+        await queue.close()
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import get_cache
+from .session import session
+from .models import Message
+
+
+class MessageWriteQueue:
+    def __init__(
+        self,
+        *,
+        batch_size: int = 64,
+        flush_interval: float = 0.01,
+        max_pending: int = 10000,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        ids: Optional[Callable[[], int]] = None,
+        name: str = "memorybot-db-writer",
+        attempts: int = 3,
+        retry_delay: float = 0.05,
+    ):
+        self._batch_size = max(1, int(batch_size))
+        self._flush_interval = max(0.0, float(flush_interval))
+        self._queue: asyncio.Queue[Optional[tuple[dict[str, Any], Optional[asyncio.Future]]]] = asyncio.Queue(maxsize=max(0, int(max_pending)))
+        self._session = session_factory or session
+        self._ids = ids
+        self._name = name
+        self._attempts = max(1, int(attempts))
+        self._retry_delay = max(0.0, float(retry_delay))
+        self._task: Optional[asyncio.Task] = None
+        self._log = logging.getLogger("memorybot.db.writer")
+        self.rows_written = 0
+        self.batches_written = 0
+        self.rows_failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name=self._name)
+
+    async def submit(self, row: dict[str, Any], *, wait: bool = True) -> None:
+        if not self.running:
+            raise RuntimeError("message write queue is not running")
+        fut: Optional[asyncio.Future] = asyncio.get_running_loop().create_future() if wait else None
+        await self._queue.put((row, fut))
+        if fut is not None:
+            await fut
+
+    async def flush(self) -> None:
+        if self.running:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        task = self._task
+        if task is None:
+            return
+        if not task.done():
+            await self._queue.put(None)
+            await task
+        self._task = None
+        self._log.debug("writer closed rows=%d batches=%d failed=%d", self.rows_written, self.batches_written, self.rows_failed)
+
+    async def _next_batch(self) -> tuple[list[tuple[dict[str, Any], Optional[asyncio.Future]]], bool]:
+        first = await self._queue.get()
+        if first is None:
+            self._queue.task_done()
+            return [], True
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._flush_interval
+        while len(batch) < self._batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                self._queue.task_done()
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _commit(self, batch: list[tuple[dict[str, Any], Optional[asyncio.Future]]]) -> None:
+        start = time.perf_counter()
+        rows = [row for row, _ in batch]
+        if self._ids is not None:
+            for row in rows:
+                if row.get("id") is None:
+                    row["id"] = self._ids()
+        cache = get_cache()
+        try:
+            for attempt in range(1, self._attempts + 1):
+                try:
+                    async with self._session() as s:
+                        await s.execute(insert(Message), rows)
+                        await s.commit()
+                    break
+                except Exception as e:
+                    if attempt < self._attempts:
+                        self._log.warning("batch insert failed rows=%d attempt=%d; retrying", len(batch), attempt, exc_info=e)
+                        await asyncio.sleep(self._retry_delay * attempt)
+                        continue
+                    self.rows_failed += len(batch)
+                    self._log.error("batch insert failed rows=%d; dropping it", len(batch), exc_info=e)
+                    if cache is not None:
+                        for key in {cache.scope_key(row["guild_id"], row["channel_id"]) for row in rows}:
+                            cache.invalidate(key)
+                    for _, fut in batch:
+                        if fut is not None and not fut.done():
+                            fut.set_exception(e)
+                    return
+            if cache is not None:
+                for row in rows:
+                    cache.append(Message(**row))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+        self.rows_written += len(batch)
+        self.batches_written += 1
+        for _, fut in batch:
+            if fut is not None and not fut.done():
+                fut.set_result(None)
+        self._log.debug("batch insert rows=%d in %.1fms", len(batch), (time.perf_counter() - start) * 1000)
+
+    async def _run(self) -> None:
+        while True:
+            batch, stop = await self._next_batch()
+            if batch:
+                await self._commit(batch)
+            if stop:
+                return
+
+
+_writer: Optional[MessageWriteQueue] = None
+
+
+def start_writer(*, batch_size: int = 64, flush_interval: float = 0.01, max_pending: int = 10000) -> MessageWriteQueue:
+    global _writer
+    if _writer is None or not _writer.running:
+        _writer = MessageWriteQueue(batch_size=batch_size, flush_interval=flush_interval, max_pending=max_pending)
+        _writer.start()
+    return _writer
+
+
+def get_writer() -> Optional[MessageWriteQueue]:
+    w = _writer
+    if w is None or not w.running:
+        return None
+    return w
+
+
+async def stop_writer() -> None:
+    global _writer
+    w = _writer
+    _writer = None
+    if w is None:
+        return
+    await w.close()
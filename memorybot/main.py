@@ -1,8 +1,22 @@
 import asyncio
 from dotenv import load_dotenv
+from .core.cluster import start_cluster
 from .core.runtime import start_bot
+from .core.worker import start_worker, start_workers
 
 
 def run() -> None:
     load_dotenv()
     asyncio.run(start_bot())
+
+
+def run_cluster() -> None:
+    raise SystemExit(asyncio.run(start_cluster()))
+
+
+def run_worker() -> None:
+    raise SystemExit(asyncio.run(start_worker()))
+
+
+def run_workers() -> None:
+    raise SystemExit(asyncio.run(start_workers()))
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Mapping, Sequence
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+_MESSAGE_OVERHEAD = 4
+_REPLY_PRIMING = 3
+_TRUNCATION_MARK = "…"
+_RECALL_HEADER = "Relevant earlier messages from this server (oldest first):"
+_SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+
+class TokenCounter:
+    def __init__(self, model: str, *, chars_per_token: float = 3.0):
+        self._model = model
+        self._chars_per_token = chars_per_token
+        self._encoding: Any = None
+        self._loading: asyncio.Future | None = None
+
+    def _load(self) -> Any:
+        log = logging.getLogger("memorybot.prompt.context")
+        if tiktoken is None:
+            log.debug("tiktoken not installed; using approximate token counts")
+            return None
+        try:
+            try:
+                return tiktoken.encoding_for_model(self._model)
+            except KeyError:
+                return tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            log.warning("tiktoken encoding unavailable (%s); using approximate token counts", e.__class__.__name__)
+            return None
+
+    async def load(self) -> None:
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(asyncio.to_thread(self._load))
+        self._encoding = await asyncio.shield(self._loading)
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return int(len(text) / self._chars_per_token) + 1
+
+    def truncate(self, text: str, max_tokens: int, *, keep: str = "head") -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            part = tokens[: max_tokens - 1] if keep == "head" else tokens[-(max_tokens - 1):]
+            body = self._encoding.decode(part)
+        else:
+            chars = max(0, int((max_tokens - 1) * self._chars_per_token))
+            body = text[:chars] if keep == "head" else text[-chars:]
+        return body + _TRUNCATION_MARK if keep == "head" else _TRUNCATION_MARK + body
+
+
+@dataclass
+class ContextWindow:
+    system_prompt: str | None
+    history: list[dict[str, str]]
+    text: str
+    tokens: int
+    budget: int
+    dropped: int = 0
+    truncated: int = 0
+    counts: dict[str, int] = field(default_factory=dict)
+
+
+class ContextBuilder:
+    def __init__(self, counter: TokenCounter, *, budget: int = 6000, min_entry_tokens: int = 48, memory_budget: int = 0):
+        self._counter = counter
+        self._budget = max(1, int(budget))
+        self._min_entry_tokens = max(1, int(min_entry_tokens))
+        self._memory_budget = max(0, int(memory_budget))
+
+    def _cost(self, content: str) -> int:
+        return self._counter.count(content) + _MESSAGE_OVERHEAD
+
+    def build(
+        self,
+        *,
+        system_prompt: str | None,
+        history: Sequence[Mapping[str, str]],
+        text: str,
+        duplicate_of: str | None = None,
+        recalled: Sequence[str] = (),
+        summary: str | None = None,
+    ) -> ContextWindow:
+        entries = [{"role": m["role"], "content": m["content"]} for m in history if m.get("role") and m.get("content")]
+        marker = text if duplicate_of is None else duplicate_of
+        for i in range(len(entries) - 1, -1, -1):
+            if entries[i]["role"] == "user" and entries[i]["content"] == marker:
+                del entries[i]
+                break
+        truncated = 0
+        text_tokens = self._cost(text)
+        system_tokens = self._cost(system_prompt) if system_prompt else 0
+        system_limit = self._budget - _REPLY_PRIMING - min(text_tokens, self._min_entry_tokens + _MESSAGE_OVERHEAD)
+        if system_tokens > system_limit:
+            logging.getLogger("memorybot.prompt.context").error(
+                "system prompt needs %d tokens but CONTEXT_TOKEN_BUDGET=%d leaves %d; truncating it",
+                system_tokens,
+                self._budget,
+                system_limit,
+            )
+            system_prompt = self._counter.truncate(system_prompt or "", system_limit - _MESSAGE_OVERHEAD) or None
+            system_tokens = self._cost(system_prompt) if system_prompt else 0
+            truncated += 1
+        remaining = self._budget - _REPLY_PRIMING - system_tokens
+        if text_tokens > remaining:
+            text = self._counter.truncate(text, max(remaining - _MESSAGE_OVERHEAD, 1))
+            text_tokens = self._cost(text)
+            truncated += 1
+        remaining -= text_tokens
+        preamble: list[dict[str, str]] = []
+        summary_tokens = 0
+        if summary and remaining - _MESSAGE_OVERHEAD >= self._min_entry_tokens:
+            content = self._counter.truncate(_SUMMARY_HEADER + "\n" + summary, remaining - _MESSAGE_OVERHEAD)
+            summary_tokens = self._cost(content)
+            remaining -= summary_tokens
+            preamble.append({"role": "system", "content": content})
+        memory: dict[str, str] | None = None
+        memory_tokens = 0
+        seen = {e["content"] for e in entries}
+        recalled = [r for r in recalled if r and r not in seen]
+        if recalled and self._memory_budget > 0:
+            allowance = min(self._memory_budget, remaining) - self._cost(_RECALL_HEADER)
+            lines: list[str] = []
+            for item in recalled:
+                cost = self._counter.count(item) + 1
+                if cost > allowance:
+                    continue
+                lines.append(item)
+                allowance -= cost
+            if lines:
+                memory = {"role": "system", "content": _RECALL_HEADER + "\n" + "\n".join(lines)}
+                memory_tokens = self._cost(memory["content"])
+                remaining -= memory_tokens
+        kept: list[dict[str, str]] = []
+        history_tokens = 0
+        for entry in reversed(entries):
+            cost = self._cost(entry["content"])
+            if cost <= remaining:
+                kept.append(entry)
+                remaining -= cost
+                history_tokens += cost
+                continue
+            if remaining - _MESSAGE_OVERHEAD >= self._min_entry_tokens:
+                content = self._counter.truncate(entry["content"], remaining - _MESSAGE_OVERHEAD, keep="tail")
+                cost = self._cost(content)
+                kept.append({"role": entry["role"], "content": content})
+                remaining -= cost
+                history_tokens += cost
+                truncated += 1
+            break
+        kept.reverse()
+        dropped = len(entries) - len(kept)
+        if memory is not None:
+            preamble.append(memory)
+        kept[:0] = preamble
+        used = _REPLY_PRIMING + system_tokens + summary_tokens + memory_tokens + history_tokens + text_tokens
+        return ContextWindow(
+            system_prompt=system_prompt,
+            history=kept,
+            text=text,
+            tokens=used,
+            budget=self._budget,
+            dropped=dropped,
+            truncated=truncated,
+            counts={"system": system_tokens, "summary": summary_tokens, "memory": memory_tokens, "history": history_tokens, "message": text_tokens},
+        )
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+from memorybot.db.models import Message
+
+
+_MAX_LINE_CHARS = 600
+
+
+def build_summary_prompt(*, max_words: int) -> str:
+    return (
+        "You maintain a running summary of a Discord conversation for a chatbot's long-term memory.\n"
+        "- Merge the previous summary (if any) with the new messages into one updated summary.\n"
+        "- Keep durable facts: who said what, user preferences, decisions, open questions, and ongoing topics.\n"
+        "- Refer to people by display name and keep user ids when they are given.\n"
+        "- Drop greetings, small talk, and details superseded by newer messages.\n"
+        f"- Reply with the summary only, in plain text, at most {max_words} words."
+    )
+
+
+def format_transcript(messages: Iterable[Message]) -> str:
+    lines: list[str] = []
+    for m in messages:
+        body = m.render().replace("\n", " ")
+        if len(body) > _MAX_LINE_CHARS:
+            body = body[: _MAX_LINE_CHARS - 1] + "…"
+        lines.append(f"[{m.id}] {m.role}: {body}")
+    return "\n".join(lines)
+
+
+def build_summary_input(previous: str | None, transcript: str) -> str:
+    head = f"Previous summary:\n{previous}" if previous else "Previous summary: (none)"
+    return f"{head}\n\nNew messages:\n{transcript}"
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Iterable
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
 
 
 def build_system_prompt(
@@ -10,6 +11,7 @@ def build_system_prompt(
     server_info: dict[str, Any] | None = None,
     tool_schemas: Iterable[dict[str, Any]] | None = None,
     tool_instructions: Iterable[str] | None = None,
+    native_tools: bool = False,
 ) -> str:
     name = bot_name.strip() or "Assistant"
     info = server_info or {}
@@ -21,30 +23,103 @@ def build_system_prompt(
         "Be clear and helpful, avoid long texts, and only include necessary details. "
         "If the user message lacks a direct question, offer brief, relevant guidance."
     )
-    contract = (
-        "Response Contract:\n"
-        "- Always return JSON matching: { message: { content: string }, tool?: { name: string, arguments: object } | null }\n"
-        "- If no tool is needed, set tool to null or omit it.\n"
-        "- Use only the tools described below and validate arguments against the given JSON Schemas."
-    )
-    tooling_policy = (
-        "Tool Usage Policy:\n"
-        "- Consider a tool call when external, current, or source-backed information is required.\n"
-        "- Do not call tools for conversational, opinionated, or self-contained questions.\n"
-        "- When calling a tool, set tool.name and tool.arguments to valid values.\n"
-        "- Do not invent tools or parameters that are not in the schemas."
-    )
-    tools_block = (
-        "Available Tools (as JSON Schemas):\n" + json.dumps(schemas, indent=2, ensure_ascii=False)
-        if schemas
-        else "Available Tools: []"
-    )
+    if native_tools:
+        contract = (
+            "Response Contract:\n"
+            "- Reply to the user in plain text.\n"
+            "- Use the provided function tools when needed; you may request several tool calls at once when they are independent.\n"
+            "- After tool results arrive, answer the user directly using them."
+        )
+        tooling_policy = (
+            "Tool Usage Policy:\n"
+            "- Consider a tool call when external, current, or source-backed information is required.\n"
+            "- Do not call tools for conversational, opinionated, or self-contained questions.\n"
+            "- Do not invent tools or parameters that are not in the provided function definitions."
+        )
+        tools_block = "Available Tools: provided as function definitions." if schemas else "Available Tools: []"
+    else:
+        contract = (
+            "Response Contract:\n"
+            "- Always return JSON matching: { message: { content: string }, tool?: { name: string, arguments: object } | null }\n"
+            "- If no tool is needed, set tool to null or omit it.\n"
+            "- Use only the tools described below and validate arguments against the given JSON Schemas."
+        )
+        tooling_policy = (
+            "Tool Usage Policy:\n"
+            "- Consider a tool call when external, current, or source-backed information is required.\n"
+            "- Do not call tools for conversational, opinionated, or self-contained questions.\n"
+            "- When calling a tool, set tool.name and tool.arguments to valid values.\n"
+            "- Do not invent tools or parameters that are not in the schemas."
+        )
+        tools_block = (
+            "Available Tools (as JSON Schemas):\n" + json.dumps(schemas, ensure_ascii=False, separators=(",", ":"))
+            if schemas
+            else "Available Tools: []"
+        )
     tool_guides = (
         "Tool-Specific Guidance:\n" + "\n".join(instructions)
         if instructions
         else "Tool-Specific Guidance:\nNone"
     )
-    server = "Server Information (JSON):\n" + json.dumps(info, indent=2, ensure_ascii=False)
-    parts = [persona, server, contract, tooling_policy, tools_block, tool_guides]
+    server = "Server Information (JSON):\n" + json.dumps(info, ensure_ascii=False, separators=(",", ":"))
+    parts = [persona, contract, tooling_policy, tools_block, tool_guides, server]
     return "\n\n".join(parts)
 
+
+class SystemPromptCache:
+    def __init__(self, *, max_entries: int = 1024, native_tools: bool = False):
+        self._max_entries = max(1, int(max_entries))
+        self._native_tools = native_tools
+        self._entries: OrderedDict[tuple[Optional[int], str], tuple[str, Any]] = OrderedDict()
+        self._tool_schemas: list[dict[str, Any]] = []
+        self._tool_instructions: list[str] = []
+        self.hits = 0
+        self.misses = 0
+
+    def set_tools(
+        self,
+        tool_schemas: Iterable[dict[str, Any]] | None,
+        tool_instructions: Iterable[str] | None,
+    ) -> None:
+        self._tool_schemas = list(tool_schemas or [])
+        self._tool_instructions = list(tool_instructions or [])
+        self._entries.clear()
+
+    def get(self, *, bot_name: str, guild_id: Optional[int], server_info: Any) -> str:
+        key = (guild_id, bot_name)
+        entry = self._entries.get(key)
+        if entry is not None and (callable(server_info) or entry[1] == server_info):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        info = server_info() if callable(server_info) else server_info
+        prompt = build_system_prompt(
+            bot_name=bot_name,
+            server_info=info,
+            tool_schemas=self._tool_schemas,
+            tool_instructions=self._tool_instructions,
+            native_tools=self._native_tools,
+        )
+        self._entries[key] = (prompt, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return prompt
+
+    def invalidate(self, guild_id: Optional[int] = None) -> None:
+        if guild_id is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[0] == guild_id]:
+            del self._entries[key]
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+from pydantic import BaseModel, Field
+
+
+class MentionItem(BaseModel):
+    message_id: int
+    author_id: int
+    cleaned: str
+    payload: dict[str, Any]
+
+
+class MentionJob(BaseModel):
+    guild_id: Optional[int] = None
+    channel_id: int
+    bot_id: int
+    bot_name: str
+    server_info: dict[str, Any] = Field(default_factory=dict)
+    items: list[MentionItem]
+    appended: bool = False
+    sent: int = 0
+    reply: Optional[dict[str, Any]] = None
+    tool_stored: bool = False
+    followup: Optional[dict[str, Any]] = None
+
+
+class ReplyJob(BaseModel):
+    guild_id: Optional[int] = None
+    channel_id: int
+    reply_to: int
+    content: str
+    thread: str
+    follow: bool = False
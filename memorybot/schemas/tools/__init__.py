@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-from .tavily import TAVILY_TOOL_NAME, tavily_tool_schema, tavily_tool_instructions
+from .tavily import TAVILY_TOOL_NAME, tavily_tool_defaults, tavily_tool_schema, tavily_tool_instructions
 
 __all__ = [
     "TAVILY_TOOL_NAME",
+    "tavily_tool_defaults",
     "tavily_tool_schema",
     "tavily_tool_instructions",
 ]
@@ -47,6 +47,11 @@ def tavily_tool_schema() -> dict[str, Any]:
     }
 
 
+def tavily_tool_defaults() -> dict[str, Any]:
+    properties = tavily_tool_schema()["function"]["parameters"]["properties"]
+    return {name: spec["default"] for name, spec in properties.items() if "default" in spec}
+
+
 def tavily_tool_instructions() -> str:
     return (
         "You can call a web search tool when external, current, or factual information is needed. "
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import select, text, update
+
+from memorybot.db.codec import encode_legacy
+from memorybot.db.models import Message
+from memorybot.db.repository import ConversationRepository
+from memorybot.db.session import init_engine, get_engine, close_engine, session
+
+
+async def _db_bytes() -> int | None:
+    engine = get_engine()
+    if engine.dialect.name != "sqlite":
+        return None
+    async with engine.connect() as conn:
+        pages = (await conn.execute(text("PRAGMA page_count"))).scalar_one()
+        size = (await conn.execute(text("PRAGMA page_size"))).scalar_one()
+    return int(pages) * int(size)
+
+
+async def _compact(batch_size: int, dry_run: bool) -> tuple[int, int]:
+    converted = 0
+    skipped = 0
+    last_id = 0
+    while True:
+        async with session() as s:
+            stmt = (
+                select(Message.id, Message.role, Message.content)
+                .where(Message.meta.is_(None), Message.id > last_id)
+                .order_by(Message.id)
+                .limit(batch_size)
+            )
+            rows = (await s.execute(stmt)).all()
+            if not rows:
+                return converted, skipped
+            last_id = rows[-1][0]
+            updates = []
+            for mid, role, content in rows:
+                record = encode_legacy(role, content)
+                if record is None:
+                    skipped += 1
+                    continue
+                updates.append(
+                    {
+                        "id": mid,
+                        "content": "",
+                        "discord_message_id": record.discord_message_id,
+                        "text": record.text,
+                        "meta": record.meta,
+                    }
+                )
+            if updates and not dry_run:
+                await s.execute(update(Message), updates)
+                await s.commit()
+            converted += len(updates)
+        sys.stdout.write(f"\rconverted={converted} skipped={skipped} last_id={last_id}")
+        sys.stdout.flush()
+
+
+async def _amain() -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="compact-messages", add_help=True)
+    parser.add_argument("--database-url", dest="database_url", default=os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./memorybot.db"))
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=500)
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true")
+    parser.add_argument("--vacuum", action="store_true", help="rebuild the SQLite file afterwards to reclaim space and enable incremental vacuum")
+    args = parser.parse_args()
+
+    await init_engine(args.database_url)
+    try:
+        await ConversationRepository().create_all(get_engine())
+        before = await _db_bytes()
+        start = time.perf_counter()
+        converted, skipped = await _compact(max(1, args.batch_size), args.dry_run)
+        elapsed = time.perf_counter() - start
+        print(f"\nconverted={converted} skipped={skipped} elapsed={elapsed:.1f}s dry_run={args.dry_run}")
+        if args.vacuum and not args.dry_run and get_engine().dialect.name == "sqlite":
+            async with get_engine().connect() as conn:
+                await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                await conn.execute(text("VACUUM"))
+        after = await _db_bytes()
+        if before is not None and after is not None:
+            print(f"db_bytes before={before} after={after}")
+    finally:
+        await close_engine()
+    return 0
+
+
+def main() -> None:
+    raise SystemExit(asyncio.run(_amain()))
+
+
+if __name__ == "__main__":
+    main()
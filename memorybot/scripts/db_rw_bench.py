@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+from memorybot.db.session import init_engine, get_engine, close_engine, session
+from memorybot.db.repository import ConversationRepository
+from memorybot.db.models import Message
+from memorybot.db.writer import start_writer, stop_writer
+
+
+_TEXT = "hello there " * 8
+
+
+async def _seed(rows: int, channels: int) -> None:
+    batch = [
+        {"guild_id": 1 + i % channels, "channel_id": 1000 + i % channels, "user_id": i, "role": "user", "meta": "{}", "text": _TEXT}
+        for i in range(rows)
+    ]
+    async with session() as s:
+        await s.execute(insert(Message), batch)
+        await s.commit()
+
+
+async def _run(
+    mode: str,
+    *,
+    seed: int,
+    channels: int,
+    readers: int,
+    writers: int,
+    seconds: float,
+    write_behind: bool,
+) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        await init_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}", sqlite_tuned=mode == "tuned", read_pool_size=readers)
+        repo = ConversationRepository()
+        await repo.create_all(get_engine())
+        await _seed(seed, channels)
+        if write_behind:
+            start_writer()
+        latencies: list[float] = []
+        writes = 0
+        errors = 0
+        deadline = time.perf_counter() + seconds
+
+        async def reader(idx: int) -> None:
+            nonlocal errors
+            i = idx
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    await repo.get_recent_history(guild_id=1 + i % channels, limit=50)
+                except Exception:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+                i += readers
+
+        async def writer(idx: int) -> None:
+            nonlocal writes, errors
+            i = idx
+            while time.perf_counter() < deadline:
+                try:
+                    await repo.add_message(
+                        guild_id=1 + i % channels,
+                        channel_id=1000 + i % channels,
+                        user_id=i,
+                        role="user",
+                        meta="{}",
+                        text=_TEXT,
+                        refresh=False,
+                    )
+                    writes += 1
+                except Exception:
+                    errors += 1
+                i += writers
+
+        try:
+            await asyncio.gather(*(reader(i) for i in range(readers)), *(writer(i) for i in range(writers)))
+        finally:
+            await stop_writer()
+            await close_engine()
+    latencies.sort()
+    return {
+        "reads": len(latencies) / seconds,
+        "writes": writes / seconds,
+        "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        "errors": errors,
+    }
+
+
+async def _amain() -> int:
+    parser = argparse.ArgumentParser(prog="db-rw-bench", add_help=True)
+    parser.add_argument("--seed", type=int, default=50000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--write-behind", dest="write_behind", action="store_true")
+    args = parser.parse_args()
+    results: dict[str, dict[str, float]] = {}
+    for mode in ("default", "tuned"):
+        r = await _run(
+            mode,
+            seed=args.seed,
+            channels=args.channels,
+            readers=args.readers,
+            writers=args.writers,
+            seconds=args.seconds,
+            write_behind=args.write_behind,
+        )
+        results[mode] = r
+        print(
+            f"{mode:>8}: reads={r['reads']:.0f}/s writes={r['writes']:.0f}/s "
+            f"read_p50={r['p50']:.2f}ms read_p99={r['p99']:.2f}ms errors={r['errors']:.0f}"
+        )
+    d, t = results["default"], results["tuned"]
+    print(f"{'speedup':>8}: reads {t['reads'] / max(d['reads'], 1e-9):.1f}x writes {t['writes'] / max(d['writes'], 1e-9):.1f}x")
+    return 0
+
+
+def main() -> None:
+    raise SystemExit(asyncio.run(_amain()))
+
+
+if __name__ == "__main__":
+    main()
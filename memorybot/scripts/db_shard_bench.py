@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from memorybot.db.session import init_engine, get_engine, close_engine
+from memorybot.db.shards import init_shards, close_shards
+from memorybot.db.repository import ConversationRepository
+
+
+_TEXT = "hello there " * 8
+
+
+async def _run(count: int, *, guilds: int, writers: int, seconds: float, write_behind: bool) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        await init_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'main.db')}")
+        repo = ConversationRepository()
+        await repo.create_all(get_engine())
+        shards = await init_shards(os.path.join(tmp, "shards"), count)
+        if write_behind:
+            shards.start_writers()
+        writes = 0
+        errors = 0
+        deadline = time.perf_counter() + seconds
+
+        async def writer(idx: int) -> None:
+            nonlocal writes, errors
+            i = idx
+            while time.perf_counter() < deadline:
+                try:
+                    await repo.add_message(
+                        guild_id=1 + i % guilds,
+                        channel_id=1000 + i % guilds,
+                        user_id=i,
+                        role="user",
+                        meta="{}",
+                        text=_TEXT,
+                        refresh=False,
+                    )
+                    writes += 1
+                except Exception:
+                    errors += 1
+                i += writers
+
+        try:
+            await asyncio.gather(*(writer(i) for i in range(writers)))
+            await shards.flush()
+            rows = sum(s["rows"] for s in await shards.stats())
+        finally:
+            await close_shards()
+            await close_engine()
+    return {"writes": writes / seconds, "rows": rows, "errors": errors}
+
+
+async def _amain() -> int:
+    parser = argparse.ArgumentParser(prog="db-shard-bench", add_help=True)
+    parser.add_argument("--shards", default="1,2,4", help="comma-separated shard counts")
+    parser.add_argument("--guilds", type=int, default=64)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--write-behind", dest="write_behind", action="store_true")
+    args = parser.parse_args()
+    base = None
+    for count in (int(x) for x in args.shards.split(",") if x.strip()):
+        r = await _run(count, guilds=args.guilds, writers=args.writers, seconds=args.seconds, write_behind=args.write_behind)
+        base = base or r["writes"]
+        print(f"shards={count:>3}: writes={r['writes']:.0f}/s rows={r['rows']:.0f} errors={r['errors']:.0f} scale={r['writes'] / max(base, 1e-9):.2f}x")
+    return 0
+
+
+def main() -> None:
+    raise SystemExit(asyncio.run(_amain()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from memorybot.db.session import init_engine, get_engine, close_engine
+from memorybot.db.repository import ConversationRepository
+from memorybot.db.writer import start_writer, stop_writer
+
+
+_PAYLOAD = json.dumps({"message": {"content": "hello there " * 8}, "author": {"id": 1, "name": "bench"}}, indent=2)
+
+
+async def _mention(repo: ConversationRepository, idx: int, *, write_behind: bool) -> None:
+    channel_id = 1000 + idx % 10
+    await repo.add_message(guild_id=1, channel_id=channel_id, user_id=idx, role="user", content=_PAYLOAD, refresh=not write_behind)
+    await repo.add_message(guild_id=1, channel_id=channel_id, user_id=0, role="assistant", content=_PAYLOAD, refresh=not write_behind, wait=False)
+    await repo.add_message(guild_id=1, channel_id=channel_id, user_id=0, role="tool", content=_PAYLOAD, refresh=not write_behind)
+
+
+async def _run(mode: str, *, mentions: int, rounds: int, batch_size: int, flush_ms: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        await init_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        repo = ConversationRepository()
+        await repo.create_all(get_engine())
+        write_behind = mode == "write-behind"
+        if write_behind:
+            start_writer(batch_size=batch_size, flush_interval=flush_ms / 1000)
+        try:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                await asyncio.gather(*(_mention(repo, i, write_behind=write_behind) for i in range(mentions)))
+            await repo.flush()
+            elapsed = time.perf_counter() - start
+        finally:
+            await stop_writer()
+            await close_engine()
+    return (mentions * rounds * 3) / elapsed
+
+
+async def _amain() -> int:
+    parser = argparse.ArgumentParser(prog="db-write-bench", add_help=True)
+    parser.add_argument("--mentions", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=64)
+    parser.add_argument("--flush-ms", dest="flush_ms", type=int, default=10)
+    args = parser.parse_args()
+    results: dict[str, float] = {}
+    for mode in ("direct", "write-behind"):
+        results[mode] = await _run(mode, mentions=args.mentions, rounds=args.rounds, batch_size=args.batch_size, flush_ms=args.flush_ms)
+        print(f"{mode:>12}: {results[mode]:.0f} rows/s ({args.mentions} concurrent mentions x {args.rounds} rounds)")
+    print(f"{'speedup':>12}: {results['write-behind'] / results['direct']:.1f}x")
+    return 0
+
+
+def main() -> None:
+    raise SystemExit(asyncio.run(_amain()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import logging
+import random
+import time
+import tracemalloc
+from typing import Any
+
+import discord
+from discord.state import ChunkRequest
+
+from memorybot.core.bot import gateway_options
+
+
+_CASES = (
+    ("full (previous)", "full", "auto", 1000, True),
+    ("standard", "standard", "auto", 1000, False),
+    ("minimal", "minimal", "none", 0, False),
+)
+
+_BOT_ID = 1 << 40
+_JOINED = "2024-01-01T00:00:00+00:00"
+
+
+def _user(uid: int) -> dict[str, Any]:
+    return {"id": str(uid), "username": f"user{uid}", "discriminator": "0", "global_name": f"User {uid}", "avatar": None, "bot": uid == _BOT_ID}
+
+
+def _member(uid: int, roles: list[str]) -> dict[str, Any]:
+    return {"user": _user(uid), "roles": roles, "joined_at": _JOINED, "deaf": False, "mute": False, "nick": None, "flags": 0}
+
+
+def _presence(gid: int, uid: int, rng: random.Random) -> dict[str, Any]:
+    status = rng.choice(("online", "idle", "dnd"))
+    activities = [{"name": f"game {rng.randrange(50)}", "type": 0, "created_at": 0}] if rng.random() < 0.4 else []
+    return {"user": {"id": str(uid)}, "guild_id": str(gid), "status": status, "activities": activities, "client_status": {"desktop": status}}
+
+
+class _Guild:
+    def __init__(self, gid: int, members: int, channels: int, roles: int, online: float, rng: random.Random):
+        self.id = gid
+        self.members = [gid * 1_000_000 + i for i in range(1, members + 1)]
+        self.channels = [gid * 1_000_000 - 1 - i for i in range(channels)]
+        self.roles = [str(gid * 1_000_000 - 10_000 - i) for i in range(roles)]
+        self.online = set(rng.sample(self.members, int(members * online)))
+        self.rng = rng
+
+    def member_roles(self) -> list[str]:
+        return self.rng.sample(self.roles, min(len(self.roles), self.rng.randrange(4)))
+
+    def create(self, intents: discord.Intents) -> dict[str, Any]:
+        online = sorted(self.online) if intents.presences else []
+        return {
+            "id": str(self.id),
+            "name": f"guild {self.id}",
+            "icon": None,
+            "owner_id": str(self.members[0]),
+            "member_count": len(self.members) + 1,
+            "large": True,
+            "unavailable": False,
+            "features": [],
+            "emojis": [],
+            "stickers": [],
+            "threads": [],
+            "voice_states": [],
+            "roles": [
+                {"id": str(self.id), "name": "@everyone", "color": 0, "hoist": False, "position": 0, "permissions": "0", "managed": False, "mentionable": False}
+            ]
+            + [
+                {"id": r, "name": f"role {i}", "color": 0, "hoist": False, "position": i + 1, "permissions": "0", "managed": False, "mentionable": False}
+                for i, r in enumerate(self.roles)
+            ],
+            "channels": [
+                {"id": str(c), "type": 0, "name": f"channel-{i}", "position": i, "permission_overwrites": [], "nsfw": False, "parent_id": None}
+                for i, c in enumerate(self.channels)
+            ],
+            "members": [_member(_BOT_ID, [])] + [_member(uid, self.member_roles()) for uid in online],
+            "presences": [_presence(self.id, uid, self.rng) for uid in online],
+        }
+
+    def chunks(self, nonce: str, size: int = 1000) -> list[dict[str, Any]]:
+        count = (len(self.members) + size - 1) // size
+        return [
+            {
+                "guild_id": str(self.id),
+                "members": [_member(uid, self.member_roles()) for uid in self.members[i * size : (i + 1) * size]],
+                "chunk_index": i,
+                "chunk_count": count,
+                "nonce": nonce,
+            }
+            for i in range(count)
+        ]
+
+    def event(self, n: int) -> tuple[str, str, dict[str, Any]]:
+        rng = self.rng
+        uid = rng.choice(self.members)
+        channel = str(rng.choice(self.channels))
+        roll = rng.random()
+        if roll < 0.6:
+            return "presences", "PRESENCE_UPDATE", _presence(self.id, uid, rng)
+        if roll < 0.8:
+            return "guild_typing", "TYPING_START", {"channel_id": channel, "guild_id": str(self.id), "user_id": str(uid), "timestamp": 0, "member": _member(uid, self.member_roles())}
+        if roll < 0.95:
+            member = _member(uid, self.member_roles())
+            del member["user"]
+            return "guild_messages", "MESSAGE_CREATE", {
+                "id": str((n + 1) << 22),
+                "channel_id": channel,
+                "guild_id": str(self.id),
+                "author": _user(uid),
+                "member": member,
+                "content": "some chatter in a busy channel " * rng.randrange(1, 6),
+                "timestamp": _JOINED,
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [],
+                "embeds": [],
+                "pinned": False,
+                "type": 0,
+            }
+        return "members", "GUILD_MEMBER_UPDATE", {"guild_id": str(self.id), **_member(uid, self.member_roles())}
+
+
+async def _replay(case: tuple[str, str, str, int, bool], *, guilds: int, members: int, channels: int, roles: int, online: float, events: int, seed: int) -> dict[str, float]:
+    _, profile, member_cache, max_messages, chunk = case
+    options = gateway_options(profile, member_cache, max_messages, chunk)
+    intents: discord.Intents = options["intents"]
+    rng = random.Random(seed)
+    fixtures = [_Guild(10_000 + i, members, channels, roles, online, rng) for i in range(guilds)]
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    client = discord.Client(**options)
+    state = client._connection
+    state.loop = asyncio.get_running_loop()
+    state.user = discord.ClientUser(state=state, data=_user(_BOT_ID))  # type: ignore[arg-type]
+    delivered = 0
+    for fixture in fixtures:
+        state._add_guild_from_data(fixture.create(intents))  # type: ignore[arg-type]
+        delivered += 1
+        if options["chunk_guilds_at_startup"]:
+            request = ChunkRequest(fixture.id, 0, state.loop, state._get_guild, cache=state.member_cache_flags.joined)
+            state._chunk_requests[request.nonce] = request
+            for chunk_data in fixture.chunks(request.nonce):
+                state.parsers["GUILD_MEMBERS_CHUNK"](chunk_data)
+                delivered += 1
+    for n in range(events):
+        intent, name, data = fixtures[n % len(fixtures)].event(n)
+        if getattr(intents, intent):
+            state.parsers[name](data)
+            delivered += 1
+        if n % 500 == 0:
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    cached_members = sum(len(g.members) for g in client.guilds)
+    cached_messages = len(state._messages or ())
+    await client.close()
+    del client, state
+    tracemalloc.stop()
+    return {"mib": used / 1024 / 1024, "delivered": delivered, "members": cached_members, "messages": cached_messages, "seconds": elapsed}
+
+
+async def _amain() -> int:
+    parser = argparse.ArgumentParser(prog="gateway-memory-bench", add_help=True)
+    parser.add_argument("--guilds", type=int, default=4)
+    parser.add_argument("--members", type=int, default=25000, help="members per guild")
+    parser.add_argument("--channels", type=int, default=80)
+    parser.add_argument("--roles", type=int, default=60)
+    parser.add_argument("--online", type=float, default=0.2, help="fraction of members online")
+    parser.add_argument("--events", type=int, default=50000, help="gateway events replayed after startup")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.getLogger("discord").setLevel(logging.WARNING)
+    for case in _CASES:
+        r = await _replay(
+            case,
+            guilds=args.guilds,
+            members=args.members,
+            channels=args.channels,
+            roles=args.roles,
+            online=args.online,
+            events=args.events,
+            seed=args.seed,
+        )
+        print(
+            f"{case[0]:<16} mem={r['mib']:.1f}MiB events={r['delivered']:.0f} "
+            f"cached_members={r['members']:.0f} cached_messages={r['messages']:.0f} replay={r['seconds']:.1f}s"
+        )
+    return 0
+
+
+def main() -> None:
+    raise SystemExit(asyncio.run(_amain()))
+
+
+if __name__ == "__main__":
+    main()
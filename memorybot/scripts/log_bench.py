@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import TextIO
+
+from memorybot.core.logging import configure_logging, set_request_id, reset_request_id, stop_logging
+
+
+_MESSAGES = (
+    ("socket event type=%s", ("MESSAGE_CREATE",)),
+    ("mention handled guild=%s channel=%s batch=%d ms=%.1f", (123456789012345678, 223456789012345678, 2, 812.3)),
+    ("trace %s", ('{"request_id":"1234","name":"mention","ms":812.3,"spans":{"recall":{"n":1,"ms":12.0},"llm":{"n":1,"ms":790.1}}}',)),
+)
+
+
+class _SlowStream:
+    def __init__(self, stream: TextIO, delay: float):
+        self._stream = stream
+        self._delay = delay
+
+    def write(self, text: str) -> int:
+        if self._delay:
+            time.sleep(self._delay)
+        return self._stream.write(text)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+
+async def _run(records: int, *, queued: bool, json_output: bool, path: str, delay: float) -> dict[str, float]:
+    with open(path, "w", buffering=1) as stream:
+        configure_logging("DEBUG", json_output=json_output, queued=queued, stream=_SlowStream(stream, delay))  # type: ignore[arg-type]
+        log = logging.getLogger("memorybot.bench")
+        lags: list[float] = []
+        done = asyncio.Event()
+
+        async def ticker() -> None:
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append(max(0.0, time.perf_counter() - start - 0.001))
+
+        tick = asyncio.create_task(ticker())
+        await asyncio.sleep(0.01)
+        token = set_request_id("1234567890")
+        calls: list[float] = []
+        start = time.perf_counter()
+        try:
+            for i in range(records):
+                msg, args = _MESSAGES[i % len(_MESSAGES)]
+                t = time.perf_counter()
+                log.debug(msg, *args)
+                calls.append(time.perf_counter() - t)
+                if i % 50 == 49:
+                    await asyncio.sleep(0)
+            on_loop = time.perf_counter() - start
+        finally:
+            reset_request_id(token)
+            done.set()
+            await tick
+        stop_logging()
+        drained = time.perf_counter() - start
+    calls.sort()
+    lags.sort()
+    return {
+        "call_us": sum(calls) / len(calls) * 1e6,
+        "p99_us": calls[int(len(calls) * 0.99)] * 1e6,
+        "loop_rate": records / on_loop,
+        "drain_rate": records / drained,
+        "lag_ms": (lags[-1] if lags else 0.0) * 1000,
+    }
+
+
+async def _amain() -> int:
+    parser = argparse.ArgumentParser(prog="log-bench", add_help=True)
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--output", default=None, help="file receiving log output (default: temporary file)")
+    parser.add_argument("--write-delay-us", dest="write_delay_us", type=float, default=0.0, help="simulated blocking time per write")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.output or os.path.join(tmp, "bench.log")
+        for queued in (False, True):
+            for json_output in (False, True):
+                r = await _run(args.records, queued=queued, json_output=json_output, path=path, delay=args.write_delay_us / 1e6)
+                mode = ("queued" if queued else "direct") + ("+json" if json_output else "")
+                print(
+                    f"{mode:<12} call={r['call_us']:.1f}us p99={r['p99_us']:.1f}us "
+                    f"loop={r['loop_rate']:.0f}/s drained={r['drain_rate']:.0f}/s max_lag={r['lag_ms']:.1f}ms"
+                )
+    configure_logging("INFO")
+    return 0
+
+
+def main() -> None:
+    raise SystemExit(asyncio.run(_amain()))
+
+
+if __name__ == "__main__":
+    main()
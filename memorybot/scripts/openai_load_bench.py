@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Any, Optional
+
+from aiohttp import web
+
+from memorybot.core.config import Settings
+from memorybot.services.openai_chat import OpenAIChatService
+from memorybot.services.rate_limiter import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_DM,
+    PRIORITY_GUILD,
+    PRIORITY_OWNER,
+    TokenBucket,
+    priority_name,
+    start_rate_limiter,
+    stop_rate_limiter,
+)
+
+
+_MIX = ((PRIORITY_OWNER, 0.05), (PRIORITY_DM, 0.15), (PRIORITY_GUILD, 0.6), (PRIORITY_BACKGROUND, 0.2))
+
+
+class FakeOpenAI:
+    def __init__(self, *, rpm: int, tpm: int, burst_seconds: float, latency: float, error_rate: float, seed: int = 0):
+        self._rpm = rpm
+        self._tpm = tpm
+        self._burst_seconds = burst_seconds
+        self._latency = latency
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.reset()
+
+    def reset(self) -> None:
+        self._requests = TokenBucket(self._rpm, burst_seconds=self._burst_seconds) if self._rpm else None
+        self._tokens = TokenBucket(self._tpm, burst_seconds=self._burst_seconds) if self._tpm else None
+        self.counts = {"ok": 0, "429": 0, "5xx": 0}
+
+    def _limited(self, cost: int) -> float:
+        now = time.monotonic()
+        wait = 0.0
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(cost, now))
+        if wait > 0:
+            return wait
+        if self._requests is not None:
+            self._requests.take(1, now)
+        if self._tokens is not None:
+            self._tokens.take(cost, now)
+        return 0.0
+
+    async def _chat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = sum(len(m.get("content") or "") for m in body.get("messages", ())) // 4
+        wait = self._limited(prompt + int(body.get("max_tokens") or 256))
+        if wait > 0:
+            self.counts["429"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after-ms": str(int(wait * 1000) + 1), "retry-after": str(int(wait) + 1)},
+            )
+        await asyncio.sleep(self._latency * self._random.uniform(0.5, 1.5))
+        if self._random.random() < self._error_rate:
+            self.counts["5xx"] += 1
+            return web.json_response({"error": {"message": "The server had an error", "type": "server_error"}}, status=503)
+        self.counts["ok"] += 1
+        completion = self._random.randint(20, 120)
+        content = json.dumps({"message": {"content": "ok " * (completion // 2)}, "tool": None})
+        return web.json_response(
+            {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "bench"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion},
+            }
+        )
+
+    async def start(self, host: str, port: int) -> str:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound = self._runner.addresses[0][1] if self._runner.addresses else port
+        return f"http://{host}:{bound}/v1"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def _pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def _drive(settings: Settings, *, requests: int, arrival_rate: float, prompt_chars: int, max_tokens: int, seed: int) -> dict[str, Any]:
+    ai = OpenAIChatService(settings)
+    rng = random.Random(seed)
+    priorities = rng.choices([p for p, _ in _MIX], weights=[w for _, w in _MIX], k=requests)
+    latencies: dict[int, list[float]] = {p: [] for p, _ in _MIX}
+    failures: dict[str, int] = {}
+    text = ("lorem ipsum " * (prompt_chars // 12 + 1))[:prompt_chars]
+
+    async def one(priority: int) -> None:
+        start = time.perf_counter()
+        try:
+            await ai.complete("You are a load test.", text, max_tokens=max_tokens, priority=priority)
+        except Exception as e:
+            failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+            return
+        latencies[priority].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tasks = []
+    for priority in priorities:
+        tasks.append(asyncio.create_task(one(priority)))
+        if arrival_rate > 0:
+            await asyncio.sleep(1 / arrival_rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await ai.aclose()
+    return {"elapsed": elapsed, "latencies": latencies, "failures": failures, "retries": ai.retries}
+
+
+async def _amain() -> int:
+    parser = argparse.ArgumentParser(prog="openai-load-bench", add_help=True)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--arrival-rate", dest="arrival_rate", type=float, default=20.0, help="requests started per second (0 = all at once)")
+    parser.add_argument("--server-rpm", dest="server_rpm", type=int, default=1200)
+    parser.add_argument("--server-tpm", dest="server_tpm", type=int, default=120000)
+    parser.add_argument("--burst-seconds", dest="burst_seconds", type=float, default=10.0)
+    parser.add_argument("--latency-ms", dest="latency_ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.02, help="fraction of admitted requests answered with 503")
+    parser.add_argument("--prompt-chars", dest="prompt_chars", type=int, default=800)
+    parser.add_argument("--max-tokens", dest="max_tokens", type=int, default=256)
+    parser.add_argument("--max-retries", dest="max_retries", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=0, help="client-side in-flight cap when limiting (0 = none)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--serve", action="store_true", help="only run the fake endpoint until interrupted")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    server = FakeOpenAI(
+        rpm=args.server_rpm,
+        tpm=args.server_tpm,
+        burst_seconds=args.burst_seconds,
+        latency=args.latency_ms / 1000,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    url = await server.start(args.host, args.port)
+    try:
+        if args.serve:
+            print(f"fake OpenAI endpoint at {url} rpm={args.server_rpm} tpm={args.server_tpm}; Ctrl+C to stop")
+            await asyncio.Event().wait()
+            return 0
+        settings = Settings(
+            token="bench",
+            OPENAI_API_KEY="bench",
+            OPENAI_BASE_URL=url,
+            OPENAI_MAX_RETRIES=args.max_retries,
+        )
+        for limited in (False, True):
+            server.reset()
+            if limited:
+                start_rate_limiter(
+                    rpm=args.server_rpm, tpm=args.server_tpm, max_concurrency=args.concurrency, burst_seconds=args.burst_seconds
+                )
+            try:
+                r = await _drive(
+                    settings,
+                    requests=args.requests,
+                    arrival_rate=args.arrival_rate,
+                    prompt_chars=args.prompt_chars,
+                    max_tokens=args.max_tokens,
+                    seed=args.seed,
+                )
+            finally:
+                stop_rate_limiter()
+            ok = sum(len(v) for v in r["latencies"].values())
+            print(
+                f"{'limited' if limited else 'unlimited':<10} ok={ok}/{args.requests} failed={r['failures'] or 0} "
+                f"retries={r['retries']} server_429={server.counts['429']} server_5xx={server.counts['5xx']} elapsed={r['elapsed']:.1f}s"
+            )
+            for priority, values in r["latencies"].items():
+                print(
+                    f"  {priority_name(priority):<10} n={len(values):<4} "
+                    f"p50={_pct(values, 0.5) * 1000:.0f}ms p95={_pct(values, 0.95) * 1000:.0f}ms"
+                )
+        return 0
+    finally:
+        await server.close()
+
+
+def main() -> None:
+    try:
+        raise SystemExit(asyncio.run(_amain()))
+    except KeyboardInterrupt:
+        raise SystemExit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from memorybot.core.metrics import MENTION_STAGE_SECONDS, MetricsServer
+from memorybot.db.shards import IdAllocator, jump_hash
+from memorybot.db.work_queue import WorkQueue
+from memorybot.utils.json_repair import repair_json
+from memorybot.utils.timing import StageTimer
+
+
+_STAGES = ("db_append_read", "recall", "llm", "tool", "discord_send", "db_write")
+
+
+async def _get(port: int, path: str) -> tuple[int, str]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode())
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, body = raw.decode().partition("\r\n\r\n")
+    return int(head.split()[1]), body
+
+
+async def check_metrics() -> None:
+    timer = StageTimer(lambda name, seconds: MENTION_STAGE_SECONDS.observe(seconds, stage=name))
+    for name in _STAGES:
+        await timer.timed(name, asyncio.sleep(0.001))
+    server = MetricsServer("127.0.0.1", 0)
+    await server.start()
+    try:
+        assert server.port != 0, "server did not bind a port"
+        status, body = await _get(server.port, "/metrics")
+        assert status == 200, f"/metrics returned {status}"
+        assert "# TYPE memorybot_mention_stage_seconds histogram" in body, "stage histogram missing"
+        for name in _STAGES:
+            count = re.search(rf'^memorybot_mention_stage_seconds_count\{{stage="{name}"\}} (\d+)$', body, re.M)
+            assert count is not None and int(count.group(1)) >= 1, f"no {name} observations"
+            assert f'memorybot_mention_stage_seconds_bucket{{stage="{name}",le="+Inf"}}' in body, f"no +Inf bucket for {name}"
+        status, _ = await _get(server.port, "/nope")
+        assert status == 404, f"unknown path returned {status}"
+        assert server.scrapes == 1, f"scrapes={server.scrapes}"
+    finally:
+        await server.close()
+
+
+async def check_json_repair() -> None:
+    expected = {"message": {"content": "hi"}, "tool": None}
+    for text in (
+        '{"message": {"content": "hi"}, "tool": null}',
+        '```json\n{"message": {"content": "hi"}, "tool": null}\n```',
+        'Sure! {"message": {"content": "hi"}, "tool": null,} Hope that helps.',
+        '{"message": {"content": "hi",}, "tool": null}',
+    ):
+        assert repair_json(text) == expected, f"not repaired: {text!r}"
+    assert repair_json("no json here") is None, "garbage was repaired"
+    cut = '{"message": {"content": "hel'
+    assert repair_json(cut) is None, "truncated reply repaired without partial"
+    assert repair_json(cut, partial=True) == {"message": {"content": "hel"}}, "partial repair lost the message"
+
+
+async def check_shards() -> None:
+    keys = range(10_000)
+    for buckets in (1, 2, 7, 16):
+        assert all(0 <= jump_hash(k, buckets) < buckets for k in keys), f"jump_hash out of range for {buckets}"
+    before = [jump_hash(k, 4) for k in keys]
+    after = [jump_hash(k, 5) for k in keys]
+    moved = [b for a, b in zip(before, after) if a != b]
+    assert all(b == 4 for b in moved), "growing the ring moved keys between old buckets"
+    assert 0.1 < len(moved) / len(before) < 0.3, f"{len(moved)} of {len(before)} keys moved"
+    allocator = IdAllocator(3)
+    ids = [allocator.next() for _ in range(20_000)]
+    assert all(a < b for a, b in zip(ids, ids[1:])), "ids are not strictly increasing"
+    assert all(i & 1023 == 3 for i in ids), "ids lost their shard slot"
+    resumed = IdAllocator(3, ids[-1])
+    assert resumed.next() > ids[-1], "a resumed allocator went backwards"
+    lanes = [IdAllocator(0, lane=lane, lanes=2) for lane in range(2)]
+    seen = [a.next() for _ in range(5_000) for a in lanes]
+    assert len(set(seen)) == len(seen), "id lanes collided"
+
+
+async def check_work_queue() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        log = logging.getLogger("memorybot.self_check.work_queue")
+        log.setLevel(logging.CRITICAL)
+        queue = WorkQueue(Path(tmp) / "queue.db", lease=30.0, max_attempts=1, logger=log)
+        await queue.open()
+        try:
+            for scope, n in (("a", 1), ("a", 2), ("b", 1), ("c", 1), ("c", 2)):
+                await queue.put("mentions", scope, {"n": n})
+            first = await queue.claim("mentions", "check", limit=10)
+            assert sorted((j.scope, j.payload["n"]) for j in first) == [("a", 1), ("b", 1), ("c", 1)], "claim skipped scope order"
+            assert await queue.claim("mentions", "check", limit=10) == [], "a later job ran before its scope was done"
+            by_scope = {j.scope: j for j in first}
+            await queue.complete(by_scope["a"])
+            await queue.complete(by_scope["b"])
+            assert not await queue.fail(by_scope["c"], "boom"), "failed job was not buried"
+            second = await queue.claim("mentions", "check", limit=10)
+            assert sorted((j.scope, j.payload["n"]) for j in second) == [("a", 2), ("c", 2)], "dead or completed jobs still block their scope"
+        finally:
+            await queue.close()
+
+
+_CHECKS: dict[str, Callable[[], Awaitable[None]]] = {
+    "metrics": check_metrics,
+    "json-repair": check_json_repair,
+    "shards": check_shards,
+    "work-queue": check_work_queue,
+}
+
+
+async def _amain() -> int:
+    parser = argparse.ArgumentParser(prog="self-check", add_help=True)
+    parser.add_argument("checks", nargs="*", metavar="check", help=f"checks to run: {', '.join(_CHECKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in _CHECKS]
+    if unknown:
+        parser.error(f"unknown check: {', '.join(unknown)}")
+    logging.basicConfig(level=logging.ERROR)
+    failed = 0
+    for name in args.checks or _CHECKS:
+        start = time.perf_counter()
+        try:
+            await _CHECKS[name]()
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {name:<12} {e}")
+            continue
+        print(f"ok   {name:<12} {(time.perf_counter() - start) * 1000:.0f}ms")
+    return 1 if failed else 0
+
+
+def main() -> None:
+    try:
+        raise SystemExit(asyncio.run(_amain()))
+    except KeyboardInterrupt:
+        raise SystemExit(130)
+
+
+if __name__ == "__main__":
+    main()
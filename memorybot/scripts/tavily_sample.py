@@ -23,13 +23,16 @@ async def _amain() -> int:
         sys.stderr.write("TAVILY_API_KEY is not set.\n")
         return 2
 
-    service = TavilySearchService(api_key=api_key)
+    service = TavilySearchService(api_key=api_key, base_url=os.getenv("TAVILY_BASE_URL") or None)
     options = TavilySearchOptions(
         include_answer=args.include_answer,
         search_depth=args.search_depth,
         max_results=args.max_results,
     )
-    result = await service.search(args.query, options=options, timeout=args.timeout)
+    try:
+        result = await service.search(args.query, options=options, timeout=args.timeout)
+    finally:
+        await service.aclose()
     print(json.dumps(result, ensure_ascii=False, indent=2))
     return 0
 
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+
+from memorybot.db.vector_index import VectorIndex, np, require_numpy
+
+
+def _synthetic(rng, n: int, dim: int, clusters: int):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    out = np.empty((n, dim), dtype=np.float32)
+    chunk = 100_000
+    for start in range(0, n, chunk):
+        size = min(chunk, n - start)
+        block = centers[rng.integers(0, clusters, size)] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+        out[start:start + size] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return out
+
+
+def _time(fn, queries) -> tuple[list[list[int]], float, float]:
+    results: list[list[int]] = []
+    timings: list[float] = []
+    for q in queries:
+        start = time.perf_counter()
+        hits = fn(q)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append([i for i, _ in hits])
+    timings.sort()
+    return results, timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="vector-index-bench", add_help=True)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--tail", type=float, default=0.4, help="rows added after training, as a fraction of --rows")
+    args = parser.parse_args()
+    require_numpy()
+    rng = np.random.default_rng(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = VectorIndex(tmp, args.dim, ivf_min_rows=1, nprobe=args.nprobe)
+        scope = index.scope("g1")
+        start = time.perf_counter()
+        tail = int(args.rows * max(0.0, args.tail))
+        vectors = _synthetic(rng, args.rows + tail, args.dim, args.clusters)
+        chunk = 100_000
+        for offset in range(0, args.rows, chunk):
+            block = vectors[offset:offset + chunk]
+            scope.add(np.arange(offset + 1, offset + 1 + len(block)), block)
+        index.save_watermark(args.rows)
+        print(f"{'build':>12}: {args.rows} x {args.dim} in {time.perf_counter() - start:.1f}s")
+        queries = vectors[rng.integers(0, args.rows, args.queries)] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+        exact, p50, p95 = _time(lambda q: scope.search(q, args.k), queries)
+        print(f"{'brute-force':>12}: p50={p50:.2f}ms p95={p95:.2f}ms")
+        start = time.perf_counter()
+        scope.train()
+        print(f"{'train':>12}: {scope.stats()['ivf_lists']} lists in {time.perf_counter() - start:.1f}s")
+        approx, p50, p95 = _time(lambda q: scope.search(q, args.k), queries)
+        recall = sum(len(set(a) & set(e)) for a, e in zip(approx, exact)) / (args.k * len(exact))
+        print(f"{'ivf':>12}: p50={p50:.2f}ms p95={p95:.2f}ms recall@{args.k}={recall:.3f} (nprobe={args.nprobe})")
+        if tail:
+            start = time.perf_counter()
+            for offset in range(args.rows, args.rows + tail, 1000):
+                block = vectors[offset:min(offset + 1000, args.rows + tail)]
+                scope.add(np.arange(offset + 1, offset + 1 + len(block)), block)
+            print(f"{'add tail':>12}: {tail} rows in batches of 1000 in {time.perf_counter() - start:.1f}s")
+            exact = []
+            for q in queries:
+                scores = vectors @ q
+                top = np.argpartition(scores, -args.k)[-args.k:]
+                exact.append([int(i) + 1 for i in top])
+            approx, p50, p95 = _time(lambda q: scope.search(q, args.k), queries)
+            recall = sum(len(set(a) & set(e)) for a, e in zip(approx, exact)) / (args.k * len(exact))
+            print(f"{'ivf + tail':>12}: p50={p50:.2f}ms p95={p95:.2f}ms recall@{args.k}={recall:.3f} ({scope.stats()})")
+    raise SystemExit(0)
+
+
+if __name__ == "__main__":
+    main()
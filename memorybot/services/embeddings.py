@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+from typing import Any, Optional, Protocol, Sequence
+
+from openai import AsyncOpenAI
+
+from memorybot.core.config import Settings
+from memorybot.db.vector_index import np, require_numpy
+from memorybot.services.openai_chat import create_client
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder(Protocol):
+    dim: int
+
+    async def embed(self, texts: Sequence[str]) -> Any: ...
+
+    async def aclose(self) -> None: ...
+
+
+def _normalize(matrix: Any) -> Any:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    def __init__(self, dim: int = 256):
+        require_numpy()
+        self.dim = int(dim)
+
+    def _vector(self, text: str) -> Any:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        tokens = _TOKEN_RE.findall(text.lower())
+        for feature in tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]:
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return vec
+
+    async def embed(self, texts: Sequence[str]) -> Any:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize(np.stack([self._vector(t) for t in texts]))
+
+    async def aclose(self) -> None:
+        return None
+
+
+class OpenAIEmbedder:
+    def __init__(self, settings: Settings, *, model: str | None = None, dim: int | None = None):
+        require_numpy()
+        self._settings = settings
+        self._model = model or settings.embedding_model
+        self.dim = int(dim or settings.embedding_dim)
+        self._client: Optional[AsyncOpenAI] = None
+        self._log = logging.getLogger("memorybot.service.embeddings")
+
+    async def embed(self, texts: Sequence[str]) -> Any:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._client is None:
+            self._client = create_client(self._settings)
+        resp = await self._client.embeddings.create(model=self._model, input=list(texts), dimensions=self.dim)
+        data = sorted(resp.data, key=lambda d: d.index)
+        return _normalize(np.asarray([d.embedding for d in data], dtype=np.float32))
+
+    async def aclose(self) -> None:
+        client = self._client
+        self._client = None
+        if client is not None:
+            await client.close()
+
+
+def create_embedder(settings: Settings) -> Embedder:
+    if settings.embedding_backend == "hashing":
+        return HashingEmbedder(settings.embedding_dim)
+    return OpenAIEmbedder(settings)
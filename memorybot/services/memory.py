@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Collection, Optional
+
+from memorybot.core.cluster import get_cluster
+from memorybot.core.config import Settings
+from memorybot.db.models import Message
+from memorybot.db.repository import ConversationRepository
+from memorybot.db.vector_index import VectorIndex, scope_name
+from memorybot.services.embeddings import Embedder, create_embedder
+
+
+_MAX_EMBED_CHARS = 2000
+
+
+def _embed_text(message: Message) -> str:
+    text = message.text if message.text is not None else message.content
+    return (text or "").strip()[:_MAX_EMBED_CHARS]
+
+
+class SemanticMemory:
+    def __init__(
+        self,
+        embedder: Embedder,
+        index: VectorIndex,
+        *,
+        repo: Optional[ConversationRepository] = None,
+        batch_size: int = 64,
+        interval: float = 2.0,
+        owns: Optional[Callable[[Optional[int], Optional[int]], bool]] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._embedder = embedder
+        self._index = index
+        self._repo = repo or ConversationRepository()
+        self._batch_size = max(1, int(batch_size))
+        self._interval = max(0.05, float(interval))
+        self._owns = owns
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._watermark = index.watermark()
+        self._log = logger or logging.getLogger("memorybot.service.memory")
+        self.indexed = 0
+        self.searches = 0
+        self.search_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="memorybot-memory-indexer")
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.index_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._log.error("memory indexing failed watermark=%d", self._watermark, exc_info=True)
+
+    async def index_pending(self) -> int:
+        total = 0
+        while True:
+            rows = await self._repo.get_messages_after_id(self._watermark, limit=self._batch_size)
+            if not rows:
+                break
+            items = [(m, t) for m in rows if (self._owns is None or self._owns(m.guild_id, m.channel_id)) and (t := _embed_text(m))]
+            if items:
+                vectors = await self._embedder.embed([t for _, t in items])
+                groups: dict[str, list[int]] = {}
+                for i, (m, _) in enumerate(items):
+                    groups.setdefault(scope_name(m.guild_id, m.channel_id), []).append(i)
+                for name, positions in groups.items():
+                    self._index.add(name, [items[i][0].id for i in positions], vectors[positions])
+            self._watermark = rows[-1].id
+            self._index.save_watermark(self._watermark)
+            total += len(items)
+            if len(rows) < self._batch_size:
+                break
+        for scope in self._index.pending_training():
+            started = time.perf_counter()
+            await asyncio.to_thread(scope.train)
+            self._log.info("trained ivf scope=%s %s in %.1fs", scope.name, scope.stats(), time.perf_counter() - started)
+        if total:
+            self.indexed += total
+            self._log.debug("indexed %d messages watermark=%d", total, self._watermark)
+        return total
+
+    async def embed_query(self, text: str) -> Any:
+        text = text.strip()[:_MAX_EMBED_CHARS]
+        if not text:
+            return None
+        try:
+            return (await self._embedder.embed([text]))[0]
+        except Exception:
+            self._log.warning("query embedding failed; skipping recall", exc_info=True)
+            return None
+
+    async def recall(
+        self,
+        *,
+        guild_id: Optional[int],
+        channel_id: Optional[int],
+        vector: Any,
+        k: int,
+        exclude: Collection[str] = (),
+    ) -> list[Message]:
+        if vector is None or k <= 0:
+            return []
+        started = time.perf_counter()
+        hits = await asyncio.to_thread(self._index.search, scope_name(guild_id, channel_id), vector, k + len(exclude))
+        self.searches += 1
+        self.search_ms += (time.perf_counter() - started) * 1000
+        if not hits:
+            return []
+        rows = {m.id: m for m in await self._repo.get_messages_by_ids([i for i, _ in hits])}
+        picked: list[Message] = []
+        for message_id, _ in hits:
+            m = rows.get(message_id)
+            if m is None or m.render() in exclude:
+                continue
+            picked.append(m)
+            if len(picked) >= k:
+                break
+        picked.sort(key=lambda m: m.id)
+        return picked
+
+    async def close(self) -> None:
+        task = self._task
+        self._task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.index_pending()
+        finally:
+            self._index.flush()
+            await self._embedder.aclose()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self._index.stats(),
+            "watermark": self._watermark,
+            "indexed": self.indexed,
+            "searches": self.searches,
+            "avg_search_ms": (self.search_ms / self.searches) if self.searches else 0.0,
+        }
+
+
+_memory: Optional[SemanticMemory] = None
+
+
+def start_memory(
+    settings: Settings,
+    *,
+    layout: Optional[str] = None,
+    owns: Optional[Callable[[Optional[int], Optional[int]], bool]] = None,
+) -> SemanticMemory:
+    global _memory
+    if _memory is None or not _memory.running:
+        cluster = get_cluster()
+        if layout is None and cluster is not None:
+            layout = cluster.layout
+        if owns is None and cluster is not None:
+            owns = cluster.owns
+        _memory = SemanticMemory(
+            create_embedder(settings),
+            VectorIndex(
+                os.path.join(settings.memory_index_dir, layout) if layout else settings.memory_index_dir,
+                settings.embedding_dim,
+                ivf_min_rows=settings.memory_ivf_min_rows,
+                nprobe=settings.memory_nprobe,
+            ),
+            batch_size=settings.memory_batch_size,
+            interval=settings.memory_index_interval_ms / 1000,
+            owns=owns,
+        )
+        _memory.start()
+    return _memory
+
+
+def get_memory() -> Optional[SemanticMemory]:
+    m = _memory
+    if m is None or not m.running:
+        return None
+    return m
+
+
+async def stop_memory() -> None:
+    global _memory
+    m = _memory
+    _memory = None
+    if m is None:
+        return
+    await m.close()
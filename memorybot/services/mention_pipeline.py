@@ -0,0 +1,432 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Any, Optional, Protocol
+
+import discord
+
+from memorybot.core.config import Settings
+from memorybot.core.metrics import CACHE_ENTRIES, CACHE_LOOKUPS, MENTION_SECONDS, MENTION_STAGE_SECONDS, MENTIONS
+from memorybot.db.codec import CompactRecord, encode_assistant_payload, encode_user_payload, render_content
+from memorybot.db.repository import ConversationRepository
+from memorybot.db.work_queue import Job, WorkQueue, partition_key
+from memorybot.prompt.context import ContextBuilder, ContextWindow, TokenCounter
+from memorybot.prompt.system_prompt import SystemPromptCache
+from memorybot.schemas.jobs import MentionItem, MentionJob, ReplyJob
+from memorybot.schemas.llm import ChatResponse, ToolUsage
+from memorybot.services.memory import get_memory
+from memorybot.services.openai_chat import OpenAIChatService
+from memorybot.services.rate_limiter import PRIORITY_DM, PRIORITY_GUILD, PRIORITY_OWNER
+from memorybot.services.summarizer import get_summarizer
+from memorybot.services.tooling import ToolExecutor
+from memorybot.utils.message_payload import build_message_payload, build_server_info
+from memorybot.utils.progressive_reply import ProgressiveReply
+from memorybot.utils.timing import StageTimer
+
+
+class ReplySink(Protocol):
+    def progressive(self, min_interval: float) -> Optional[ProgressiveReply]: ...
+
+    async def reply(self, content: str) -> Any: ...
+
+    async def follow_up(self, target: Any, content: str) -> None: ...
+
+    async def flush(self) -> None: ...
+
+    async def checkpoint(self, job: MentionJob) -> None: ...
+
+
+class DiscordSink:
+    def __init__(self, message: discord.Message):
+        self._message = message
+
+    def progressive(self, min_interval: float) -> Optional[ProgressiveReply]:
+        return ProgressiveReply(self._message, min_interval=min_interval)
+
+    async def reply(self, content: str) -> Any:
+        return await self._message.reply(content, mention_author=False)
+
+    async def follow_up(self, target: Any, content: str) -> None:
+        if target is None:
+            return
+        try:
+            await target.reply(content, mention_author=False)
+        except Exception:
+            pass
+
+    async def flush(self) -> None:
+        return None
+
+    async def checkpoint(self, job: MentionJob) -> None:
+        return None
+
+
+class QueueSink:
+    def __init__(self, queue: WorkQueue, job: Job, mention: MentionJob):
+        self._queue = queue
+        self._job = job
+        self._mention = mention
+        self._pending: list[tuple[str, str, dict[str, Any], int, Optional[str]]] = []
+        self._seq = 0
+
+    def progressive(self, min_interval: float) -> Optional[ProgressiveReply]:
+        return None
+
+    def _add(self, content: str, follow: bool) -> None:
+        m = self._mention
+        reply = ReplyJob(
+            guild_id=m.guild_id,
+            channel_id=m.channel_id,
+            reply_to=m.items[-1].message_id,
+            content=content,
+            thread=str(self._job.id),
+            follow=follow,
+        )
+        self._seq += 1
+        if self._seq <= m.sent:
+            return
+        self._pending.append(
+            ("replies", str(m.channel_id), reply.model_dump(), partition_key(m.guild_id, m.channel_id), f"{self._job.id}:{self._seq}")
+        )
+
+    async def reply(self, content: str) -> Any:
+        self._add(content, False)
+        return self._job.id
+
+    async def follow_up(self, target: Any, content: str) -> None:
+        if target is not None:
+            self._add(content, True)
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        await self._queue.put_many(pending)
+        self._mention.sent = self._seq
+        await self.checkpoint(self._mention)
+
+    async def checkpoint(self, job: MentionJob) -> None:
+        await self._queue.checkpoint(self._job, job.model_dump())
+
+    async def complete(self) -> None:
+        pending, self._pending = self._pending, []
+        await self._queue.complete(self._job, pending)
+
+
+class MentionPipeline:
+    def __init__(self, settings: Settings, *, logger: Optional[logging.Logger] = None):
+        self.settings = settings
+        self.log = logger or logging.getLogger("memorybot.service.mention")
+        self.ai = OpenAIChatService(settings)
+        self.repo = ConversationRepository()
+        self.tools = ToolExecutor(settings)
+        self.history_limit = settings.context_history_limit
+        self.tokens = TokenCounter(settings.openai_model)
+        self.context = ContextBuilder(
+            self.tokens,
+            budget=settings.context_token_budget,
+            memory_budget=settings.memory_token_budget,
+        )
+        self.native_tools = settings.tool_call_mode == "native"
+        self.prompts = SystemPromptCache(native_tools=self.native_tools)
+        self.prompts.set_tools(self.tools.tool_schemas(), self.tools.tool_instructions())
+
+    @staticmethod
+    def build_job(batch: list[tuple[discord.Message, str]], bot_user: discord.ClientUser, *, server_info: bool = False) -> MentionJob:
+        message = batch[-1][0]
+        return MentionJob(
+            guild_id=getattr(message.guild, "id", None),
+            channel_id=message.channel.id,
+            bot_id=bot_user.id,
+            bot_name=bot_user.display_name or bot_user.name,
+            server_info=build_server_info(message.guild) if server_info else {},
+            items=[
+                MentionItem(message_id=m.id, author_id=m.author.id, cleaned=c, payload=build_message_payload(m, c))
+                for m, c in batch
+            ],
+        )
+
+    def collect_metrics(self) -> None:
+        prompts = self.prompts.stats()
+        CACHE_ENTRIES.set(prompts["entries"], cache="system_prompt")
+        CACHE_LOOKUPS.set_total(prompts["hits"], cache="system_prompt", result="hit")
+        CACHE_LOOKUPS.set_total(prompts["misses"], cache="system_prompt", result="miss")
+        tools = self.tools.cache_stats()
+        if tools is not None:
+            CACHE_ENTRIES.set(tools["entries"], cache="tools")
+            CACHE_LOOKUPS.set_total(tools["hits"] + tools["store_hits"] + tools["coalesced"], cache="tools", result="hit")
+            CACHE_LOOKUPS.set_total(tools["misses"], cache="tools", result="miss")
+
+    def describe(self) -> str:
+        return f"system prompt cache {self.prompts.stats()}; provider prompt cache {self.ai.usage_stats()}; tool cache {self.tools.cache_stats()}"
+
+    async def start(self) -> None:
+        await self.tokens.load()
+
+    async def aclose(self) -> None:
+        await self.ai.aclose()
+        await self.tools.aclose()
+
+    async def run(self, job: MentionJob, sink: ReplySink, *, server_info: Any = None) -> None:
+        timer = StageTimer(_observe_stage)
+        gid = job.guild_id
+        current = job.items[-1]
+        outcome = "empty"
+        try:
+            await self.tokens.load()
+            system_prompt = self.prompts.get(
+                bot_name=job.bot_name,
+                guild_id=gid,
+                server_info=server_info if server_info is not None else job.server_info,
+            )
+            records = [encode_user_payload(item.payload) for item in job.items]
+            settings = self.settings
+            memory = get_memory() if settings.memory_top_k > 0 else None
+            summarizer = get_summarizer()
+            if job.appended:
+                read = self.repo.get_recent_history(guild_id=gid, channel_id=job.channel_id, limit=self.history_limit)
+            else:
+                read = self.repo.append_and_get_history(
+                    [self._user_row(item, record) for item, record in zip(job.items, records)],
+                    guild_id=gid,
+                    channel_id=job.channel_id,
+                    limit=self.history_limit,
+                )
+            with timer.stage("db_append_read"):
+                history, vector, summary = await asyncio.gather(
+                    read,
+                    memory.embed_query(current.cleaned) if memory is not None else _nothing(),
+                    summarizer.latest(guild_id=gid, channel_id=job.channel_id) if summarizer is not None else _nothing(),
+                )
+            if not job.appended:
+                job.appended = True
+                await sink.checkpoint(job)
+            summary_text = summary.content if summary is not None else None
+            recalled: list[str] = []
+            if memory is not None and vector is not None:
+                with timer.stage("recall"):
+                    found = await memory.recall(
+                        guild_id=gid,
+                        channel_id=job.channel_id,
+                        vector=vector,
+                        k=settings.memory_top_k,
+                        exclude={c for _, c in history},
+                    )
+                recalled = [m.render() for m in found]
+            record = records[-1]
+            stored = render_content(None, record.text, record.meta)
+            current_payload = json.dumps(current.payload, ensure_ascii=False, separators=(",", ":"))
+            window = self._build_context(system_prompt, [{"role": r, "content": c} for r, c in history], current_payload, stored, recalled, summary_text)
+            replied = True
+            priority = self._priority(job)
+            if self.native_tools:
+                replied = await self._respond_native(job, sink, window, timer, priority)
+            elif job.reply is not None:
+                parsed = ChatResponse.model_validate(job.reply)
+                initial_msg = await timer.timed("discord_send", sink.reply(parsed.message.content))
+                if parsed.tool is not None:
+                    await sink.flush()
+                    await self._follow_up(job, sink, timer, parsed, initial_msg, system_prompt, current_payload, stored, recalled, summary_text, priority)
+            else:
+                progressive: ProgressiveReply | None = None
+                with timer.stage("llm"):
+                    if settings.stream_replies:
+                        progressive = sink.progressive(settings.stream_edit_interval_ms / 1000)
+                    if progressive is not None:
+                        parsed = await self.ai.chat_stream(
+                            window.text,
+                            system_prompt=window.system_prompt,
+                            history=window.history,
+                            on_text=progressive.update,
+                            priority=priority,
+                        )
+                    else:
+                        parsed = await self.ai.chat(window.text, system_prompt=window.system_prompt, history=window.history, priority=priority)
+                if not parsed or not getattr(parsed, "message", None) or not getattr(parsed.message, "content", None):
+                    return
+                send = progressive.finish(parsed.message.content) if progressive is not None else sink.reply(parsed.message.content)
+                initial_msg, _ = await asyncio.gather(
+                    timer.timed("discord_send", send),
+                    timer.timed("db_write", self._store_assistant(job, parsed)),
+                )
+                job.reply = parsed.model_dump(mode="json")
+                await sink.checkpoint(job)
+
+                if getattr(parsed, "tool", None):
+                    await sink.flush()
+                    await self._follow_up(job, sink, timer, parsed, initial_msg, system_prompt, current_payload, stored, recalled, summary_text, priority)
+            outcome = "ok" if replied else "empty"
+            if memory is not None:
+                memory.notify()
+            self.log.debug(
+                "responded to mention guild=%s channel=%s author=%s batch=%d %s",
+                gid,
+                job.channel_id,
+                current.author_id,
+                len(job.items),
+                timer.summary(),
+            )
+        except Exception:
+            outcome = "error"
+            self.log.error("mention handler error %s", timer.summary(), exc_info=True)
+            raise
+        finally:
+            MENTIONS.inc(outcome=outcome)
+            MENTION_SECONDS.observe(timer.total_ms / 1000)
+
+    async def _follow_up(
+        self,
+        job: MentionJob,
+        sink: ReplySink,
+        timer: StageTimer,
+        parsed: ChatResponse,
+        initial_msg: Any,
+        system_prompt: str,
+        current_payload: str,
+        stored: str,
+        recalled: list[str],
+        summary_text: Optional[str],
+        priority: int,
+    ) -> None:
+        if job.followup is not None:
+            followup = ChatResponse.model_validate(job.followup)
+            await timer.timed("discord_send", sink.follow_up(initial_msg, followup.message.content))
+            return
+        gid = job.guild_id
+        if job.tool_stored:
+            with timer.stage("db_append_read"):
+                history = await self.repo.get_recent_history(guild_id=gid, channel_id=job.channel_id, limit=self.history_limit)
+        else:
+            with timer.stage("tool"):
+                tool_result = await self.tools.execute(parsed.tool)
+            with timer.stage("db_append_read"):
+                history = await self.repo.append_and_get_history(
+                    [{"user_id": job.bot_id, "role": "tool", "meta": self.tools.serialize_result(tool_result)}],
+                    guild_id=gid,
+                    channel_id=job.channel_id,
+                    limit=self.history_limit,
+                )
+            job.tool_stored = True
+            await sink.checkpoint(job)
+        window = self._build_context(system_prompt, [{"role": r, "content": c} for r, c in history], current_payload, stored, recalled, summary_text)
+        with timer.stage("llm"):
+            followup = await self.ai.chat(window.text, system_prompt=window.system_prompt, history=window.history, priority=priority)
+        if followup and getattr(followup, "message", None) and getattr(followup.message, "content", None):
+            await asyncio.gather(
+                timer.timed("discord_send", sink.follow_up(initial_msg, followup.message.content)),
+                timer.timed("db_write", self._store_assistant(job, followup)),
+            )
+            job.followup = followup.model_dump(mode="json")
+            await sink.checkpoint(job)
+
+    def _priority(self, job: MentionJob) -> int:
+        if job.items[-1].author_id in self.settings.owner_ids:
+            return PRIORITY_OWNER
+        return PRIORITY_DM if job.guild_id is None else PRIORITY_GUILD
+
+    async def _respond_native(self, job: MentionJob, sink: ReplySink, window: ContextWindow, timer: StageTimer, priority: int) -> bool:
+        async def run_tools(tools: list[ToolUsage]) -> list[dict]:
+            with timer.stage("tool"):
+                return await self.tools.execute_many(tools)
+
+        if job.reply is not None:
+            await timer.timed("discord_send", sink.reply(ChatResponse.model_validate(job.reply).message.content))
+            return True
+        with timer.stage("llm"):
+            outcome = await self.ai.chat_with_tools(
+                window.text,
+                tools=self.tools.tool_schemas(),
+                execute=run_tools,
+                system_prompt=window.system_prompt,
+                history=window.history,
+                max_rounds=self.settings.max_tool_rounds,
+                priority=priority,
+            )
+        content = outcome.response.message.content
+        if not content:
+            return False
+        await asyncio.gather(
+            timer.timed("discord_send", sink.reply(content)),
+            timer.timed("db_write", self._store_exchange(job, outcome.tool_results, outcome.response)),
+        )
+        job.reply = outcome.response.model_dump(mode="json")
+        await sink.checkpoint(job)
+        return True
+
+    @staticmethod
+    def _user_row(item: MentionItem, record: CompactRecord) -> dict:
+        return {
+            "user_id": item.author_id,
+            "role": "user",
+            "discord_message_id": record.discord_message_id,
+            "text": record.text,
+            "meta": record.meta,
+        }
+
+    async def _store_assistant(self, job: MentionJob, response: ChatResponse) -> None:
+        record = encode_assistant_payload(response.model_dump())
+        await self.repo.add_message(
+            guild_id=job.guild_id,
+            channel_id=job.channel_id,
+            user_id=job.bot_id,
+            role="assistant",
+            text=record.text,
+            meta=record.meta,
+            refresh=False,
+            wait=False,
+        )
+
+    async def _store_exchange(self, job: MentionJob, tool_results: list[dict], response: ChatResponse) -> None:
+        for result in tool_results:
+            await self.repo.add_message(
+                guild_id=job.guild_id,
+                channel_id=job.channel_id,
+                user_id=job.bot_id,
+                role="tool",
+                meta=self.tools.serialize_result(result),
+                refresh=False,
+                wait=False,
+            )
+        await self._store_assistant(job, response)
+
+    def _build_context(
+        self,
+        system_prompt: str,
+        history: list[dict[str, str]],
+        text: str,
+        stored: str,
+        recalled: list[str] | None = None,
+        summary: str | None = None,
+    ) -> ContextWindow:
+        window = self.context.build(
+            system_prompt=system_prompt,
+            history=history,
+            text=text,
+            duplicate_of=stored,
+            recalled=recalled or (),
+            summary=summary,
+        )
+        self.log.debug(
+            "context tokens=%d/%d system=%d summary=%d memory=%d history=%d message=%d kept=%d dropped=%d truncated=%d",
+            window.tokens,
+            window.budget,
+            window.counts.get("system", 0),
+            window.counts.get("summary", 0),
+            window.counts.get("memory", 0),
+            window.counts.get("history", 0),
+            window.counts.get("message", 0),
+            len(window.history),
+            window.dropped,
+            window.truncated,
+        )
+        return window
+
+
+async def _nothing() -> None:
+    return None
+
+
+def _observe_stage(name: str, seconds: float) -> None:
+    MENTION_STAGE_SECONDS.observe(seconds, stage=name)
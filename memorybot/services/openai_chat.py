@@ -1,12 +1,51 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
-from typing import Iterable, Mapping, Optional
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Iterable, Mapping, Optional
 
+import openai
+from jiter import from_json
 from openai import AsyncOpenAI
+from pydantic import TypeAdapter, ValidationError
 
-from memorybot.schemas.llm import ChatResponse
+from memorybot.schemas.llm import ChatMessage, ChatResponse, ToolUsage
 from memorybot.core.config import Settings
+from memorybot.core.metrics import OPENAI_ERRORS, OPENAI_RETRIES, OPENAI_SECONDS, OPENAI_STRUCTURED, OPENAI_TOKENS, OPENAI_WAIT_SECONDS
+from memorybot.core.tracing import span
+from memorybot.services.rate_limiter import PRIORITY_GUILD, Permit, RateLimiter, get_rate_limiter, priority_name
+from memorybot.utils.json_repair import repair_json
+
+
+_COMPLETION_ESTIMATE = 512
+_CHAT_RESPONSE: TypeAdapter[ChatResponse] = TypeAdapter(ChatResponse)
+_REQUERY_PROMPT = "Your previous reply was not valid JSON for the required schema. Send the same reply again as a single JSON object only."
+_FORMAT_HINTS = ("response_format", "json_schema", "structured output")
+_UNSTRUCTURED_MODELS: set[str] = set()
+
+
+def create_client(settings: Settings, *, max_retries: Optional[int] = None) -> AsyncOpenAI:
+    kwargs: dict = {}
+    if max_retries is not None:
+        kwargs["max_retries"] = max_retries
+    if settings.openai_api_key:
+        kwargs["api_key"] = settings.openai_api_key
+    base = settings.openai_base_url or settings.openai_api_base
+    if base:
+        kwargs["base_url"] = base
+    return AsyncOpenAI(**kwargs) if kwargs else AsyncOpenAI()
+
+
+@dataclass
+class ToolChatResult:
+    response: ChatResponse
+    tool_results: list[dict[str, Any]] = field(default_factory=list)
+    rounds: int = 0
 
 
 class OpenAIChatService:
@@ -14,26 +53,91 @@ class OpenAIChatService:
         self._settings = settings
         self._client: Optional[AsyncOpenAI] = None
         self._model = model or settings.openai_model
+        self._max_retries = settings.openai_max_retries
+        self._retry_base = settings.openai_retry_base_ms / 1000
+        self._retry_max = settings.openai_retry_max_ms / 1000
         self._log = logging.getLogger("memorybot.service.openai")
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.structured: dict[str, int] = {}
 
     def _client_instance(self) -> AsyncOpenAI:
         if self._client is None:
-            kwargs: dict = {}
-            if self._settings.openai_api_key:
-                kwargs["api_key"] = self._settings.openai_api_key
-            base = self._settings.openai_base_url or self._settings.openai_api_base
-            if base:
-                kwargs["base_url"] = base
-            self._client = AsyncOpenAI(**kwargs) if kwargs else AsyncOpenAI()
+            self._client = create_client(self._settings, max_retries=0)
         return self._client
 
-    async def chat(
+    async def _acquire(self, limiter: Optional[RateLimiter], tokens: int, priority: int) -> Optional[Permit]:
+        if limiter is None:
+            return None
+        permit = await limiter.acquire(tokens, priority)
+        OPENAI_WAIT_SECONDS.observe(permit.waited, priority=priority_name(priority))
+        return permit
+
+    def _backoff(self, attempt: int) -> float:
+        cap = min(self._retry_max, self._retry_base * 2**attempt)
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def _retry_delay(self, error: Exception, attempt: int, limiter: Optional[RateLimiter]) -> Optional[float]:
+        if attempt >= self._max_retries:
+            return None
+        if isinstance(error, openai.APIStatusError):
+            status = error.status_code
+            if status == 429 and getattr(error, "code", None) == "insufficient_quota":
+                return None
+            if status not in (408, 409, 429) and status < 500:
+                return None
+            after = _retry_after(error.response.headers)
+            if after is None:
+                delay = self._backoff(attempt)
+            else:
+                delay = after + random.uniform(0, min(1.0, after * 0.1))
+            if status == 429 and limiter is not None:
+                limiter.pause(after if after is not None else delay)
+            return delay
+        if isinstance(error, openai.APIConnectionError):
+            return self._backoff(attempt)
+        return None
+
+    async def _call(self, op: str, call: Callable[..., Awaitable[Any]], *, priority: int = PRIORITY_GUILD, **kwargs: Any) -> Any:
+        limiter = get_rate_limiter()
+        tokens = _estimate_tokens(kwargs.get("messages"), kwargs.get("max_tokens")) if limiter is not None else 0
+        attempt = 0
+        while True:
+            permit = await self._acquire(limiter, tokens, priority)
+            start = time.perf_counter()
+            try:
+                with span(f"openai.{op}"):
+                    result = await call(model=self._model, **kwargs)
+            except Exception as e:
+                OPENAI_ERRORS.inc(model=self._model, op=op)
+                delay = self._retry_delay(e, attempt, limiter)
+                if delay is None:
+                    raise
+                reason = _error_reason(e)
+                self._log.warning("openai %s failed (%s); retry %d/%d in %.1fs", op, reason, attempt + 1, self._max_retries, delay)
+            else:
+                usage = getattr(result, "usage", None)
+                if permit is not None:
+                    permit.settle(getattr(usage, "total_tokens", None))
+                self._record_usage(usage)
+                return result
+            finally:
+                OPENAI_SECONDS.observe(time.perf_counter() - start, model=self._model, op=op)
+                if permit is not None and limiter is not None:
+                    limiter.release(permit)
+            self.retries += 1
+            OPENAI_RETRIES.inc(model=self._model, reason=reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _build_messages(
         self,
         text: str,
-        *,
-        system_prompt: str | None = None,
-        history: Iterable[Mapping[str, str]] | None = None,
-    ) -> ChatResponse:
+        system_prompt: str | None,
+        history: Iterable[Mapping[str, str]] | None,
+    ) -> list[dict]:
         msgs: list[dict] = []
         if system_prompt:
             msgs.append({"role": "system", "content": system_prompt})
@@ -41,33 +145,244 @@ class OpenAIChatService:
             for m in history:
                 r = m.get("role")
                 c = m.get("content")
-                if r in {"user", "assistant", "tool"} and c:
+                if not c:
+                    continue
+                if r in {"system", "user", "assistant"}:
                     msgs.append({"role": r, "content": c})
+                elif r == "tool":
+                    msgs.append({"role": "system", "content": f"Tool result: {c}"})
         msgs.append({"role": "user", "content": text})
+        return msgs
+
+    async def chat(
+        self,
+        text: str,
+        *,
+        system_prompt: str | None = None,
+        history: Iterable[Mapping[str, str]] | None = None,
+        priority: int = PRIORITY_GUILD,
+    ) -> ChatResponse:
+        msgs = self._build_messages(text, system_prompt, history)
         client = self._client_instance()
+        response_format: Optional[dict[str, Any]] = None if self._model in _UNSTRUCTURED_MODELS else _RESPONSE_FORMAT
+        kwargs: dict[str, Any] = {"response_format": response_format} if response_format is not None else {}
         try:
-            resp = await client.chat.completions.parse(
-                model=self._model,
-                messages=msgs,
-                response_format=ChatResponse,
-            )
-            return resp.choices[0].message.parsed
-        except Exception:
-            self._log.warning("parse failed; falling back to create", exc_info=True)
-        try:
-            created = await client.chat.completions.create(model=self._model, messages=msgs)
-            content = None
             try:
-                content = created.choices[0].message.content if created.choices else None
-            except Exception:
-                content = None
-            return ChatResponse(message=self._fallback_message(content or ""))
+                created = await self._call("chat", client.chat.completions.create, priority=priority, messages=msgs, **kwargs)
+            except openai.APIStatusError as e:
+                if response_format is None or not _format_rejected(e):
+                    raise
+                self._log.warning("model %s rejected structured output; sending it plain JSON requests from now on: %s", self._model, e)
+                _UNSTRUCTURED_MODELS.add(self._model)
+                response_format = None
+                kwargs = {}
+                created = await self._call("chat", client.chat.completions.create, priority=priority, messages=msgs)
         except Exception as e:
             self._log.error("openai chat error", exc_info=e)
             raise
-        
+        content, refusal, truncated = _reply_content(created)
+        if refusal:
+            return ChatResponse(message=self._fallback_message(refusal), tool=None)
+        parsed = self._decode(content, truncated=truncated)
+        if parsed is not None:
+            return parsed
+        self._log.warning("unusable structured reply (%d chars); asking the model again", len(content))
+        try:
+            created = await self._call(
+                "requery",
+                client.chat.completions.create,
+                priority=priority,
+                messages=[*msgs, {"role": "assistant", "content": content}, {"role": "user", "content": _REQUERY_PROMPT}],
+                **kwargs,
+            )
+            again, _, truncated = _reply_content(created)
+            parsed = self._decode(again, truncated=truncated, requeried=True)
+            if parsed is not None:
+                return parsed
+            content = again or content
+        except openai.APIError:
+            self._log.warning("re-query failed; using the raw reply", exc_info=True)
+        OPENAI_STRUCTURED.inc(result="raw")
+        self.structured["raw"] = self.structured.get("raw", 0) + 1
+        return ChatResponse(message=self._fallback_message(content), tool=None)
+
+    def _decode(self, content: str, *, truncated: bool = False, requeried: bool = False) -> Optional[ChatResponse]:
+        parsed, result = _decode_chat_response(content, truncated=truncated)
+        if parsed is None:
+            return None
+        if result == "truncated":
+            self._log.warning("structured reply was cut off; keeping the message and dropping any tool request")
+        elif result == "repaired":
+            self._log.debug("repaired a malformed structured reply locally")
+        if requeried:
+            result = "requeried"
+        OPENAI_STRUCTURED.inc(result=result)
+        self.structured[result] = self.structured.get(result, 0) + 1
+        return parsed
+
+    async def chat_stream(
+        self,
+        text: str,
+        *,
+        system_prompt: str | None = None,
+        history: Iterable[Mapping[str, str]] | None = None,
+        on_text: Callable[[str], None] | None = None,
+        priority: int = PRIORITY_GUILD,
+    ) -> ChatResponse:
+        if self._model in _UNSTRUCTURED_MODELS:
+            return await self.chat(text, system_prompt=system_prompt, history=history, priority=priority)
+        msgs = self._build_messages(text, system_prompt, history)
+        client = self._client_instance()
+        limiter = get_rate_limiter()
+        permit = await self._acquire(limiter, _estimate_tokens(msgs, None) if limiter is not None else 0, priority)
+        start = time.perf_counter()
+        raw = ""
+        truncated = False
+        try:
+            with span("openai.stream"):
+                async with client.chat.completions.stream(
+                    model=self._model,
+                    messages=msgs,
+                    response_format=ChatResponse,
+                    stream_options={"include_usage": True},
+                ) as stream:
+                    last = ""
+                    async for event in stream:
+                        if event.type != "content.delta":
+                            continue
+                        raw = event.snapshot
+                        if on_text is None:
+                            continue
+                        partial = _partial_content(event.snapshot)
+                        if partial and partial != last:
+                            last = partial
+                            on_text(partial)
+                    completion = await stream.get_final_completion()
+            OPENAI_SECONDS.observe(time.perf_counter() - start, model=self._model, op="stream")
+            usage = getattr(completion, "usage", None)
+            if permit is not None:
+                permit.settle(getattr(usage, "total_tokens", None))
+            self._record_usage(usage)
+            parsed = completion.choices[0].message.parsed if completion.choices else None
+            if parsed is not None:
+                return parsed
+            self._log.warning("stream returned no parsed response; falling back to chat")
+        except Exception as e:
+            if isinstance(e, openai.APIError):
+                OPENAI_ERRORS.inc(model=self._model, op="stream")
+                self._retry_delay(e, 0, limiter)
+                raw = ""
+            if isinstance(e, openai.APIStatusError) and _format_rejected(e):
+                _UNSTRUCTURED_MODELS.add(self._model)
+            truncated = isinstance(e, openai.LengthFinishReasonError)
+            self._log.warning("stream failed", exc_info=True)
+        finally:
+            if permit is not None and limiter is not None:
+                limiter.release(permit)
+        if raw:
+            parsed = self._decode(raw, truncated=truncated)
+            if parsed is not None:
+                return parsed
+        self._log.warning("falling back to chat after the stream")
+        return await self.chat(text, system_prompt=system_prompt, history=history, priority=priority)
+
+    async def chat_with_tools(
+        self,
+        text: str,
+        *,
+        tools: list[dict[str, Any]],
+        execute: Callable[[list[ToolUsage]], Awaitable[list[dict[str, Any]]]],
+        system_prompt: str | None = None,
+        history: Iterable[Mapping[str, str]] | None = None,
+        max_rounds: int = 3,
+        priority: int = PRIORITY_GUILD,
+    ) -> ToolChatResult:
+        msgs = self._build_messages(text, system_prompt, history)
+        client = self._client_instance()
+        results: list[dict[str, Any]] = []
+        rounds = 0
+        while True:
+            final = rounds >= max_rounds
+            kwargs: dict[str, Any] = {"tools": tools, "tool_choice": "none" if final else "auto"}
+            if not final:
+                kwargs["parallel_tool_calls"] = True
+            created = await self._call("tools", client.chat.completions.create, priority=priority, messages=msgs, **kwargs)
+            reply = created.choices[0].message if created.choices else None
+            calls = [c for c in (getattr(reply, "tool_calls", None) or []) if getattr(c, "function", None)]
+            if final or not calls:
+                content = getattr(reply, "content", None) or ""
+                return ToolChatResult(ChatResponse(message=ChatMessage(content=content), tool=None), results, rounds)
+            rounds += 1
+            msgs.append(
+                {
+                    "role": "assistant",
+                    "content": reply.content,
+                    "tool_calls": [
+                        {
+                            "id": c.id,
+                            "type": "function",
+                            "function": {"name": c.function.name, "arguments": c.function.arguments},
+                        }
+                        for c in calls
+                    ],
+                }
+            )
+            usages = [_tool_usage(c.function.name, c.function.arguments) for c in calls]
+            valid = [u for u in usages if isinstance(u, ToolUsage)]
+            executed = iter(await execute(valid)) if valid else iter(())
+            outputs = [next(executed) if isinstance(u, ToolUsage) else u for u in usages]
+            self._log.debug("tool round=%d calls=%d", rounds, len(calls))
+            for call, output in zip(calls, outputs):
+                msgs.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": call.id,
+                        "content": json.dumps(output, ensure_ascii=False, separators=(",", ":"), default=str),
+                    }
+                )
+            results.extend(outputs)
+
+    async def complete(self, system_prompt: str, text: str, *, max_tokens: int | None = None, priority: int = PRIORITY_GUILD) -> str:
+        client = self._client_instance()
+        kwargs: dict[str, Any] = {}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        created = await self._call(
+            "complete",
+            client.chat.completions.create,
+            priority=priority,
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": text}],
+            **kwargs,
+        )
+        content = created.choices[0].message.content if created.choices else None
+        return (content or "").strip()
+
+    def _record_usage(self, usage: Any) -> None:
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+        self.prompt_tokens += prompt
+        self.cached_prompt_tokens += cached
+        self.completion_tokens += completion
+        OPENAI_TOKENS.inc(prompt, model=self._model, kind="prompt")
+        OPENAI_TOKENS.inc(cached, model=self._model, kind="cached_prompt")
+        OPENAI_TOKENS.inc(completion, model=self._model, kind="completion")
+        self._log.debug("usage prompt=%d cached=%d completion=%d", prompt, cached, completion)
+
+    def usage_stats(self) -> dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_rate": (self.cached_prompt_tokens / self.prompt_tokens) if self.prompt_tokens else 0.0,
+            "retries": self.retries,
+            "structured": dict(self.structured),
+        }
+
     def _fallback_message(self, content: str):
-        from memorybot.schemas.llm import ChatMessage
         return ChatMessage(content=content)
 
     async def aclose(self) -> None:
@@ -83,3 +398,129 @@ class OpenAIChatService:
         res = close()
         if hasattr(res, "__await__"):
             await res
+
+
+def _strict_schema(schema: Any) -> Any:
+    if isinstance(schema, list):
+        return [_strict_schema(s) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+    out = {k: _strict_schema(v) for k, v in schema.items()}
+    if out.get("type") == "object" and "properties" in out:
+        out.setdefault("additionalProperties", False)
+        out["required"] = list(out["properties"])
+        for prop in out["properties"].values():
+            if isinstance(prop, dict) and prop.get("default", ...) is None:
+                prop.pop("default")
+    return out
+
+
+def _format_rejected(error: openai.APIStatusError) -> bool:
+    if error.status_code not in (400, 422):
+        return False
+    fields = (getattr(error, "param", None), getattr(error, "code", None), error.message)
+    return any(hint in str(value).lower() for value in fields if value for hint in _FORMAT_HINTS)
+
+
+def _response_format(name: str, adapter: TypeAdapter[Any]) -> dict[str, Any]:
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": _strict_schema(adapter.json_schema()), "strict": True}}
+
+
+_RESPONSE_FORMAT = _response_format("ChatResponse", _CHAT_RESPONSE)
+
+
+def _reply_content(completion: Any) -> tuple[str, Optional[str], bool]:
+    choice = completion.choices[0] if getattr(completion, "choices", None) else None
+    if choice is None:
+        return "", None, False
+    message = choice.message
+    return message.content or "", getattr(message, "refusal", None), getattr(choice, "finish_reason", None) == "length"
+
+
+def _decode_chat_response(content: str, *, truncated: bool = False) -> tuple[Optional[ChatResponse], str]:
+    if not content:
+        return None, "empty"
+    try:
+        parsed = _CHAT_RESPONSE.validate_json(content)
+    except ValidationError:
+        parsed = None
+    if parsed is not None:
+        if truncated and parsed.tool is not None:
+            return parsed.model_copy(update={"tool": None}), "truncated"
+        return parsed, "valid"
+    data = repair_json(content)
+    result = "repaired"
+    if data is None:
+        data = repair_json(content, partial=True)
+        result = "truncated"
+    if not isinstance(data, dict):
+        return None, "invalid"
+    if isinstance(data.get("message"), str):
+        data["message"] = {"content": data["message"]}
+    if truncated or result == "truncated":
+        data["tool"] = None
+        result = "truncated"
+    data.setdefault("tool", None)
+    try:
+        return _CHAT_RESPONSE.validate_python(data), result
+    except ValidationError:
+        return None, "invalid"
+
+
+def _estimate_tokens(messages: Any, max_tokens: Optional[int]) -> int:
+    chars = sum(len(m["content"]) for m in messages or () if isinstance(m.get("content"), str))
+    return chars // 4 + 4 * len(messages or ()) + (max_tokens or _COMPLETION_ESTIMATE)
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_reason(error: Exception) -> str:
+    if isinstance(error, openai.APIStatusError):
+        return str(error.status_code)
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    return "connection"
+
+
+def _tool_usage(name: str, arguments: str | None) -> ToolUsage | dict[str, Any]:
+    try:
+        args = json.loads(arguments) if arguments else {}
+        if not isinstance(args, dict):
+            raise ValueError("arguments must be an object")
+        return ToolUsage(name=name, arguments=args)
+    except ValueError as e:
+        return {"status": "error", "error": f"invalid arguments: {e}", "tool": name}
+
+
+def _partial_content(snapshot: str) -> str:
+    if not snapshot or not snapshot.lstrip():
+        return ""
+    try:
+        parsed: Any = from_json(snapshot.encode("utf-8"), partial_mode="trailing-strings")
+    except ValueError:
+        return ""
+    if not isinstance(parsed, dict):
+        return ""
+    message = parsed.get("message")
+    if not isinstance(message, dict):
+        return ""
+    content = message.get("content")
+    return content if isinstance(content, str) else ""
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+
+PRIORITY_OWNER = 0
+PRIORITY_DM = 1
+PRIORITY_GUILD = 2
+PRIORITY_BACKGROUND = 3
+
+_PRIORITY_NAMES = {PRIORITY_OWNER: "owner", PRIORITY_DM: "dm", PRIORITY_GUILD: "guild", PRIORITY_BACKGROUND: "background"}
+
+
+def priority_name(priority: int) -> str:
+    return _PRIORITY_NAMES.get(priority, str(priority))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, *, burst_seconds: float = 10.0):
+        self.rate = float(per_minute) / 60.0
+        self.capacity = max(1.0, self.rate * max(1.0, float(burst_seconds)))
+        self._level = self.capacity
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._level = min(self.capacity, self._level + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        need = min(float(amount), self.capacity)
+        return 0.0 if self._level >= need else (need - self._level) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self._level -= amount
+
+    @property
+    def level(self) -> float:
+        self._refill(time.monotonic())
+        return self._level
+
+
+class Permit:
+    __slots__ = ("tokens", "used", "waited")
+
+    def __init__(self, tokens: int, waited: float):
+        self.tokens = tokens
+        self.used: Optional[int] = None
+        self.waited = waited
+
+    def settle(self, used: Optional[int]) -> None:
+        self.used = used
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        *,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 0,
+        burst_seconds: float = 10.0,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._requests = TokenBucket(rpm, burst_seconds=burst_seconds) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm, burst_seconds=burst_seconds) if tpm > 0 else None
+        self._max_concurrency = max(0, int(max_concurrency))
+        self._heap: list[tuple[int, int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._inflight = 0
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._log = logger or logging.getLogger("memorybot.service.ratelimit")
+        self.granted = 0
+        self.delayed = 0
+        self.pauses = 0
+        self.wait_s = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for *_, fut in self._heap if not fut.done())
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def pause(self, seconds: float) -> None:
+        until = time.monotonic() + max(0.0, float(seconds))
+        if until <= self._paused_until:
+            return
+        self._paused_until = until
+        self.pauses += 1
+        self._log.info("rate limited by the provider; holding new requests for %.1fs", seconds)
+        self._schedule()
+
+    def _delay(self, tokens: int, now: float) -> float:
+        delay = self._paused_until - now
+        if self._requests is not None:
+            delay = max(delay, self._requests.wait_time(1, now))
+        if self._tokens is not None and tokens:
+            delay = max(delay, self._tokens.wait_time(tokens, now))
+        return delay
+
+    def _schedule(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._heap:
+            _, _, tokens, fut = self._heap[0]
+            if fut.done():
+                heapq.heappop(self._heap)
+                continue
+            if self._max_concurrency and self._inflight >= self._max_concurrency:
+                return
+            now = time.monotonic()
+            delay = self._delay(tokens, now)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._schedule)
+                return
+            heapq.heappop(self._heap)
+            if self._requests is not None:
+                self._requests.take(1, now)
+            if self._tokens is not None:
+                self._tokens.take(tokens, now)
+            self._inflight += 1
+            fut.set_result(None)
+
+    def _release(self, permit: Optional[Permit]) -> None:
+        self._inflight -= 1
+        if permit is not None and permit.used is not None and permit.used > permit.tokens and self._tokens is not None:
+            self._tokens.take(permit.used - permit.tokens, time.monotonic())
+        self._schedule()
+
+    async def acquire(self, tokens: int = 0, priority: int = PRIORITY_GUILD) -> Permit:
+        start = time.perf_counter()
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), tokens, fut))
+        self._schedule()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(None)
+            else:
+                self._schedule()
+            raise
+        waited = time.perf_counter() - start
+        self.granted += 1
+        if waited > 0.001:
+            self.delayed += 1
+            self.wait_s += waited
+        return Permit(tokens, waited)
+
+    def release(self, permit: Permit) -> None:
+        self._release(permit)
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0, priority: int = PRIORITY_GUILD) -> AsyncIterator[Permit]:
+        permit = await self.acquire(tokens, priority)
+        try:
+            yield permit
+        finally:
+            self.release(permit)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "granted": self.granted,
+            "delayed": self.delayed,
+            "avg_wait_ms": (self.wait_s / self.delayed * 1000) if self.delayed else 0.0,
+            "pauses": self.pauses,
+            "waiting": self.waiting,
+            "inflight": self._inflight,
+        }
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def start_rate_limiter(*, rpm: int = 0, tpm: int = 0, max_concurrency: int = 0, burst_seconds: float = 10.0) -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter(rpm=rpm, tpm=tpm, max_concurrency=max_concurrency, burst_seconds=burst_seconds)
+    return _limiter
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    return _limiter
+
+
+def stop_rate_limiter() -> None:
+    global _limiter
+    _limiter = None
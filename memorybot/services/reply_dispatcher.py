@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+from collections import OrderedDict
+from typing import Any, Optional
+
+import discord
+from pydantic import ValidationError
+
+from memorybot.db.work_queue import Job, LeaseLost, WorkQueue
+from memorybot.schemas.jobs import ReplyJob
+
+
+class ReplyDispatcher:
+    def __init__(
+        self,
+        client: discord.Client,
+        queue: WorkQueue,
+        *,
+        concurrency: int = 4,
+        poll_interval: float = 0.2,
+        max_threads: int = 1024,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._client = client
+        self._queue = queue
+        self._concurrency = max(1, int(concurrency))
+        self._poll_interval = max(0.01, float(poll_interval))
+        self._max_threads = max(1, int(max_threads))
+        self._threads: OrderedDict[str, int] = OrderedDict()
+        self._owner = f"gateway-{socket.gethostname()}-{os.getpid()}"
+        self._active: set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._log = logger or logging.getLogger("memorybot.service.replies")
+        self.sent = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="memorybot-reply-dispatcher")
+
+    async def _run(self) -> None:
+        while True:
+            free = self._concurrency - len(self._active)
+            jobs: list[Job] = []
+            if free > 0 and self._client.is_ready():
+                try:
+                    jobs = await self._queue.claim("replies", self._owner, limit=free)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self._log.error("claiming replies failed", exc_info=True)
+            for job in jobs:
+                task = asyncio.create_task(self._dispatch(job))
+                self._active.add(task)
+                task.add_done_callback(self._done)
+            if jobs and len(self._active) < self._concurrency:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._active.discard(task)
+        self._wake.set()
+
+    def _remember(self, thread: str, message_id: int) -> None:
+        self._threads[thread] = message_id
+        self._threads.move_to_end(thread)
+        while len(self._threads) > self._max_threads:
+            self._threads.popitem(last=False)
+
+    async def _send(self, reply: ReplyJob) -> discord.Message:
+        channel = self._client.get_partial_messageable(reply.channel_id, guild_id=reply.guild_id)
+        target = self._threads.get(reply.thread) if reply.follow else None
+        return await channel.get_partial_message(target or reply.reply_to).reply(reply.content, mention_author=False)
+
+    @staticmethod
+    def _permanent(error: Exception) -> bool:
+        if isinstance(error, ValidationError):
+            return True
+        if isinstance(error, (discord.Forbidden, discord.NotFound)):
+            return True
+        return isinstance(error, discord.HTTPException) and error.status < 500 and error.status != 429
+
+    async def _dispatch(self, job: Job) -> None:
+        try:
+            try:
+                reply = ReplyJob.model_validate(job.payload)
+                sent = await self._send(reply)
+            except Exception as e:
+                self.failed += 1
+                error = f"{type(e).__name__}: {e}"
+                if self._permanent(e):
+                    await self._queue.bury(job, error)
+                else:
+                    await self._queue.fail(job, error)
+                return
+            self._remember(reply.thread, sent.id)
+            self.sent += 1
+            await self._queue.complete(job)
+        except LeaseLost:
+            self._log.warning("lost the lease on %r; it will be sent again", job)
+        except Exception:
+            self._log.error("reply dispatch failed for %r", job, exc_info=True)
+
+    async def close(self) -> None:
+        task = self._task
+        self._task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._active:
+            await asyncio.gather(*list(self._active), return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {"sent": self.sent, "failed": self.failed, "active": len(self._active), "threads": len(self._threads)}
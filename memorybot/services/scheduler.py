@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+
+class MentionScheduler(Generic[T]):
+    def __init__(
+        self,
+        handler: Callable[[list[T]], Awaitable[None]],
+        *,
+        debounce: float = 0.3,
+        max_batch: int = 5,
+        max_concurrency: int = 8,
+        max_pending: int = 100,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._handler = handler
+        self._debounce = max(0.0, float(debounce))
+        self._max_batch = max(1, int(max_batch))
+        self._max_pending = max(1, int(max_pending))
+        self._semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+        self._queues: dict[Hashable, deque[tuple[float, T]]] = {}
+        self._arrivals: dict[Hashable, asyncio.Event] = {}
+        self._workers: dict[Hashable, asyncio.Task] = {}
+        self._pending = 0
+        self._active = 0
+        self._log = logger or logging.getLogger("memorybot.service.scheduler")
+        self.accepted = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.batches = 0
+
+    def submit(self, key: Hashable, item: T) -> bool:
+        if self._pending >= self._max_pending:
+            self.rejected += 1
+            self._log.warning("mention queue full pending=%d; dropping key=%s", self._pending, key)
+            return False
+        loop = asyncio.get_running_loop()
+        self._queues.setdefault(key, deque()).append((loop.time(), item))
+        self._pending += 1
+        self.accepted += 1
+        event = self._arrivals.get(key)
+        if event is not None:
+            event.set()
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.create_task(self._run(key), name=f"memorybot-mentions-{key}")
+        return True
+
+    async def _settle(self, key: Hashable, queue: deque[tuple[float, T]]) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = queue[0][0] + self._debounce
+        event = self._arrivals.setdefault(key, asyncio.Event())
+        while len(queue) < self._max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _run(self, key: Hashable) -> None:
+        queue = self._queues[key]
+        try:
+            while queue:
+                if self._debounce > 0:
+                    await self._settle(key, queue)
+                batch = [queue.popleft()[1] for _ in range(min(len(queue), self._max_batch))]
+                self._pending -= len(batch)
+                self.batches += 1
+                self.coalesced += len(batch) - 1
+                async with self._semaphore:
+                    self._active += 1
+                    try:
+                        await self._handler(batch)
+                    except Exception:
+                        self._log.error("mention batch failed key=%s size=%d", key, len(batch), exc_info=True)
+                    finally:
+                        self._active -= 1
+        finally:
+            self._workers.pop(key, None)
+            self._arrivals.pop(key, None)
+            if not queue:
+                self._queues.pop(key, None)
+
+    def close(self) -> None:
+        for task in list(self._workers.values()):
+            task.cancel()
+        self._workers.clear()
+        self._queues.clear()
+        self._arrivals.clear()
+        self._pending = 0
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": self._pending,
+            "active": self._active,
+            "channels": len(self._workers),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+        }
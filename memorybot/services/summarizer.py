@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from memorybot.core.cluster import get_cluster
+from memorybot.core.config import Settings
+from memorybot.db.models import ConversationSummary
+from memorybot.db.repository import ConversationRepository, SummaryRepository
+from memorybot.prompt.summary import build_summary_input, build_summary_prompt, format_transcript
+from memorybot.services.openai_chat import OpenAIChatService
+from memorybot.services.rate_limiter import PRIORITY_BACKGROUND
+
+
+Scope = tuple[Optional[int], Optional[int]]
+
+
+class ConversationSummarizer:
+    def __init__(
+        self,
+        ai: OpenAIChatService,
+        *,
+        repo: Optional[ConversationRepository] = None,
+        summaries: Optional[SummaryRepository] = None,
+        segment_size: int = 40,
+        keep_recent: int = 50,
+        interval: float = 30.0,
+        min_call_interval: float = 2.0,
+        max_per_pass: int = 10,
+        max_tokens: int = 400,
+        owns: Optional[Callable[[Optional[int], Optional[int]], bool]] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._ai = ai
+        self._repo = repo or ConversationRepository()
+        self._summaries = summaries or SummaryRepository()
+        self._segment_size = max(1, int(segment_size))
+        self._keep_recent = max(0, int(keep_recent))
+        self._interval = max(0.05, float(interval))
+        self._min_call_interval = max(0.0, float(min_call_interval))
+        self._max_per_pass = max(1, int(max_per_pass))
+        self._max_tokens = max(32, int(max_tokens))
+        self._owns = owns
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._scan_id = 0
+        self._dirty: set[Scope] = set()
+        self._latest: dict[Scope, Optional[ConversationSummary]] = {}
+        self._next_call = 0.0
+        self._log = logger or logging.getLogger("memorybot.service.summarizer")
+        self.summaries_written = 0
+        self.messages_summarized = 0
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="memorybot-summarizer")
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.run_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                self._log.error("summarization pass failed", exc_info=True)
+
+    @staticmethod
+    def _key(guild_id: Optional[int], channel_id: Optional[int]) -> Scope:
+        return (guild_id, None) if guild_id is not None else (None, channel_id)
+
+    async def latest(self, *, guild_id: Optional[int], channel_id: Optional[int]) -> Optional[ConversationSummary]:
+        key = self._key(guild_id, channel_id)
+        if key in self._latest:
+            return self._latest[key]
+        summary = await self._summaries.latest(guild_id=key[0], channel_id=key[1])
+        self._latest[key] = summary
+        return summary
+
+    async def run_pass(self) -> int:
+        scopes, self._scan_id = await self._repo.get_scopes_after_id(self._scan_id)
+        self._dirty.update(self._key(g, c) for g, c in scopes if self._owns is None or self._owns(g, c))
+        written = 0
+        for scope in list(self._dirty):
+            while written < self._max_per_pass:
+                if not await self._summarize_next(scope):
+                    self._dirty.discard(scope)
+                    break
+                written += 1
+            if written >= self._max_per_pass:
+                break
+        return written
+
+    async def _throttle(self) -> None:
+        delay = self._next_call - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next_call = time.monotonic() + self._min_call_interval
+
+    async def _summarize_next(self, scope: Scope) -> bool:
+        guild_id, channel_id = scope
+        previous = await self.latest(guild_id=guild_id, channel_id=channel_id)
+        after = previous.end_message_id if previous is not None else 0
+        window = self._segment_size + self._keep_recent
+        rows = await self._repo.get_messages_after_id(after, guild_id=guild_id, channel_id=channel_id, limit=window)
+        if len(rows) < window:
+            return False
+        segment = rows[: self._segment_size]
+        await self._throttle()
+        started = time.perf_counter()
+        content = await self._ai.complete(
+            build_summary_prompt(max_words=int(self._max_tokens * 0.75)),
+            build_summary_input(previous.content if previous is not None else None, format_transcript(segment)),
+            max_tokens=self._max_tokens,
+            priority=PRIORITY_BACKGROUND,
+        )
+        if not content:
+            self._log.warning("empty summary for scope=%s; will retry on next activity", scope)
+            return False
+        summary = await self._summaries.add(
+            guild_id=guild_id,
+            channel_id=channel_id,
+            start_message_id=segment[0].id,
+            end_message_id=segment[-1].id,
+            message_count=(previous.message_count if previous is not None else 0) + len(segment),
+            content=content,
+        )
+        self._latest[scope] = summary
+        self.summaries_written += 1
+        self.messages_summarized += len(segment)
+        self._log.debug(
+            "summarized scope=%s rows=%d..%d in %.0fms",
+            scope,
+            segment[0].id,
+            segment[-1].id,
+            (time.perf_counter() - started) * 1000,
+        )
+        return True
+
+    async def close(self) -> None:
+        task = self._task
+        self._task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self._ai.aclose()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "dirty_scopes": len(self._dirty),
+            "scan_id": self._scan_id,
+            "summaries": self.summaries_written,
+            "messages": self.messages_summarized,
+            "failures": self.failures,
+        }
+
+
+_summarizer: Optional[ConversationSummarizer] = None
+
+
+def start_summarizer(
+    settings: Settings, *, owns: Optional[Callable[[Optional[int], Optional[int]], bool]] = None
+) -> ConversationSummarizer:
+    global _summarizer
+    if _summarizer is None or not _summarizer.running:
+        cluster = get_cluster()
+        if owns is None and cluster is not None:
+            owns = cluster.owns
+        _summarizer = ConversationSummarizer(
+            OpenAIChatService(settings, model=settings.summary_model),
+            segment_size=settings.summary_segment_size,
+            keep_recent=settings.context_history_limit if settings.summary_keep_recent is None else settings.summary_keep_recent,
+            interval=settings.summary_interval_ms / 1000,
+            min_call_interval=settings.summary_min_call_interval_ms / 1000,
+            max_per_pass=settings.summary_max_per_pass,
+            max_tokens=settings.summary_max_tokens,
+            owns=owns,
+        )
+        _summarizer.start()
+    return _summarizer
+
+
+def get_summarizer() -> Optional[ConversationSummarizer]:
+    s = _summarizer
+    if s is None or not s.running:
+        return None
+    return s
+
+
+async def stop_summarizer() -> None:
+    global _summarizer
+    s = _summarizer
+    _summarizer = None
+    if s is None:
+        return
+    await s.close()
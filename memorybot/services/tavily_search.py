@@ -5,8 +5,11 @@ import logging
 import os
 from typing import Any, Literal, Optional
 
+import httpx
 from pydantic import BaseModel, Field, ValidationError, field_validator
-from tavily import TavilyClient
+
+
+TAVILY_BASE_URL = "https://api.tavily.com"
 
 
 class TavilySearchOptions(BaseModel):
@@ -17,11 +20,32 @@ class TavilySearchOptions(BaseModel):
     def to_kwargs(self) -> dict[str, Any]:
         return self.model_dump(exclude_none=True)
 
+    def to_payload(self) -> dict[str, Any]:
+        data = self.to_kwargs()
+        if data.get("include_answer") == "none":
+            data["include_answer"] = False
+        return data
+
 
 class TavilySearchService:
-    def __init__(self, api_key: Optional[str] = None, *, logger: Optional[logging.Logger] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        *,
+        logger: Optional[logging.Logger] = None,
+        base_url: Optional[str] = None,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 5,
+        keepalive_expiry: float = 30.0,
+    ):
         self._api_key = api_key
-        self._client: Optional[TavilyClient] = None
+        self._base_url = (base_url or TAVILY_BASE_URL).rstrip("/")
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
         self._log = logger or logging.getLogger("memorybot.service.tavily")
 
     def _resolve_api_key(self) -> str:
@@ -30,12 +54,22 @@ class TavilySearchService:
             raise RuntimeError("TAVILY_API_KEY is not configured")
         return key
 
-    def _client_instance(self) -> TavilyClient:
+    def _client_instance(self) -> httpx.AsyncClient:
         if self._client is None:
             key = self._resolve_api_key()
-            self._client = TavilyClient(key)
+            self._client = httpx.AsyncClient(
+                base_url=self._base_url,
+                headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
+                limits=self._limits,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+            )
         return self._client
 
+    async def _post_search(self, client: httpx.AsyncClient, payload: dict[str, Any]) -> Any:
+        resp = await client.post("/search", json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
     async def search(
         self,
         query: str,
@@ -57,15 +91,11 @@ class TavilySearchService:
             except ValidationError as e:
                 raise ValueError(str(e))
 
-        kwargs = opts.to_kwargs()
+        payload = {"query": q, **opts.to_payload()}
         client = self._client_instance()
-        loop = asyncio.get_running_loop()
-
-        def _call() -> dict[str, Any]:
-            return client.search(query=q, **kwargs)
 
         try:
-            raw = await asyncio.wait_for(loop.run_in_executor(None, _call), timeout=timeout)
+            raw = await asyncio.wait_for(self._post_search(client, payload), timeout=timeout)
             if isinstance(raw, dict):
                 ans = raw.get("answer")
             else:
@@ -79,4 +109,7 @@ class TavilySearchService:
             raise
 
     async def aclose(self) -> None:
+        client = self._client
         self._client = None
+        if client is not None:
+            await client.aclose()
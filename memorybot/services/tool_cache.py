@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from memorybot.db.repository import ToolResultRepository
+
+
+def cache_key(name: str, arguments: dict[str, Any]) -> str:
+    return name + ":" + json.dumps(arguments, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+class ToolResultCache:
+    def __init__(
+        self,
+        *,
+        ttl: float = 600.0,
+        max_entries: int = 512,
+        store: Optional[ToolResultRepository] = None,
+        purge_interval: float = 600.0,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._ttl = max(0.0, float(ttl))
+        self._max_entries = max(1, int(max_entries))
+        self._store = store
+        self._purge_interval = max(1.0, float(purge_interval))
+        self._next_purge = 0.0
+        self._entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._log = logger or logging.getLogger("memorybot.service.tool_cache")
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.purged = 0
+
+    def _get_local(self, key: str) -> Optional[dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, payload = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def _put_local(self, key: str, payload: dict[str, Any], ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load_store(self, key: str) -> Optional[dict[str, Any]]:
+        if self._store is None:
+            return None
+        now = time.time()
+        try:
+            raw = await self._store.get(key, now=now)
+        except Exception:
+            self._log.warning("tool cache store read failed", exc_info=True)
+            return None
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    async def _save_store(self, key: str, tool: str, payload: dict[str, Any]) -> None:
+        if self._store is None:
+            return
+        try:
+            await self._store.put(
+                key,
+                tool=tool,
+                payload=json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+                expires_at=time.time() + self._ttl,
+            )
+        except Exception:
+            self._log.warning("tool cache store write failed", exc_info=True)
+            return
+        await self._purge_store()
+
+    async def _purge_store(self) -> None:
+        now = time.time()
+        if self._store is None or now < self._next_purge:
+            return
+        self._next_purge = now + self._purge_interval
+        try:
+            purged = await self._store.purge_expired(now=now)
+        except Exception:
+            self._log.warning("tool cache store purge failed", exc_info=True)
+            return
+        self.purged += purged
+        if purged:
+            self._log.debug("purged %d expired tool results", purged)
+
+    async def _fill(self, key: str, tool: str, compute: Callable[[], Awaitable[dict[str, Any]]]) -> dict[str, Any]:
+        try:
+            stored = await self._load_store(key)
+            if stored is not None:
+                self.store_hits += 1
+                self._put_local(key, stored, self._ttl)
+                return stored
+            self.misses += 1
+            payload = await compute()
+            if payload.get("status") == "ok" and self._ttl > 0:
+                self._put_local(key, payload, self._ttl)
+                await self._save_store(key, tool, payload)
+            return payload
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        tool: str,
+        compute: Callable[[], Awaitable[dict[str, Any]]],
+    ) -> dict[str, Any]:
+        cached = self._get_local(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fill(key, tool, compute))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.store_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "purged": self.purged,
+            "hit_rate": ((lookups - self.misses) / lookups) if lookups else 0.0,
+        }
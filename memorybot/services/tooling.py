@@ -1,45 +1,114 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
+import re
 from typing import Any, Optional
 
 from memorybot.core.config import Settings
+from memorybot.core.metrics import TOOL_CALLS, TOOL_SECONDS
+from memorybot.core.tracing import span
 from memorybot.schemas.llm import ToolUsage
-from memorybot.schemas.tools import TAVILY_TOOL_NAME
+from memorybot.schemas.tools import TAVILY_TOOL_NAME, tavily_tool_defaults, tavily_tool_schema, tavily_tool_instructions
 from memorybot.services.tavily_search import TavilySearchService
+from memorybot.services.tool_cache import ToolResultCache, cache_key
+from memorybot.db.repository import ToolResultRepository
+
+
+_WS_RE = re.compile(r"\s+")
+_TAVILY_DEFAULTS = tavily_tool_defaults()
+
+
+def _metric_label(name: str) -> str:
+    return name if name == TAVILY_TOOL_NAME else "unknown"
+
+
+def _tavily_options(arguments: dict[str, Any]) -> dict[str, Any]:
+    options = dict(_TAVILY_DEFAULTS)
+    for opt in ("include_answer", "search_depth", "max_results"):
+        v = arguments.get(opt)
+        if v is not None:
+            options[opt] = v
+    return options
 
 
 class ToolExecutor:
     def __init__(self, settings: Settings, *, logger: Optional[logging.Logger] = None):
         self._settings = settings
         self._log = logger or logging.getLogger("memorybot.service.tools")
-        self._tavily = TavilySearchService(api_key=settings.tavily_api_key, logger=self._log)
+        self._tavily = TavilySearchService(
+            api_key=settings.tavily_api_key,
+            logger=self._log,
+            base_url=settings.tavily_base_url,
+            max_connections=settings.tavily_max_connections,
+            max_keepalive_connections=settings.tavily_max_keepalive,
+            keepalive_expiry=settings.tavily_keepalive_expiry,
+        )
+        self._cache: Optional[ToolResultCache] = None
+        if settings.tool_cache_enabled:
+            self._cache = ToolResultCache(
+                ttl=settings.tool_cache_ttl,
+                max_entries=settings.tool_cache_max_entries,
+                store=ToolResultRepository() if settings.tool_cache_persist else None,
+                purge_interval=max(settings.tool_cache_ttl, 60.0),
+                logger=self._log,
+            )
+
+    def tool_schemas(self) -> list[dict[str, Any]]:
+        return [tavily_tool_schema()]
+
+    def tool_instructions(self) -> list[str]:
+        return [tavily_tool_instructions()]
+
+    @staticmethod
+    def normalize_arguments(name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+        if name == TAVILY_TOOL_NAME:
+            q = _WS_RE.sub(" ", str(arguments.get("query", ""))).strip().lower()
+            return {"query": q, **_tavily_options(arguments)}
+        return {k: v for k, v in arguments.items() if v is not None}
 
     async def execute(self, tool: ToolUsage) -> dict[str, Any]:
+        with span(f"tool.{_metric_label((tool.name or '').strip())}"):
+            return await self._execute_cached(tool)
+
+    async def _execute_cached(self, tool: ToolUsage) -> dict[str, Any]:
         name = (tool.name or "").strip()
         if not name:
+            TOOL_CALLS.inc(tool="", status="error")
             return {"status": "error", "error": "missing tool name"}
+        args = tool.arguments or {}
+        if self._cache is None:
+            result = await self._execute(name, args)
+        else:
+            key = cache_key(name, self.normalize_arguments(name, args))
+            result = {**await self._cache.get_or_compute(key, name, lambda: self._execute(name, args)), "arguments": args}
+        TOOL_CALLS.inc(tool=_metric_label(name), status=result.get("status", "error"))
+        return result
+
+    async def execute_many(self, tools: list[ToolUsage]) -> list[dict[str, Any]]:
+        return list(await asyncio.gather(*(self.execute(t) for t in tools)))
+
+    async def _execute(self, name: str, args: dict[str, Any]) -> dict[str, Any]:
+        with TOOL_SECONDS.time(tool=_metric_label(name)):
+            return await self._run(name, args)
+
+    async def _run(self, name: str, args: dict[str, Any]) -> dict[str, Any]:
         try:
             if name == TAVILY_TOOL_NAME:
-                args = tool.arguments or {}
                 q = str(args.get("query", "")).strip()
-                include_answer = args.get("include_answer")
-                search_depth = args.get("search_depth")
-                max_results = args.get("max_results")
-                result = await self._tavily.search(
-                    q,
-                    options={
-                        "include_answer": include_answer,
-                        "search_depth": search_depth,
-                        "max_results": max_results,
-                    },
-                )
+                result = await self._tavily.search(q, options=_tavily_options(args))
                 return {"status": "ok", "tool": name, "arguments": args, "result": result}
-            return {"status": "error", "error": f"unknown tool: {name}", "tool": name, "arguments": tool.arguments}
+            return {"status": "error", "error": f"unknown tool: {name}", "tool": name, "arguments": args}
         except Exception as e:
             self._log.error("tool execution failed", exc_info=e)
-            return {"status": "error", "error": str(e), "tool": name, "arguments": tool.arguments}
+            return {"status": "error", "error": str(e), "tool": name, "arguments": args}
+
+    def cache_stats(self) -> dict[str, Any] | None:
+        return self._cache.stats() if self._cache is not None else None
+
+    async def aclose(self) -> None:
+        await self._tavily.aclose()
 
     @staticmethod
     def serialize_result(payload: dict[str, Any]) -> str:
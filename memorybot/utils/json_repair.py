@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Optional
+
+from jiter import from_json
+
+
+_FENCE = re.compile(r"```[a-zA-Z0-9_-]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+
+
+def extract_json_object(text: str) -> Optional[str]:
+    fenced = _FENCE.search(text)
+    if fenced is not None and "{" in fenced.group(1):
+        text = fenced.group(1)
+    start = text.find("{")
+    if start < 0:
+        return None
+    out: list[str] = []
+    depth = 0
+    in_string = False
+    escaped = False
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            i = len(out) - 1
+            while i >= 0 and out[i].isspace():
+                i -= 1
+            if i >= 0 and out[i] == ",":
+                del out[i]
+            depth -= 1
+        out.append(ch)
+        if depth == 0:
+            break
+    return "".join(out)
+
+
+def repair_json(text: str, *, partial: bool = False) -> Any:
+    candidate = extract_json_object(text)
+    if candidate is None:
+        return None
+    if partial:
+        candidate = candidate.rstrip()
+        while candidate.endswith(","):
+            candidate = candidate[:-1].rstrip()
+    try:
+        return from_json(candidate.encode("utf-8"), partial_mode="trailing-strings" if partial else "off")
+    except ValueError:
+        return None
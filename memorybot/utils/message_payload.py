@@ -72,8 +72,8 @@ def build_server_info(guild: Optional[discord.Guild]) -> Dict[str, Any]:
     }
 
 
-def build_message_json(message: discord.Message, cleaned_content: str) -> str:
-    payload: Dict[str, Any] = {
+def build_message_payload(message: discord.Message, cleaned_content: str) -> Dict[str, Any]:
+    return {
         "message": {
             "id": message.id,
             "created_at": _iso(message.created_at),
@@ -83,4 +83,7 @@ def build_message_json(message: discord.Message, cleaned_content: str) -> str:
         "author": _user_info(message.author),
         "channel": _channel_info(message.channel),
     }
-    return json.dumps(payload, indent=2, ensure_ascii=False)
+
+
+def build_message_json(message: discord.Message, cleaned_content: str) -> str:
+    return json.dumps(build_message_payload(message, cleaned_content), ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+import discord
+
+
+class ProgressiveReply:
+    def __init__(
+        self,
+        target: discord.Message,
+        *,
+        min_interval: float = 1.2,
+        min_growth: int = 32,
+        limit: int = 2000,
+    ):
+        self._target = target
+        self._min_interval = max(0.0, float(min_interval))
+        self._min_growth = max(1, int(min_growth))
+        self._limit = limit
+        self._sent: Optional[discord.Message] = None
+        self._pending = ""
+        self._shown = ""
+        self._last_push = 0.0
+        self._final = False
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._log = logging.getLogger("memorybot.utils.progressive_reply")
+
+    @property
+    def message(self) -> Optional[discord.Message]:
+        return self._sent
+
+    def update(self, text: str) -> None:
+        if self._final:
+            return
+        self._pending = text[: self._limit]
+        if self._sent is not None and len(self._pending) - len(self._shown) < self._min_growth:
+            return
+        self._ensure_pump()
+
+    async def finish(self, text: str) -> Optional[discord.Message]:
+        self._final = True
+        self._pending = text[: self._limit]
+        self._wake.set()
+        self._ensure_pump()
+        task = self._task
+        if task is not None:
+            await task
+        if self._pending != self._shown:
+            await self._push(self._pending)
+        return self._sent
+
+    def _ensure_pump(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending and self._pending != self._shown:
+            if self._sent is not None and not self._final:
+                delay = self._min_interval - (loop.time() - self._last_push)
+                if delay > 0:
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            try:
+                await self._push(self._pending)
+            except Exception:
+                self._log.warning("progressive reply update failed", exc_info=True)
+                return
+
+    async def _push(self, text: str) -> None:
+        if self._sent is None:
+            self._sent = await self._target.reply(text, mention_author=False)
+        elif text != self._shown:
+            await self._sent.edit(content=text)
+        self._shown = text
+        self._last_push = asyncio.get_running_loop().time()
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+
+from memorybot.core.tracing import span
+
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    def __init__(self, observer: Optional[Callable[[str, float], None]] = None) -> None:
+        self._start = time.perf_counter()
+        self._observer = observer
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed * 1000
+            if self._observer is not None:
+                self._observer(name, elapsed)
+
+    async def timed(self, name: str, aw: Awaitable[T]) -> T:
+        with self.stage(name):
+            return await aw
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def summary(self) -> str:
+        parts = [f"{name}={ms:.1f}ms" for name, ms in self.stages.items()]
+        parts.append(f"total={self.total_ms:.1f}ms")
+        return " ".join(parts)